@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+"""
+Bulk throughput over 1 to N local fake elastic search nodes, with and
+without gzip compressed bodies. Each node handles one request at a time
+at `--node_mbps`, like a node saturating its network link, so throughput
+only grows when requests are balanced over more nodes (or get smaller).
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import argparse
+import threading
+
+from collections import Counter
+from http.server import ThreadingHTTPServer
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "indexing"))
+from es.bulk_sink import BulkSink  # noqa: E402
+from es.es_connector import get_connection  # noqa: E402
+from synthetic_cord import SyntheticRelease  # noqa: E402
+from bench_pipeline import BulkHandler  # noqa: E402
+
+
+class NodeHandler(BulkHandler):
+    """ `BulkHandler` behind a link of `server.bytes_per_second` """
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        with self.server.link:
+            time.sleep(len(body) / self.server.bytes_per_second)
+        wire_bytes = len(body)
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+
+        items = []
+        for line in body.splitlines()[::2]:
+            op, meta = next(iter(json.loads(line).items()))
+            items.append({op: {"_index": meta["_index"], "status": 201}})
+        with self.server.lock:
+            self.server.stats.update(
+                requests=1, docs=len(items), bytes=wire_bytes
+            )
+        self.reply({"took": 1, "errors": False, "items": items})
+
+    do_PUT = do_POST
+
+
+def start_node(mbps):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), NodeHandler)
+    server.daemon_threads = True
+    server.bytes_per_second = mbps * 2 ** 20
+    server.link = threading.Lock()
+    server.lock = threading.Lock()
+    server.stats = Counter()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_actions(docs, seed=0):
+    release = SyntheticRelease(seed=seed)
+    return [
+        {
+            "_index": "paragraphs",
+            "_source": json.dumps(dict(
+                cord_uid=release.uid(),
+                paragraph_id=i,
+                title=release.text(5, 20),
+                body=release.text(50, 200),
+            )),
+        }
+        for i in range(docs)
+    ]
+
+
+def bench(actions, nodes, compress, mbps, batch_size, bulk_threads):
+    servers = [start_node(mbps) for _ in range(nodes)]
+    hosts = ",".join(
+        f"127.0.0.1:{server.server_address[1]}" for server in servers
+    )
+    es = get_connection(hosts, pool_size=bulk_threads, compress=compress)
+    start = time.perf_counter()
+    with BulkSink(es, max_docs=batch_size, threads=bulk_threads) as sink:
+        sink.extend(actions)
+    secs = time.perf_counter() - start
+    for server in servers:
+        server.shutdown()
+
+    return dict(
+        seconds=round(secs, 3),
+        docs_per_second=round(len(actions) / secs, 1),
+        wire_mb=round(
+            sum(server.stats["bytes"] for server in servers) / 2 ** 20, 2
+        ),
+        requests_per_node=[server.stats["requests"] for server in servers],
+    )
+
+
+def main(docs, max_nodes, node_mbps, batch_size, bulk_threads, output):
+    actions = make_actions(docs)
+    results = {}
+    nodes = 1
+    while nodes <= max_nodes:
+        for compress in (False, True):
+            name = f"nodes={nodes},gzip={str(compress).lower()}"
+            results[name] = bench(
+                actions, nodes, compress, node_mbps, batch_size, bulk_threads
+            )
+            print(f"{name}: {json.dumps(results[name])}")
+        nodes *= 2
+
+    if output is not None:
+        with open(output, "w") as fout:
+            json.dump(results, fout, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-n", "--docs", type=int, default=20000,
+        help="Number of documents sent"
+    )
+    parser.add_argument(
+        "--max_nodes", type=int, default=4,
+        help="Largest number of nodes (runs with 1, 2, 4... nodes)"
+    )
+    parser.add_argument(
+        "--node_mbps", type=float, default=5,
+        help="MB per second each node receives"
+    )
+    parser.add_argument(
+        "-bs", "--batch_size", type=int, default=500,
+        help="Maximum number of documents per bulk request"
+    )
+    parser.add_argument(
+        "--bulk_threads", type=int, default=8,
+        help="Number of bulk requests sent concurrently"
+    )
+    parser.add_argument(
+        "--output", type=str, default=None,
+        help="Also write the results to this json file"
+    )
+    main(**vars(parser.parse_args()))
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+"""
+Download a random file from a local HTTP server standing in for the S3
+bucket (range requests, md5 etag, bandwidth limited connections): checks
+the ranged downloader resumes an interrupted download, replaces a truncated
+file and produces the same bytes, and compares it with a single stream.
+"""
+import os
+import sys
+import time
+import random
+import hashlib
+import argparse
+import tempfile
+import threading
+
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from downloader import download, state_path  # noqa: E402
+
+
+class Handler(BaseHTTPRequestHandler):
+    # set on the server: data, etag, rate (bytes/s per connection),
+    # fail_after (requests served before failing every request), served
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def headers_for(self, length):
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", f'"{self.server.etag}"')
+        self.end_headers()
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.headers_for(len(self.server.data))
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.served += 1
+            failing = server.fail_after is not None and \
+                server.served > server.fail_after
+
+        data = server.data
+        start, end = 0, len(data) - 1
+        if "Range" in self.headers:
+            first, last = self.headers["Range"].split("=")[1].split("-")
+            start, end = int(first), min(int(last), end)
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{end}/{len(data)}"
+            )
+        else:
+            self.send_response(200)
+        self.headers_for(end - start + 1)
+
+        if failing:
+            # drop the connection half way
+            end = start + (end - start) // 2
+        block = 64 * 1024
+        for offset in range(start, end + 1, block):
+            chunk = data[offset:min(offset + block, end + 1)]
+            self.wfile.write(chunk)
+            with server.lock:
+                server.sent += len(chunk)
+            if server.rate:
+                time.sleep(len(chunk) / server.rate)
+        if failing:
+            self.close_connection = True
+            self.connection.close()
+
+
+def start_server(data, rate=None, fail_after=None, port=0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    server.data = data
+    server.etag = hashlib.md5(data).hexdigest()
+    server.rate = rate
+    server.fail_after = fail_after
+    server.served = 0
+    server.sent = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def url_of(server):
+    return f"http://127.0.0.1:{server.server_address[1]}/cord-19_test.tar.gz"
+
+
+def timed_download(server, save_dir, threads, part_mb):
+    start = time.perf_counter()
+    path = download(
+        url_of(server), save_dir, threads=threads, part_mb=part_mb, retries=0
+    )
+    return path, time.perf_counter() - start
+
+
+def main(size_mb, part_mb, threads, rate_mb):
+    data = random.Random(0).randbytes(size_mb * 1024 * 1024)
+    rate = rate_mb * 1024 * 1024
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+
+        # interrupted after a few parts, then resumed
+        server = start_server(data, fail_after=threads)
+        try:
+            timed_download(server, tmp_dir, threads, part_mb)
+            raise RuntimeError("download should have failed")
+        except Exception as e:
+            print(f"Interrupted download: {type(e).__name__}")
+        server.shutdown()
+        server.server_close()
+        part_path = tmp_dir.joinpath("cord-19_test.tar.gz.part")
+        if not state_path(part_path).exists():
+            raise RuntimeError("no download state left to resume from")
+
+        # same url, the state only applies to it
+        server = start_server(data, port=server.server_address[1])
+        path, _ = timed_download(server, tmp_dir, threads, part_mb)
+        server.shutdown()
+        if path.read_bytes() != data:
+            raise RuntimeError("resumed download differs from the source")
+        if state_path(part_path).exists() or part_path.exists():
+            raise RuntimeError("download state not cleaned up")
+        print(
+            f"Resumed download fetched {server.sent / len(data):.0%} "
+            "of the file, same bytes"
+        )
+
+        # a truncated file is not accepted
+        with open(path, "r+b") as fout:
+            fout.truncate(len(data) // 3)
+        server = start_server(data)
+        path, _ = timed_download(server, tmp_dir, threads, part_mb)
+        server.shutdown()
+        if path.read_bytes() != data:
+            raise RuntimeError("truncated file was not downloaded again")
+        print("Truncated file downloaded again, same bytes")
+
+        # bandwidth limited connections, single stream vs ranged
+        times = {}
+        for n in (1, threads):
+            path.unlink()
+            server = start_server(data, rate=rate)
+            parts = size_mb if n == 1 else part_mb
+            _, times[n] = timed_download(server, tmp_dir, n, parts)
+            server.shutdown()
+            if path.read_bytes() != data:
+                raise RuntimeError(f"download with {n} threads differs")
+
+    print(f"{size_mb}MB at {rate_mb}MB/s per connection")
+    print(f"single stream      {times[1]:8.3f}s")
+    print(f"{threads} range requests  {times[threads]:8.3f}s")
+    print(f"speedup: {times[1] / times[threads]:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-s", "--size_mb", type=int, default=64,
+        help="Size of the served file"
+    )
+    parser.add_argument(
+        "--part_mb", type=int, default=4,
+        help="Size of each range request"
+    )
+    parser.add_argument(
+        "-t", "--threads", type=int, default=8,
+        help="Concurrent range requests"
+    )
+    parser.add_argument(
+        "--rate_mb", type=int, default=32,
+        help="Bandwidth of each connection, in MB/s"
+    )
+    main(**vars(parser.parse_args()))
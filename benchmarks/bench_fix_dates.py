@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Compare the per-row `fix_date` apply against the column-wise
+`CSVProcessor.fix_dates`, checking both produce the same csv.
+"""
+import io
+import os
+import sys
+import time
+import random
+import argparse
+import pandas as pd
+
+from datetime import date, timedelta
+
+sys.path.append(
+    os.path.join(os.path.dirname(__file__), "..", "indexing", "preprocessing")
+)
+from CSVProcessor import CSVProcessor  # noqa: E402
+
+
+# publish_time formats found in cord19 releases
+SAMPLE_DATES = [
+    "2020-03-15",
+    "2020-12-31",
+    "2019",
+    "2020",
+    "2020 Mar",
+    "2020 Mar 15",
+    "2019 Dec 1",
+    "2020 Spring",
+    "2020 Summer",
+    "2020 Autumn",
+    "2020 Fall",
+    "2020 Winter",
+    "2020 Jan-Feb",
+    "2021 Nov-Dec",
+    "['2020-01-02', '2020-02-01']",
+    "['2021-05-17']",
+    float("nan"),
+]
+
+
+def legacy_fix_dates(df, csv_processor):
+    return df.apply(
+        lambda row: csv_processor.fix_date(row['publish_time']),
+        axis=1
+    )
+
+
+def synthetic_metadata(rows, seed=0):
+    # a few thousand distinct daily dates plus the odd formats
+    rng = random.Random(seed)
+    start = date(2019, 1, 1)
+    daily = [
+        (start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(1500)
+    ]
+    values = [
+        rng.choice(SAMPLE_DATES) if rng.random() < 0.2 else rng.choice(daily)
+        for _ in range(rows)
+    ]
+    return pd.DataFrame({
+        "cord_uid": [f"uid{i}" for i in range(rows)],
+        "publish_time": values,
+    })
+
+
+def to_csv(df):
+    out = io.StringIO()
+    df.to_csv(out, index=False)
+    return out.getvalue()
+
+
+def timed(func):
+    start = time.perf_counter()
+    ret = func()
+    return ret, time.perf_counter() - start
+
+
+def main(metadata, rows):
+    if metadata is not None:
+        df = pd.read_csv(metadata)
+    else:
+        df = synthetic_metadata(rows)
+
+    csv_processor = CSVProcessor()
+    legacy, legacy_secs = timed(lambda: legacy_fix_dates(df, csv_processor))
+    fixed, fixed_secs = timed(
+        lambda: csv_processor.fix_dates(df["publish_time"])
+    )
+    if to_csv(df.assign(publish_time=legacy)) != \
+            to_csv(df.assign(publish_time=fixed)):
+        raise RuntimeError("fix_dates output differs from per-row fix_date!")
+
+    print(
+        f"{len(df)} rows, {df['publish_time'].nunique(dropna=False)} "
+        "distinct publish_time values, same output"
+    )
+    print(f"per-row apply      {legacy_secs:8.3f}s")
+    print(f"column fix_dates   {fixed_secs:8.3f}s")
+    print(f"speedup: {legacy_secs / fixed_secs:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-m", "--metadata", type=str, default=None,
+        help="Use the publish_time values of a real metadata.csv"
+    )
+    parser.add_argument(
+        "-n", "--rows", type=int, default=200000,
+        help="Number of synthetic rows"
+    )
+    main(**vars(parser.parse_args()))
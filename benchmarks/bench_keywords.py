@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of keyword filtering: the previous per-keyword
+`filter_by_kwords` against the precompiled `KeywordMatcher`.
+"""
+import os
+import sys
+import json
+import random
+import timeit
+import argparse
+
+from pathlib import Path
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "indexing"))
+from preprocessing.keywords import KEYWORDS, KeywordMatcher  # noqa: E402
+
+
+def legacy_filter_by_kwords(title="", abstract="", text=""):
+    ret = False
+    for kw in KEYWORDS:
+        if kw in title.lower() or kw in abstract.lower() or kw in text.lower():
+            ret = True
+            break
+
+    return ret
+
+
+def synthetic_paragraphs(count, seed=0):
+    # paragraphs of CORD-19 parses are ~100-200 words long, about one in
+    # ten mentions one of the keywords
+    rng = random.Random(seed)
+    words = (
+        "the of and in to a with patients were was for infection virus "
+        "respiratory cells protein viral disease clinical study results "
+        "coronavirus analysis data acute syndrome severe treatment"
+    ).split()
+    paragraphs = []
+    for _ in range(count):
+        text = [rng.choice(words) for _ in range(rng.randint(100, 200))]
+        if rng.random() < 0.1:
+            text.insert(rng.randrange(len(text)), rng.choice(KEYWORDS))
+        paragraphs.append(" ".join(text).capitalize() + ".")
+
+    return paragraphs
+
+
+def real_paragraphs(data_dir, count):
+    paragraphs = []
+    for json_path in Path(data_dir).glob("document_parses/*/*.json"):
+        body_text = json.load(open(json_path, "r"))["body_text"]
+        paragraphs.extend(part["text"].strip() for part in body_text)
+        if len(paragraphs) >= count:
+            break
+
+    return [pa for pa in paragraphs[:count] if pa != ""]
+
+
+def main(data_dir, count, repeat):
+    if data_dir is not None:
+        paragraphs = real_paragraphs(data_dir, count)
+    else:
+        paragraphs = synthetic_paragraphs(count)
+
+    matcher = KeywordMatcher()
+    legacy = [legacy_filter_by_kwords(text=pa) for pa in paragraphs]
+    compiled = [matcher.search(pa) for pa in paragraphs]
+    if legacy != compiled:
+        raise RuntimeError("KeywordMatcher disagrees with filter_by_kwords!")
+
+    avg_len = sum(len(pa) for pa in paragraphs) / max(len(paragraphs), 1)
+    print(
+        f"{len(paragraphs)} paragraphs, {avg_len:.0f} chars on average, "
+        f"{sum(legacy)} with keywords"
+    )
+    results = {}
+    for name, func in [
+        ("filter_by_kwords (legacy)", legacy_filter_by_kwords),
+        ("KeywordMatcher.search", lambda text: matcher.search(text)),
+        ("KeywordMatcher.findall", lambda text: matcher.findall(text)),
+    ]:
+        secs = min(timeit.repeat(
+            lambda: [func(text=pa) for pa in paragraphs],
+            number=1, repeat=repeat
+        ))
+        results[name] = secs
+        print(f"{name:<28}{secs * 1e6 / len(paragraphs):>8.2f} us/paragraph")
+
+    base = results["filter_by_kwords (legacy)"]
+    print(f"speedup: {base / results['KeywordMatcher.search']:.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-d", "--data_dir", type=str, default=None,
+        help="Sample paragraphs from a cord19 release instead of synthetic"
+    )
+    parser.add_argument(
+        "-n", "--count", type=int, default=5000,
+        help="Number of paragraphs to benchmark"
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=5,
+        help="Timing repetitions (best is reported)"
+    )
+    main(**vars(parser.parse_args()))
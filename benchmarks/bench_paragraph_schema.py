@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+"""
+Index size and ingest time of the full (paper fields copied into every
+paragraph) and slim (`--slim_paragraphs`) paragraph schemas.
+
+When a cluster is reachable (by default the `docker-compose.yml`
+container, on port 9201), each schema is indexed into
+`bench-<schema>-<index>` indices of it, force merged and their store size
+(`_stats/store`) reported, then deleted unless `--keep`. Otherwise, or
+with `--fake`, documents go to a local fake bulk endpoint and only the
+ingest time and the bulk payload of each index are reported.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+from pathlib import Path
+from collections import Counter
+from elasticsearch import Elasticsearch
+from elasticsearch_dsl import connections
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "indexing"))
+import process_cord  # noqa: E402
+from es.bulk_sink import BulkSink  # noqa: E402
+from es.indexing import init_index, index_names  # noqa: E402
+from es.es_connector import get_connection  # noqa: E402
+from synthetic_cord import SyntheticRelease, release_dir  # noqa: E402
+from bench_pipeline import BulkHandler, start_bulk_server  # noqa: E402
+
+
+SCHEMAS = {"full": False, "slim": True}
+
+
+class IndexBytesHandler(BulkHandler):
+    """ Like `BulkHandler`, also adds up the bytes sent to each index """
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        lines = body.splitlines()
+        items = []
+        index_bytes = Counter()
+        for action, source in zip(lines[::2], lines[1::2]):
+            op, meta = next(iter(json.loads(action).items()))
+            items.append({op: {"_index": meta["_index"], "status": 201}})
+            index_bytes[meta["_index"]] += len(action) + len(source) + 2
+
+        with self.server.lock:
+            self.server.stats.update(
+                requests=1, docs=len(items), bytes=len(body)
+            )
+            self.server.index_bytes.update(index_bytes)
+        self.reply({"took": 1, "errors": False, "items": items})
+
+    do_PUT = do_POST
+
+
+def bench_fake(data_dir, incl_abs, slim, batch_size, workers):
+    server = start_bulk_server()
+    server.RequestHandlerClass = IndexBytesHandler
+    server.index_bytes = Counter()
+    es = Elasticsearch(f"http://127.0.0.1:{server.server_address[1]}")
+    start = time.perf_counter()
+    with BulkSink(es, max_docs=batch_size) as sink:
+        process_cord.process_metadata(
+            sink, str(data_dir), data_dir.joinpath("metadata.csv"),
+            incl_abs, workers, slim=slim
+        )
+    secs = time.perf_counter() - start
+    server.shutdown()
+    return dict(
+        ingest_seconds=round(secs, 3),
+        docs=server.stats["docs"],
+        payload_mb={
+            index: round(size / 2 ** 20, 2)
+            for index, size in sorted(server.index_bytes.items())
+        },
+    )
+
+
+def bench_cluster(data_dir, incl_abs, slim, batch_size, workers, keep):
+    es = connections.get_connection()
+    schema = "slim" if slim else "full"
+    names = {
+        name: f"bench-{schema}-{name}"
+        for name in index_names(incl_abs).keys()
+    }
+    for name in names.values():
+        es.indices.delete(index=name, ignore_unavailable=True)
+    init_index(incl_abs, names=names, slim=slim)
+
+    start = time.perf_counter()
+    with BulkSink(es, max_docs=batch_size, index_names=names) as sink:
+        process_cord.process_metadata(
+            sink, str(data_dir), data_dir.joinpath("metadata.csv"),
+            incl_abs, workers, names=names, slim=slim
+        )
+    es.indices.refresh(index=list(names.values()))
+    secs = time.perf_counter() - start
+
+    store_mb, docs = {}, 0
+    for alias, name in names.items():
+        es.options(request_timeout=3600).indices.forcemerge(
+            index=name, max_num_segments=1
+        )
+        stats = es.indices.stats(index=name, metric="store,docs")
+        primaries = stats["indices"][name]["primaries"]
+        store_mb[alias] = round(
+            primaries["store"]["size_in_bytes"] / 2 ** 20, 2
+        )
+        docs += primaries["docs"]["count"]
+        if not keep:
+            es.indices.delete(index=name)
+
+    return dict(ingest_seconds=round(secs, 3), docs=docs, store_mb=store_mb)
+
+
+def cluster_reachable(address, port):
+    es = get_connection(address, port)
+    try:
+        return es.ping()
+    except Exception:
+        return False
+
+
+def report(results):
+    full, slim = results["full"], results["slim"]
+    for schema, res in results.items():
+        print(f"{schema}: {json.dumps(res)}")
+
+    print(
+        f"ingest time: {full['ingest_seconds']}s -> {slim['ingest_seconds']}s"
+        f" ({slim['ingest_seconds'] / full['ingest_seconds']:.2f}x)"
+    )
+    for key in ("payload_mb", "store_mb"):
+        if key not in full:
+            continue
+        before = full[key]["paragraphs"]
+        after = slim[key]["paragraphs"]
+        print(
+            f"paragraphs {key}: {before} -> {after} "
+            f"({after / before:.2f}x), all indices: "
+            f"{sum(full[key].values()):.2f} -> {sum(slim[key].values()):.2f}"
+        )
+
+
+def main(
+    data_dir, out_dir, papers, seed, incl_abs, address, port, fake,
+    batch_size, workers, keep, output
+):
+    tmp_dir = None
+    if data_dir is None:
+        if out_dir is None:
+            tmp_dir = tempfile.TemporaryDirectory()
+            out_dir = tmp_dir.name
+        data_dir = release_dir(out_dir)
+        if not data_dir.joinpath("metadata.csv").exists():
+            print(f"Writing a synthetic release of {papers} papers")
+            SyntheticRelease(papers=papers, seed=seed).write(data_dir)
+    data_dir = Path(data_dir)
+
+    if not fake and not cluster_reachable(address, port):
+        print(
+            f"No cluster at {address}:{port}, using a fake bulk endpoint "
+            "(no store size)"
+        )
+        fake = True
+
+    results = {}
+    for schema, slim in SCHEMAS.items():
+        print(f"Indexing the {schema} paragraph schema")
+        if fake:
+            results[schema] = bench_fake(
+                data_dir, incl_abs, slim, batch_size, workers
+            )
+        else:
+            results[schema] = bench_cluster(
+                data_dir, incl_abs, slim, batch_size, workers, keep
+            )
+
+    report(results)
+    if output is not None:
+        Path(output).write_text(json.dumps(dict(
+            results, incl_abs=incl_abs, data_dir=str(data_dir)
+        ), indent=2))
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-d", "--data_dir", type=str, default=None,
+        help="Index this release instead of a synthetic one"
+    )
+    parser.add_argument(
+        "-o", "--out_dir", type=str, default=None,
+        help="Keep the synthetic release here, reused if it exists "
+        "(default: a temporary directory)"
+    )
+    parser.add_argument(
+        "-n", "--papers", type=int, default=2000,
+        help="Number of synthetic papers"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0,
+        help="Random seed of the synthetic release"
+    )
+    parser.add_argument(
+        "-i", "--incl_abs", action="store_true",
+        help="Compare the with-abstract indices"
+    )
+    parser.add_argument(
+        "-a", "--address", type=str, default="localhost",
+        help="Elastic search address"
+    )
+    parser.add_argument(
+        "-p", "--port", type=int, default=9201,
+        help="Elastic search port (9201 is the docker-compose container)"
+    )
+    parser.add_argument(
+        "--fake", action="store_true",
+        help="Use a fake bulk endpoint even if the cluster is reachable"
+    )
+    parser.add_argument(
+        "-bs", "--batch_size", type=int, default=500,
+        help="Maximum number of documents per bulk request"
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=1,
+        help="Number of processes used to parse papers"
+    )
+    parser.add_argument(
+        "--keep", action="store_true",
+        help="Do not delete the benchmark indices"
+    )
+    parser.add_argument(
+        "--output", type=str, default=None,
+        help="Also write the results to this json file"
+    )
+    main(**vars(parser.parse_args()))
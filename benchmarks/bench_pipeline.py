@@ -0,0 +1,463 @@
+#!/usr/bin/env python
+"""
+Benchmark suite of the indexing pipeline over a synthetic release (see
+`synthetic_cord.py`): fix_date, filter_by_kwords, process_paper_body,
+parsing without and through the parse cache, deduplication, serialization
+and end-to-end process_metadata (threaded and asyncio) against a local
+fake bulk endpoint.
+Results are saved as json and compared with the previous run.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+import pandas as pd
+
+from pathlib import Path
+from collections import Counter
+from elasticsearch import Elasticsearch, AsyncElasticsearch
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "indexing"))
+import process_cord  # noqa: E402
+from es.bulk_sink import BulkSink  # noqa: E402
+from es.async_sink import AsyncBulkSink  # noqa: E402
+from parse_cache import ParseCache  # noqa: E402
+from preprocessing.CSVProcessor import CSVProcessor  # noqa: E402
+from preprocessing.metadata_reader import MetadataReader  # noqa: E402
+from synthetic_cord import SyntheticRelease, release_dir  # noqa: E402
+
+
+RESULTS_DIR = Path(__file__).parent.joinpath("results")
+
+
+class BulkHandler(BaseHTTPRequestHandler):
+    """ Acknowledges every document of a bulk request, like a fast cluster """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, body):
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.reply({"version": {"number": "8.0.0"}, "tagline": "fake"})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        lines = body.splitlines()
+        # action and source lines alternate
+        items = []
+        for line in lines[::2]:
+            op, meta = next(iter(json.loads(line).items()))
+            items.append({op: {"_index": meta["_index"], "status": 201}})
+
+        with self.server.lock:
+            self.server.stats.update(
+                requests=1, docs=len(items), bytes=len(body)
+            )
+        self.reply({"took": 1, "errors": False, "items": items})
+
+    # depending on the client version
+    do_PUT = do_POST
+
+
+def start_bulk_server(latency=0):
+    # `latency` seconds per bulk request, like a remote cluster
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BulkHandler)
+    server.latency = latency
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.stats = Counter()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def timed(func, repeat=3):
+    # best of `repeat` runs
+    best, ret = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ret = func()
+        secs = time.perf_counter() - start
+        best = secs if best is None else min(best, secs)
+    return best, ret
+
+
+def result(secs, items, unit, **extra):
+    return dict(
+        seconds=round(secs, 6),
+        items=items,
+        unit=unit,
+        per_second=round(items / secs, 2) if secs else None,
+        **extra
+    )
+
+
+def load_release(data_dir):
+    meta_path = data_dir.joinpath("metadata.csv")
+    groups = list(MetadataReader(meta_path))
+    parses = {}
+    for rows in groups:
+        for row in rows:
+            for json_file, json_data in process_cord.iter_json_files(
+                data_dir, row
+            ):
+                parses[json_file] = json_data
+    return meta_path, groups, parses
+
+
+def bench_fix_date(meta_path, repeat):
+    dates = pd.read_csv(meta_path, usecols=["publish_time"], dtype=str)
+    dates = dates["publish_time"]
+    csv_processor = CSVProcessor()
+    row_secs, _ = timed(
+        lambda: [csv_processor.fix_date(date) for date in dates], repeat
+    )
+    column_secs, _ = timed(lambda: csv_processor.fix_dates(dates), repeat)
+    return {
+        "fix_date": result(row_secs, len(dates), "dates"),
+        "fix_dates": result(column_secs, len(dates), "dates"),
+    }
+
+
+def bench_filter_by_kwords(groups, parses, repeat):
+    rows = [row for rows in groups for row in rows]
+    paragraphs = [
+        part["text"]
+        for json_data in parses.values()
+        for part in json.loads(json_data)["body_text"]
+    ]
+
+    def run():
+        matches = sum(process_cord.filter_by_kwords(row=row) for row in rows)
+        return matches + sum(
+            process_cord.filter_by_kwords(text=text) for text in paragraphs
+        )
+
+    secs, matches = timed(run, repeat)
+    return {"filter_by_kwords": result(
+        secs, len(rows) + len(paragraphs), "texts", matches=matches
+    )}
+
+
+def bench_process_paper_body(groups, parses, incl_abs, repeat):
+    pairs = [
+        (row, parses[json_file])
+        for rows in groups
+        for row in rows
+        for json_file in process_cord.get_json_files(row)
+        if json_file in parses
+    ]
+
+    def run():
+        return sum(
+            len(process_cord.process_paper_body(row, data, incl_abs)[1])
+            for row, data in pairs
+        )
+
+    secs, paragraphs = timed(run, repeat)
+    size = sum(len(data) for _, data in pairs)
+    return {"process_paper_body": result(
+        secs, len(pairs), "files", mb=round(size / 2 ** 20, 2),
+        paragraphs=paragraphs
+    )}
+
+
+def bench_parse_cache(data_dir, groups):
+    # parsing every json file without cache, filling it and reading it
+    rows = [row for rows in groups for row in rows]
+
+    def run():
+        return sum(
+            len(parts)
+            for row in rows
+            for _, parts in process_cord.iter_body_parts(data_dir, row)
+        )
+
+    results = {}
+    secs, paragraphs = timed(run, 1)
+    results["parse[no_cache]"] = result(
+        secs, len(rows), "rows", paragraphs=paragraphs
+    )
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for name in ("parse[cache_miss]", "parse[cache_hit]"):
+            process_cord.parse_cache = ParseCache(
+                cache_dir, process_cord.kword_matcher.keywords
+            )
+            start = time.perf_counter()
+            paragraphs = run()
+            process_cord.parse_cache.save()
+            secs = time.perf_counter() - start
+            results[name] = result(
+                secs, len(rows), "rows", paragraphs=paragraphs
+            )
+        process_cord.parse_cache = None
+    return results
+
+
+def bench_deduplicate(data_dir, groups, parses, incl_abs, repeat):
+    duplicated = [rows for rows in groups if len(rows) > 1]
+
+    def run():
+        return [
+            process_cord.process_group(data_dir, incl_abs, rows, parses)
+            for rows in duplicated
+        ]
+
+    secs, _ = timed(run, repeat)
+    return {"deduplicate": result(
+        secs, len(duplicated), "groups",
+        rows=sum(len(rows) for rows in duplicated)
+    )}
+
+
+def bench_serialization(data_dir, groups, parses, incl_abs, repeat):
+    docs = []
+    for rows in groups:
+        final_row = process_cord.process_group(
+            data_dir, incl_abs, rows, parses
+        )
+        for value in final_row.values():
+            docs.extend(value)
+
+    secs, actions = timed(
+        lambda: [process_cord.to_action(doc) for doc in docs], repeat
+    )
+    size = sum(len(action["_source"]) for action in actions)
+    return {"serialization": result(
+        secs, len(docs), "docs", mb=round(size / 2 ** 20, 2)
+    )}
+
+
+def bench_end_to_end(
+    data_dir, meta_path, incl_abs, batch_sizes, workers, bulk_threads,
+    latency=0, readers=8
+):
+    # threaded and asyncio ingestion
+    results = {}
+    for batch_size, is_async in (
+        (batch_size, is_async)
+        for batch_size in batch_sizes for is_async in (False, True)
+    ):
+        server = start_bulk_server(latency)
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        start = time.perf_counter()
+        if is_async:
+            sink = AsyncBulkSink(
+                AsyncElasticsearch(url), max_docs=batch_size,
+                threads=bulk_threads
+            )
+            process_cord.process_metadata(
+                sink, str(data_dir), meta_path, incl_abs, workers,
+                readers=readers
+            )
+        else:
+            sink = BulkSink(
+                Elasticsearch(url), max_docs=batch_size, threads=bulk_threads
+            )
+            with sink:
+                process_cord.process_metadata(
+                    sink, str(data_dir), meta_path, incl_abs, workers
+                )
+        secs = time.perf_counter() - start
+        server.shutdown()
+        name = "end_to_end_async" if is_async else "end_to_end"
+        results[f"{name}[bs={batch_size}]"] = result(
+            secs, server.stats["docs"], "docs",
+            requests=server.stats["requests"],
+            mb=round(server.stats["bytes"] / 2 ** 20, 2),
+        )
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(__file__), stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_results(results_dir, compare=None):
+    if compare is not None:
+        return json.loads(Path(compare).read_text())
+    runs = sorted(Path(results_dir).glob("bench_pipeline-*.json"))
+    return json.loads(runs[-1].read_text()) if len(runs) else None
+
+
+def report(results, previous=None, threshold=0.1):
+    previous = (previous or {}).get("results", {})
+    regressions = []
+    for name, res in results.items():
+        line = (
+            f"{name:28s} {res['seconds']:9.3f}s "
+            f"{res['per_second'] or 0:12.1f} {res['unit']}/s"
+        )
+        old = previous.get(name)
+        if old is not None and old.get("seconds"):
+            change = res["seconds"] / old["seconds"] - 1
+            line += f"  {change:+7.1%} vs previous"
+            if change > threshold:
+                regressions.append(name)
+                line += "  REGRESSION"
+        print(line)
+    return regressions
+
+
+def main(
+    data_dir, out_dir, papers, seed, incl_abs, batch_sizes, workers,
+    bulk_threads, bulk_latency, readers, repeat, results_dir, compare,
+    threshold, no_save
+):
+    config = dict(
+        papers=papers, seed=seed, incl_abs=incl_abs, workers=workers,
+        bulk_threads=bulk_threads, bulk_latency=bulk_latency,
+        readers=readers, repeat=repeat,
+    )
+    tmp_dir = None
+    if data_dir is None:
+        if out_dir is None:
+            tmp_dir = tempfile.TemporaryDirectory()
+            out_dir = tmp_dir.name
+        data_dir = release_dir(out_dir)
+        if not data_dir.joinpath("metadata.csv").exists():
+            print(f"Generating {papers} papers into {data_dir}")
+            SyntheticRelease(papers=papers, seed=seed).write(data_dir)
+    data_dir = Path(data_dir)
+    config["data_dir"] = str(data_dir)
+
+    meta_path, groups, parses = load_release(data_dir)
+    config.update(
+        groups=len(groups),
+        rows=sum(len(rows) for rows in groups),
+        json_files=len(parses),
+    )
+    print(
+        f"{config['rows']} rows, {config['groups']} cord_uids, "
+        f"{config['json_files']} json files"
+    )
+
+    results = {}
+    results.update(bench_fix_date(meta_path, repeat))
+    results.update(bench_filter_by_kwords(groups, parses, repeat))
+    results.update(
+        bench_process_paper_body(groups, parses, incl_abs, repeat)
+    )
+    results.update(bench_parse_cache(data_dir, groups))
+    results.update(
+        bench_deduplicate(data_dir, groups, parses, incl_abs, repeat)
+    )
+    results.update(
+        bench_serialization(data_dir, groups, parses, incl_abs, repeat)
+    )
+    results.update(bench_end_to_end(
+        data_dir, meta_path, incl_abs, batch_sizes, workers, bulk_threads,
+        bulk_latency, readers
+    ))
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+
+    run = dict(
+        timestamp=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        commit=git_commit(),
+        config=config,
+        results=results,
+    )
+    print()
+    regressions = report(
+        results, previous_results(results_dir, compare), threshold
+    )
+    if not no_save:
+        results_dir = Path(results_dir)
+        results_dir.mkdir(parents=True, exist_ok=True)
+        out_path = results_dir.joinpath(
+            f"bench_pipeline-{time.strftime('%Y%m%d-%H%M%S')}.json"
+        )
+        out_path.write_text(json.dumps(run, indent=2))
+        print(f"Results saved to: {out_path}")
+
+    if len(regressions):
+        print(f"Slower than the previous run: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-d", "--data_dir", type=str, default=None,
+        help="Benchmark this release instead of a synthetic one"
+    )
+    parser.add_argument(
+        "-o", "--out_dir", type=str, default=None,
+        help="Keep the synthetic release here, reused if it exists "
+        "(default: a temporary directory)"
+    )
+    parser.add_argument(
+        "-n", "--papers", type=int, default=2000,
+        help="Number of synthetic papers"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0,
+        help="Random seed of the synthetic release"
+    )
+    parser.add_argument(
+        "-i", "--incl_abs", action="store_true",
+        help="Build the documents of the with-abstract indices"
+    )
+    parser.add_argument(
+        "-bs", "--batch_sizes", type=int, nargs="+", default=[500],
+        help="Bulk batch sizes of the end-to-end runs"
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=1,
+        help="Parsing processes of the end-to-end runs"
+    )
+    parser.add_argument(
+        "--bulk_threads", type=int, default=4,
+        help="Concurrent bulk requests of the end-to-end runs"
+    )
+    parser.add_argument(
+        "--bulk_latency", type=float, default=0,
+        help="Seconds the fake bulk endpoint takes per request"
+    )
+    parser.add_argument(
+        "--readers", type=int, default=8,
+        help="Threads reading json files in the asyncio end-to-end runs"
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=3,
+        help="Runs of each micro-benchmark, the best one is kept"
+    )
+    parser.add_argument(
+        "--results_dir", type=str, default=str(RESULTS_DIR),
+        help="Where results are saved and previous runs looked up"
+    )
+    parser.add_argument(
+        "--compare", type=str, default=None,
+        help="Compare with this results file instead of the latest one"
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=0.1,
+        help="Relative slowdown reported as a regression"
+    )
+    parser.add_argument(
+        "--no_save", action="store_true",
+        help="Do not save the results"
+    )
+    main(**vars(parser.parse_args()))
@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+"""
+Search latency and throughput of the papers, paragraphs and abstracts
+indices (eg: of the `docker-compose.yml` container, on port 9201).
+
+The workload mixes BM25 `match` queries on `body` with the same queries
+filtered by `journal.keyword`, `authors.keyword` or a `publish_time` year
+range, built from documents sampled from each index (kinds whose fields
+an index lacks, like slim paragraphs, are left out). `--save_workload`
+writes it as json lines and `--workload` replays it, so runs against
+different index profiles (shards, codec, schema) send the same queries.
+
+Each index is queried at each `--concurrency`, reporting p50/p95/p99
+latency (per index and per query kind) and queries per second, along with
+the profile of the index. Results are saved as json and compared with the
+previous run.
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+
+from pathlib import Path
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "indexing"))
+from es.es_connector import get_connection  # noqa: E402
+from bench_pipeline import RESULTS_DIR, git_commit  # noqa: E402
+
+
+INDICES = ["papers", "paragraphs", "abstracts"]
+# field each kind of query needs, besides body
+KIND_FIELDS = {
+    "match": None,
+    "journal": "journal",
+    "authors": "authors",
+    "date_range": "publish_time",
+}
+SAMPLE_FIELDS = ["body", "journal", "authors", "publish_time"]
+# `ignore_above` of the keyword subfields, longer values are not indexed in
+# them and a term filter on one would have no hits
+IGNORE_ABOVE = 256
+WORD = re.compile(r"[a-z]{4,}")
+
+
+def mapped_fields(es, index):
+    # fields of the first concrete index behind `index`
+    mapping = es.indices.get_mapping(index=index)
+    return set(next(iter(mapping.values()))["mappings"]["properties"])
+
+
+def sample_docs(es, index, size, seed):
+    resp = es.search(
+        index=index,
+        size=size,
+        query={"function_score": {
+            "query": {"match_all": {}},
+            "random_score": {"seed": seed, "field": "_seq_no"},
+        }},
+        source=SAMPLE_FIELDS,
+    )
+    return [hit["_source"] for hit in resp["hits"]["hits"]]
+
+
+def filterable(kind, field, fields, doc):
+    # whether a query of `kind` can be built from `doc`
+    if field is None:
+        return True
+    if field not in fields or doc.get(field) in (None, ""):
+        return False
+    return kind not in ("journal", "authors") or \
+        len(doc[field]) <= IGNORE_ABOVE
+
+
+def make_query(kind, doc, rng):
+    # `match` on words of `doc`, filtered by its own field values so the
+    # query has hits
+    words = WORD.findall(doc.get("body", "").lower()) or ["covid"]
+    terms = rng.sample(words, min(3, len(words)))
+    match = {"match": {"body": " ".join(terms)}}
+    if kind == "match":
+        return {"query": match}
+
+    if kind == "date_range":
+        year = int(doc["publish_time"][:4])
+        flt = {"range": {"publish_time": {
+            "gte": f"{year}-01-01", "lt": f"{year + 1}-01-01"
+        }}}
+    else:
+        flt = {"term": {f"{kind}.keyword": doc[kind]}}
+    return {"query": {"bool": {"must": [match], "filter": [flt]}}}
+
+
+def make_workload(es, indices, queries, samples, seed):
+    """ `queries` (index, kind, body) per index, kinds in turns, none for
+    an empty index """
+    rng = random.Random(seed)
+    workload = []
+    for index in indices:
+        fields = mapped_fields(es, index)
+        docs = sample_docs(es, index, samples, seed)
+        kinds = {
+            kind: [
+                doc for doc in docs if filterable(kind, field, fields, doc)
+            ]
+            for kind, field in KIND_FIELDS.items()
+        }
+        kinds = {kind: docs for kind, docs in kinds.items() if len(docs)}
+        if len(docs) == 0:
+            print(f"{index}: no documents to build queries from, skipping")
+            continue
+        print(f"{index}: {len(docs)} sampled documents, {', '.join(kinds)}")
+        names = list(kinds)
+        for i in range(queries):
+            kind = names[i % len(names)]
+            workload.append(dict(
+                index=index, kind=kind,
+                body=make_query(kind, rng.choice(kinds[kind]), rng),
+            ))
+    return workload
+
+
+def read_workload(path):
+    with open(path) as fin:
+        return [json.loads(line) for line in fin if line.strip()]
+
+
+def write_workload(path, workload):
+    with open(path, "w") as fout:
+        for item in workload:
+            fout.write(json.dumps(item) + "\n")
+    print(f"Workload saved to: {path}")
+
+
+def index_profile(es, index):
+    # what the latencies depend on, to tell apart the runs compared
+    settings = es.indices.get_settings(index=index)
+    stats = es.indices.stats(index=index, metric="docs,store")
+    index_settings = next(iter(settings.values()))["settings"]["index"]
+    primaries = stats["_all"]["primaries"]
+    return dict(
+        indices=sorted(settings),
+        shards=int(index_settings["number_of_shards"]),
+        replicas=int(index_settings["number_of_replicas"]),
+        codec=index_settings.get("codec", "default"),
+        docs=primaries["docs"]["count"],
+        store_mb=round(primaries["store"]["size_in_bytes"] / 2 ** 20, 2),
+    )
+
+
+def percentile(values, q):
+    # nearest rank of sorted `values`
+    rank = max(0, min(len(values) - 1, round(q / 100 * len(values)) - 1))
+    return values[rank]
+
+
+def latency_stats(latencies):
+    latencies = sorted(latencies)
+    return {
+        f"p{q}_ms": round(percentile(latencies, q) * 1000, 2)
+        for q in (50, 95, 99)
+    }
+
+
+def run_queries(es, items, concurrency, request_cache=False):
+    def search(item):
+        start = time.perf_counter()
+        resp = es.search(
+            index=item["index"], request_cache=request_cache, **item["body"]
+        )
+        return time.perf_counter() - start, resp["took"]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        timings = list(pool.map(search, items))
+    secs = time.perf_counter() - start
+
+    by_kind = defaultdict(list)
+    for item, (latency, _) in zip(items, timings):
+        by_kind[item["kind"]].append(latency)
+    return dict(
+        latency_stats([latency for latency, _ in timings]),
+        queries=len(items),
+        qps=round(len(items) / secs, 1),
+        took_ms=round(sum(took for _, took in timings) / len(timings), 2),
+        kinds={
+            kind: latency_stats(latencies)
+            for kind, latencies in sorted(by_kind.items())
+        },
+    )
+
+
+def previous_results(results_dir, compare=None):
+    if compare is not None:
+        return json.loads(Path(compare).read_text())
+    runs = sorted(Path(results_dir).glob("bench_queries-*.json"))
+    return json.loads(runs[-1].read_text()) if len(runs) else None
+
+
+def report(results, previous=None):
+    previous = (previous or {}).get("results", {})
+    for name, res in results.items():
+        line = (
+            f"{name:20s} p50 {res['p50_ms']:8.2f}ms  "
+            f"p95 {res['p95_ms']:8.2f}ms  p99 {res['p99_ms']:8.2f}ms  "
+            f"{res['qps']:9.1f} q/s"
+        )
+        old = previous.get(name)
+        if old is not None and old.get("p99_ms") and old.get("qps"):
+            line += f"  p99 {res['p99_ms'] / old['p99_ms'] - 1:+7.1%}"
+            line += f", q/s {res['qps'] / old['qps'] - 1:+7.1%} vs previous"
+        print(line)
+
+
+def main(
+    address, port, indices, concurrency, queries, samples, warmup, seed,
+    workload, save_workload, request_cache, label, results_dir, compare,
+    no_save
+):
+    es = get_connection(address, port, pool_size=max(concurrency))
+    indices = [
+        index for index in indices if es.indices.exists(index=index)
+    ]
+    if workload is not None:
+        items = [
+            item for item in read_workload(workload)
+            if item["index"] in indices
+        ]
+    else:
+        items = make_workload(es, indices, queries, samples, seed)
+    # empty (or new) indices have no queries to time
+    indices = [
+        index for index in indices
+        if any(item["index"] == index for item in items)
+    ]
+    if len(indices) == 0:
+        sys.exit(
+            "No queries to run: the indices are missing or empty, index a "
+            "release first (or replay a workload of existing indices)"
+        )
+    if save_workload is not None:
+        write_workload(save_workload, items)
+
+    profiles = {index: index_profile(es, index) for index in indices}
+    results = {}
+    for index in indices:
+        index_items = [item for item in items if item["index"] == index]
+        print(
+            f"{index}: {len(index_items)} queries, "
+            f"{json.dumps(profiles[index])}"
+        )
+        run_queries(es, index_items[:warmup], 1, request_cache)
+        for threads in concurrency:
+            results[f"{index},c={threads}"] = run_queries(
+                es, index_items, threads, request_cache
+            )
+
+    run = dict(
+        timestamp=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        commit=git_commit(),
+        config=dict(
+            label=label, workload=workload, queries=len(items), seed=seed,
+            request_cache=request_cache, profiles=profiles,
+        ),
+        results=results,
+    )
+    print()
+    report(results, previous_results(results_dir, compare))
+    if not no_save:
+        results_dir = Path(results_dir)
+        results_dir.mkdir(parents=True, exist_ok=True)
+        out_path = results_dir.joinpath(
+            f"bench_queries-{time.strftime('%Y%m%d-%H%M%S')}.json"
+        )
+        out_path.write_text(json.dumps(run, indent=2))
+        print(f"Results saved to: {out_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-a", "--address", type=str, default="localhost",
+        help="Elastic search address, or comma separated hosts"
+    )
+    parser.add_argument(
+        "-p", "--port", type=int, default=9201,
+        help="Elastic search port (9201 is the docker-compose container)"
+    )
+    parser.add_argument(
+        "--indices", type=str, nargs="+", default=INDICES,
+        help="Indices (or aliases) to query, missing ones are skipped"
+    )
+    parser.add_argument(
+        "-c", "--concurrency", type=int, nargs="+", default=[1, 4, 16],
+        help="Numbers of concurrent queries to run the workload at"
+    )
+    parser.add_argument(
+        "-n", "--queries", type=int, default=1000,
+        help="Queries generated per index"
+    )
+    parser.add_argument(
+        "--samples", type=int, default=500,
+        help="Documents sampled from each index to build the queries from"
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=100,
+        help="Queries of each index sent (and not measured) before the runs"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0,
+        help="Random seed of the sampling and the generated queries"
+    )
+    parser.add_argument(
+        "--workload", type=str, default=None,
+        help="Replay the queries of this json lines file instead"
+    )
+    parser.add_argument(
+        "--save_workload", type=str, default=None,
+        help="Write the workload to this json lines file"
+    )
+    parser.add_argument(
+        "--request_cache", action="store_true",
+        help="Let the shard request cache answer repeated queries"
+    )
+    parser.add_argument(
+        "--label", type=str, default=None,
+        help="Name of the index profile benchmarked, saved with the results"
+    )
+    parser.add_argument(
+        "--results_dir", type=str, default=str(RESULTS_DIR),
+        help="Directory the results are saved to"
+    )
+    parser.add_argument(
+        "--compare", type=str, default=None,
+        help="Compare with these results instead of the latest saved"
+    )
+    parser.add_argument(
+        "--no_save", action="store_true",
+        help="Do not save the results"
+    )
+    main(**vars(parser.parse_args()))
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""
+Check that `spark_cord` builds the same documents as `process_cord`: both
+process a synthetic release (see `synthetic_cord.py`) and their (index,
+_id, source) documents are compared. Spark runs on a `local[*]` master by
+default.
+
+The papers are then written with `save_to_es` through es-hadoop (the jar
+of `spark_connector`, or `--jar`) into a local fake endpoint, and the
+documents it receives compared too (unless `--no_write`), no
+elasticsearch is needed.
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+
+from pathlib import Path
+from collections import Counter
+from pyspark.sql import SparkSession
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "indexing"))
+import process_cord  # noqa: E402
+import spark_cord  # noqa: E402
+from es.spark_connector import get_session  # noqa: E402
+from preprocessing.metadata_reader import MetadataReader  # noqa: E402
+from synthetic_cord import SyntheticRelease, release_dir  # noqa: E402
+from bench_pipeline import BulkHandler, start_bulk_server  # noqa: E402
+
+
+class EsHadoopHandler(BulkHandler):
+    """ Enough of a cluster for es-hadoop to write into, keeps the
+    (index, _id, source) of the documents it receives """
+
+    def do_HEAD(self):
+        # every index exists
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.end_headers()
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path in ("", "/"):
+            self.reply({
+                "name": "fake", "cluster_name": "fake", "cluster_uuid": "0",
+                "version": {"number": "8.13.4", "build_flavor": "default"},
+                "tagline": "You Know, for Search",
+            })
+        elif path.startswith("/_cluster/health"):
+            self.reply({"status": "green", "timed_out": False})
+        else:
+            self.reply({})
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not path.endswith("/_bulk"):
+            # eg: the refresh after writing
+            return self.reply({})
+
+        items, docs = [], []
+        lines = body.splitlines()
+        for action, source in zip(lines[::2], lines[1::2]):
+            op, meta = next(iter(json.loads(action).items()))
+            index = meta.get("_index", path.strip("/").split("/")[0])
+            docs.append((index, meta.get("_id"), source.decode()))
+            items.append({op: {
+                "_index": index, "_id": meta.get("_id"), "status": 201
+            }})
+        with self.server.lock:
+            self.server.docs.extend(docs)
+        self.reply({"took": 1, "errors": False, "items": items})
+
+    do_PUT = do_POST
+
+
+def python_docs(data_dir, meta_path, incl_abs):
+    docs = []
+    for rows in MetadataReader(meta_path):
+        final_row = process_cord.process_group(data_dir, incl_abs, rows)
+        if final_row is None:
+            continue
+        for value in final_row.values():
+            for doc in value:
+                action = process_cord.to_action(doc)
+                docs.append(
+                    (action["_index"], action["_id"], action["_source"])
+                )
+    return docs
+
+
+def get_spark(master, write, jar=None):
+    # es-hadoop is only needed to write
+    if write:
+        spark = get_session(dict(master=master, jar=jar))
+    else:
+        spark = SparkSession.builder.master(master).appName(
+            "check_spark"
+        ).getOrCreate()
+    spark_cord.add_sources(spark)
+    return spark
+
+
+def written_docs(docs, index, batch_size):
+    # what `save_to_es` sends for `index`
+    server = start_bulk_server()
+    server.RequestHandlerClass = EsHadoopHandler
+    server.docs = []
+    try:
+        spark_cord.save_to_es(
+            docs, index, "127.0.0.1", server.server_address[1], batch_size
+        )
+    finally:
+        server.shutdown()
+    return server.docs
+
+
+def by_id(docs):
+    # sources compared as objects, the order of their keys may differ
+    return {
+        (index, doc_id): json.loads(source)
+        for index, doc_id, source in docs
+    }
+
+
+def compare(expected, actual, name="spark_cord"):
+    """ Print the differences of two document lists, True when equal """
+    for label, docs in (("process_cord", expected), (name, actual)):
+        counts = Counter(index for index, _, _ in docs)
+        counts = dict(sorted(counts.items()))
+        print(f"{label}: {len(docs)} documents, {counts}")
+    dups = len(actual) - len(by_id(actual))
+    if dups:
+        print(f"{dups} duplicated _ids from {name}")
+
+    expected, actual = by_id(expected), by_id(actual)
+    missing = expected.keys() - actual.keys()
+    extra = actual.keys() - expected.keys()
+    changed = [
+        key for key in expected.keys() & actual.keys()
+        if expected[key] != actual[key]
+    ]
+    for label, keys in (
+        (f"missing from {name}", missing),
+        (f"only in {name}", extra),
+        ("with different sources", changed),
+    ):
+        if len(keys):
+            print(f"{len(keys)} documents {label}, eg: {sorted(keys)[:5]}")
+    return dups == 0 and not (missing or extra or changed)
+
+
+def main(
+    data_dir, papers, seed, incl_abs, master, partitions, jar, no_write,
+    batch_size
+):
+    tmp_dir = None
+    if data_dir is None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        data_dir = release_dir(tmp_dir.name)
+        print(f"Generating {papers} papers into {data_dir}")
+        SyntheticRelease(papers=papers, seed=seed).write(data_dir)
+    data_dir = Path(data_dir).absolute()
+    meta_path = data_dir.joinpath("metadata.csv")
+
+    expected = python_docs(data_dir, meta_path, incl_abs)
+    spark = get_spark(master, not no_write, jar)
+    try:
+        docs = spark_cord.process_metadata(
+            spark, data_dir, meta_path, incl_abs, partitions
+        )
+        docs.persist()
+        same = compare(expected, docs.collect())
+        if not no_write:
+            print("Writing papers through es-hadoop")
+            same = compare(
+                [doc for doc in expected if doc[0] == "papers"],
+                written_docs(docs, "papers", batch_size), "es-hadoop"
+            ) and same
+    finally:
+        spark.stop()
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+
+    print("Same documents" if same else "Documents differ")
+    sys.exit(0 if same else 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-d", "--data_dir", type=str, default=None,
+        help="Check this release instead of a synthetic one"
+    )
+    parser.add_argument(
+        "-n", "--papers", type=int, default=300,
+        help="Number of synthetic papers"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0,
+        help="Random seed of the synthetic release"
+    )
+    parser.add_argument(
+        "-i", "--incl_abs", action="store_true",
+        help="Build the documents of the with-abstract indices"
+    )
+    parser.add_argument(
+        "--master", type=str, default="local[*]",
+        help="Spark master"
+    )
+    parser.add_argument(
+        "--partitions", type=int, default=None,
+        help="Number of partitions papers are grouped into"
+    )
+    parser.add_argument(
+        "--jar", type=str, default=None,
+        help="elasticsearch-hadoop jar (default: the one in spark_connector)"
+    )
+    parser.add_argument(
+        "--no_write", action="store_true",
+        help="Only compare the documents, without writing them through "
+        "es-hadoop"
+    )
+    parser.add_argument(
+        "-bs", "--batch_size", type=int, default=100,
+        help="Documents per bulk request of each spark task"
+    )
+    main(**vars(parser.parse_args()))
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+"""
+Generate a synthetic CORD-19 release: `metadata.csv` (with duplicated
+cord_uids and the publish_time formats found in real releases) plus pmc
+and pdf json parses, laid out as `<out_dir>/cord19-<date>`.
+"""
+import os
+import sys
+import csv
+import json
+import random
+import string
+import tarfile
+import argparse
+
+from pathlib import Path
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "indexing"))
+from preprocessing.keywords import KEYWORDS  # noqa: E402
+
+
+# all the columns of a real metadata.csv, in order
+COLUMNS = [
+    "cord_uid",
+    "sha",
+    "source_x",
+    "title",
+    "doi",
+    "pmcid",
+    "pubmed_id",
+    "license",
+    "abstract",
+    "publish_time",
+    "authors",
+    "journal",
+    "mag_id",
+    "who_covidence_id",
+    "arxiv_id",
+    "pdf_json_files",
+    "pmc_json_files",
+    "url",
+    "s2_id",
+]
+
+PUBLISH_TIMES = [
+    "{year}-{month:02d}-{day:02d}",
+    "{year}-{month:02d}-{day:02d}",
+    "{year}-{month:02d}-{day:02d}",
+    "{year}",
+    "{year} {month_abbr}",
+    "{year} {month_abbr} {day}",
+    "{year} {season}",
+    "{year} {month_abbr}-{next_abbr}",
+    "['{year}-{month:02d}-{day:02d}', '{year}-{month:02d}-01']",
+    "",
+]
+
+MONTHS = [
+    "Jan", "Feb", "Mar", "Apr", "May", "Jun",
+    "Jul", "Aug", "Sep", "Oct", "Nov", "Dec",
+]
+
+SEASONS = ["Spring", "Summer", "Autumn", "Fall", "Winter"]
+
+WORDS = (
+    "the of and in to a with patients were was for infection virus "
+    "respiratory cells protein viral disease clinical study results "
+    "analysis data acute syndrome severe treatment cases hospital mortality "
+    "transmission model influenza antibody vaccine immune response samples "
+    "children risk outcomes health care"
+).split()
+
+SOURCES = ["PMC", "Medline", "WHO", "Elsevier", "MedRxiv", "ArXiv"]
+
+
+class SyntheticRelease:
+    """ Random but reproducible CORD-19 release.
+
+    `papers` distinct cord_uids, `dup_ratio` of them with 2 to 4 metadata
+    rows. Each row has a pmc parse with probability `pmc_ratio`, a pdf
+    parse with `pdf_ratio`, ~`paragraphs` paragraphs per parse and about
+    `kw_ratio` of titles, abstracts and paragraphs mention a keyword.
+    """
+
+    def __init__(
+        self, papers=1000, dup_ratio=0.05, pmc_ratio=0.5, pdf_ratio=0.6,
+        paragraphs=30, kw_ratio=0.1, seed=0
+    ):
+        self.papers = papers
+        self.dup_ratio = dup_ratio
+        self.pmc_ratio = pmc_ratio
+        self.pdf_ratio = pdf_ratio
+        self.paragraphs = paragraphs
+        self.kw_ratio = kw_ratio
+        self.rng = random.Random(seed)
+
+    def text(self, min_words, max_words, kw_ratio=None):
+        rng = self.rng
+        kw_ratio = self.kw_ratio if kw_ratio is None else kw_ratio
+        words = [
+            rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))
+        ]
+        if len(words) and rng.random() < kw_ratio:
+            keyword = rng.choice(KEYWORDS)
+            words[rng.randrange(len(words))] = keyword.upper() \
+                if rng.random() < 0.1 else keyword
+        text = " ".join(words)
+        return text[:1].upper() + text[1:]
+
+    def uid(self, size=8):
+        chars = string.ascii_lowercase + string.digits
+        return "".join(self.rng.choice(chars) for _ in range(size))
+
+    def publish_time(self):
+        rng = self.rng
+        month = rng.randint(1, 12)
+        return rng.choice(PUBLISH_TIMES).format(
+            year=rng.randint(1990, 2022),
+            month=month,
+            day=rng.randint(1, 28),
+            month_abbr=MONTHS[month - 1],
+            next_abbr=MONTHS[month % 12],
+            season=rng.choice(SEASONS),
+        )
+
+    def authors(self):
+        rng = self.rng
+        return "; ".join(
+            rng.choice(WORDS).title() + ", " +
+            rng.choice(string.ascii_uppercase) + "."
+            for _ in range(rng.randint(1, 8))
+        )
+
+    def parse(self, paper_id, title):
+        rng = self.rng
+        count = max(0, int(rng.gauss(self.paragraphs, self.paragraphs / 3)))
+        return {
+            "paper_id": paper_id,
+            "metadata": {"title": title, "authors": []},
+            "abstract": [],
+            "body_text": [
+                {
+                    "text": self.text(0, 200) if rng.random() > 0.02 else "",
+                    "cite_spans": [],
+                    "ref_spans": [],
+                    "section": self.text(1, 4, kw_ratio=0),
+                }
+                for _ in range(count)
+            ],
+            "bib_entries": {},
+            "ref_entries": {},
+            "back_matter": [],
+        }
+
+    def rows(self):
+        rng = self.rng
+        for _ in range(self.papers):
+            cord_uid = self.uid()
+            copies = rng.randint(2, 4) if rng.random() < self.dup_ratio else 1
+            title = self.text(5, 20)
+            for _ in range(copies):
+                # duplicates share the title, parses and abstract may differ
+                row = dict.fromkeys(COLUMNS, "")
+                row.update(
+                    cord_uid=cord_uid,
+                    source_x=rng.choice(SOURCES),
+                    title=title,
+                    doi=f"10.{rng.randint(1000, 9999)}/{self.uid(12)}",
+                    license=rng.choice(["cc-by", "no-cc", "els-covid"]),
+                    abstract=self.text(0, 300) if rng.random() > 0.2 else "",
+                    publish_time=self.publish_time(),
+                    authors=self.authors(),
+                    journal=self.text(1, 4, kw_ratio=0),
+                    url=f"https://doi.org/10.1000/{self.uid(12)}",
+                )
+                if rng.random() < self.pmc_ratio:
+                    row["pmcid"] = f"PMC{rng.randint(1000000, 9999999)}"
+                    row["pmc_json_files"] = \
+                        f"document_parses/pmc_json/{row['pmcid']}.xml.json"
+                if rng.random() < self.pdf_ratio:
+                    row["sha"] = "".join(
+                        rng.choice("0123456789abcdef") for _ in range(40)
+                    )
+                    row["pdf_json_files"] = \
+                        f"document_parses/pdf_json/{row['sha']}.json"
+                yield row
+
+    def write(self, data_dir, tar=False):
+        """ Write the release into `data_dir`, returns the number of rows """
+        data_dir = Path(data_dir)
+        for parse_dir in ("pmc_json", "pdf_json"):
+            data_dir.joinpath("document_parses", parse_dir).mkdir(
+                parents=True, exist_ok=True
+            )
+
+        count = 0
+        with open(data_dir.joinpath("metadata.csv"), "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            for row in self.rows():
+                writer.writerow(row)
+                count += 1
+                for column in ("pmc_json_files", "pdf_json_files"):
+                    if row[column] == "":
+                        continue
+                    paper_id = Path(row[column]).name.split(".")[0]
+                    data_dir.joinpath(row[column]).write_text(
+                        json.dumps(self.parse(paper_id, row["title"]))
+                    )
+
+        if tar:
+            with tarfile.open(
+                data_dir.joinpath("document_parses.tar.gz"), "w:gz"
+            ) as tarball:
+                tarball.add(
+                    data_dir.joinpath("document_parses"), "document_parses"
+                )
+        return count
+
+
+def release_dir(out_dir, date="2022-06-02"):
+    return Path(out_dir).joinpath(f"cord19-{date}")
+
+
+def main(out_dir, date, tar, **config):
+    data_dir = release_dir(out_dir, date)
+    rows = SyntheticRelease(**config).write(data_dir, tar)
+    print(f"Wrote {rows} metadata rows into {data_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-o", "--out_dir", type=str, required=True,
+        help="Directory to write the release into"
+    )
+    parser.add_argument(
+        "--date", type=str, default="2022-06-02",
+        help="Date of the release (names its directory)"
+    )
+    parser.add_argument(
+        "-n", "--papers", type=int, default=1000,
+        help="Number of distinct cord_uids"
+    )
+    parser.add_argument(
+        "--dup_ratio", type=float, default=0.05,
+        help="Fraction of cord_uids with several metadata rows"
+    )
+    parser.add_argument(
+        "--pmc_ratio", type=float, default=0.5,
+        help="Fraction of rows with a pmc parse"
+    )
+    parser.add_argument(
+        "--pdf_ratio", type=float, default=0.6,
+        help="Fraction of rows with a pdf parse"
+    )
+    parser.add_argument(
+        "--paragraphs", type=int, default=30,
+        help="Mean number of paragraphs of a parse"
+    )
+    parser.add_argument(
+        "--kw_ratio", type=float, default=0.1,
+        help="Fraction of texts mentioning one of the keywords"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0,
+        help="Random seed"
+    )
+    parser.add_argument(
+        "--tar", action="store_true",
+        help="Also pack the parses as document_parses.tar.gz"
+    )
+    main(**vars(parser.parse_args()))
@@ -8,30 +8,15 @@ import requests
 import argparse
 
 from bs4 import BeautifulSoup
-from tqdm import tqdm
-from pathlib import Path
-from urllib.request import urlretrieve
 
-from indexing.preprocessing.fix_dates import fix_dates
-from indexing.process_cord import main as process_cord
+from downloader import download
+from extractor import needed_parses, previous_release, extract_parses
+from indexing.process_cord import index_release as process_cord
+from indexing.process_cord import export_release
+from indexing.process_cord import metrics, write_metrics
 from indexing.process_cord import get_parser as get_indexing_parser
 
 
-class TqdmUpTo(tqdm):
-    def update_to(self, b=1, bsize=1, tsize=None):
-        """
-        b  : int, optional
-            Number of blocks transferred so far [default: 1].
-        bsize  : int, optional
-            Size of each block (in tqdm units) [default: 1].
-        tsize  : int, optional
-            Total size (in tqdm units). If [default: None] remains unchanged.
-        """
-        if tsize is not None:
-            self.total = tsize
-        self.update(b * bsize - self.n)  # will also set self.n = b * bsize
-
-
 def get_parser():
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument(
@@ -58,6 +43,28 @@ def get_parser():
         "--force",  action="store_true",
         help="Overwrite existing data."
     )
+    parser.add_argument(
+        "--stream_parses",  action="store_true",
+        help="Do not extract document_parses.tar.gz, index straight from it."
+    )
+    parser.add_argument(
+        "--extract_referenced",  action="store_true",
+        help="Only extract the json parses referenced by metadata.csv, "
+        "reusing unchanged files of the previous release"
+    )
+    parser.add_argument(
+        "--extract_workers", type=int, default=8,
+        help="Threads writing the extracted parses"
+    )
+    parser.add_argument(
+        "--download_threads", type=int, default=8,
+        help="Concurrent range requests used to download the release"
+    )
+    parser.add_argument(
+        "--sha256", type=str, default=None,
+        help="Expected sha256 of the release tarball, checked along with "
+        "its etag"
+    )
     return get_indexing_parser(parser, requires=False)
 
 
@@ -91,90 +98,147 @@ def scrape_latest():
     return date
 
 
-def download_url(url, save_dir):
-    filename = url.split("/")[-1]
-    bar = TqdmUpTo(
-        unit="B", unit_scale=True, unit_divisor=1024, miniters=1, desc=filename
-    )
-    save_dir = Path(save_dir)
-    if not save_dir.exists():
-        save_dir.mkdir(parents=True, exist_ok=True)
-
-    filename_path = str(save_dir.joinpath(filename))
-    with bar as t:
-        urlretrieve(url, filename=filename_path, reporthook=t.update_to)
-
-
-def download_collection(date):
+def download_collection(
+    date, extract=True, threads=8, referenced=False, extract_workers=8,
+    sha256=None
+):
     print(f"Downloading CORD-19 release of {date}...")
     collection_dir = "data/"
     base_url = "https://ai2-semanticscholar-cord-19.s3-us-west-2.amazonaws.com/historical_releases"  # noqa: E501
     tarball_url = f"{base_url}/cord-19_{date}.tar.gz"
     tarball_local = os.path.join(collection_dir, f"cord-19_{date}.tar.gz")
 
-    if not os.path.exists(tarball_local):
-        print(f"Fetching {tarball_url}...")
-        download_url(tarball_url, collection_dir)
-    else:
-        print(f"{tarball_local} already exists, skipping download.")
+    # resumes partial downloads and replaces truncated ones
+    print(f"Fetching {tarball_url}...")
+    with metrics.stage("download"):
+        download(
+            tarball_url, collection_dir, threads=threads, sha256=sha256
+        )
 
     print(f"Extracting {tarball_local} into {collection_dir}")
-    tarball = tarfile.open(tarball_local)
-    tarball.extractall(collection_dir)
-    tarball.close()
+    with metrics.stage("extract"):
+        tarball = tarfile.open(tarball_local)
+        tarball.extractall(collection_dir)
+        tarball.close()
 
     docparses = os.path.join(collection_dir, date, "document_parses.tar.gz")
     collection_base = os.path.join(collection_dir, date)
 
-    print(f"Extracting {docparses} into {collection_base}...")
-    tarball = tarfile.open(docparses)
-    tarball.extractall(collection_base)
-    tarball.close()
+    if extract and referenced:
+        print(f"Extracting referenced parses of {docparses}...")
+        with metrics.stage("extract_parses"):
+            extracted = extract_parses(
+                docparses, collection_base,
+                needed_parses(os.path.join(collection_base, "metadata.csv")),
+                previous_release(collection_dir, date),
+                extract_workers,
+            )
+        for name, count in extracted.items():
+            metrics.count("parses_extracted", count, result=name)
+    elif extract:
+        print(f"Extracting {docparses} into {collection_base}...")
+        with metrics.stage("extract_parses"):
+            tarball = tarfile.open(docparses)
+            tarball.extractall(collection_base)
+            tarball.close()
 
     print(f"Renaming {collection_base}")
     os.rename(collection_base, os.path.join(collection_dir, f"cord19-{date}"))
 
 
 def build_indexes(date, args):
-    # fix dates in metadata archive
+    # dates in the metadata archive are fixed while indexing
     data_dir = f"data/cord19-{date}"
     orig_meta = f"data/cord19-{date}/metadata.csv"
-    corr_meta = f"data/cord19-{date}/metadata_dates.csv"
-    fix_dates(orig_meta, corr_meta)
+    parses_tar = args.parses_tar
+    extracted = os.path.exists(f"{data_dir}/document_parses")
+    if parses_tar is None and (args.stream_parses or not extracted):
+        parses_tar = f"{data_dir}/document_parses.tar.gz"
+    if args.export_dir is not None:
+        export_release(
+            orig_meta, data_dir, args.export_dir, args.incl_abs,
+            args.workers, parses_tar, args.parse_cache,
+            args.slim_paragraphs, args.shard_docs, args.partition
+        )
+        return
+
     process_cord(
-        metadata=corr_meta,
+        metadata=orig_meta,
         data_dir=data_dir,
         address=args.address,
         port=args.port,
+        pool_size=args.pool_size,
+        timeout=args.timeout,
+        http_compress=args.http_compress,
+        sniff=args.sniff,
         incl_abs=args.incl_abs,
-        batch_size=args.batch_size
+        slim_paragraphs=args.slim_paragraphs,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        chunk_mb=args.chunk_mb,
+        bulk_threads=args.bulk_threads,
+        max_retries=args.max_retries,
+        dead_letter=args.dead_letter,
+        incremental=args.incremental,
+        state_db=args.state_db,
+        parses_tar=parses_tar,
+        bulk_load=args.bulk_load,
+        shards=args.shards,
+        best_compression=args.best_compression,
+        versioned=args.versioned,
+        keep_generations=args.keep_generations,
+        parse_cache=args.parse_cache,
+        async_ingest=args.async_ingest,
+        readers=args.readers,
+        read_ahead=args.read_ahead,
+        partition=args.partition,
+        publish_partitions=args.publish_partitions,
+        resume=args.resume,
+        checkpoint=args.checkpoint,
+        # the latest release may be the one indexed last time
+        skip_published=args.skip_published or args.scrape_latest,
     )
 
 
+def update_release(args):
+    date = args.date
+    if args.scrape_latest:
+        date = scrape_latest()
+
+    if args.all or args.download:
+        collection_dir = f"data/cord19-{date}"
+        if not args.force and os.path.exists(collection_dir):
+            print(
+                "Collection exists; not redownloading collection. " +
+                "Use --force to remove existing collection " +
+                "and redownload."
+            )
+        else:
+            if os.path.exists(collection_dir):
+                print("Removing existing collection...")
+                shutil.rmtree(collection_dir)
+            download_collection(
+                date, not args.stream_parses, args.download_threads,
+                args.extract_referenced, args.extract_workers, args.sha256
+            )
+
+    if args.all or args.index:
+        build_indexes(date, args)
+
+    return date
+
+
 def main(args):
     if not args.all and not (args.download or args.index):
         print("Must specify --all or one of {--download, --index}.")
-    else:
-        date = args.date
-        if args.scrape_latest:
-            date = scrape_latest()
-
-        if args.all or args.download:
-            collection_dir = f"data/cord19-{date}"
-            if not args.force and os.path.exists(collection_dir):
-                print(
-                    "Collection exists; not redownloading collection. " +
-                    "Use --force to remove existing collection " +
-                    "and redownload."
-                )
-            else:
-                if os.path.exists(collection_dir):
-                    print("Removing existing collection...")
-                    shutil.rmtree(collection_dir)
-                download_collection(date)
-
-        if args.all or args.index:
-            build_indexes(date, args)
+        return
+
+    success, date = False, args.date
+    try:
+        date = update_release(args)
+        success = True
+    finally:
+        write_metrics(args.report, args.prom_file, success, release=date)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,312 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import requests
+
+from tqdm import tqdm
+from pathlib import Path
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+
+
+MB = 1024 * 1024
+# part sizes (MiB) of the usual s3 uploaders, the aws cli uses 8
+MULTIPART_MB = [8, 16, 5, 15, 32, 50, 64, 100, 128, 256, 512]
+# most part sizes hashed to verify a multipart etag, in a single read
+MAX_PART_SIZES = 16
+
+
+def get_session(threads):
+    # one pooled connection per download thread
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=threads)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def remote_info(session, url):
+    # size, whether ranges are supported and etag of the remote file
+    r = session.head(url, allow_redirects=True, timeout=60)
+    r.raise_for_status()
+    size = r.headers.get("Content-Length")
+    return dict(
+        size=int(size) if size is not None else None,
+        ranges=r.headers.get("Accept-Ranges", "").lower() == "bytes",
+        etag=r.headers.get("ETag", "").strip('"'),
+    )
+
+
+def etag_md5(etag):
+    # single part uploads to s3 use the md5 of the object as etag,
+    # multipart ones do not (they contain a dash)
+    if len(etag) == 32 and "-" not in etag:
+        return etag.lower()
+    return None
+
+
+def etag_parts(etag):
+    # multipart uploads to s3 use the md5 of the md5s of their parts and
+    # the number of parts, as `<md5>-<parts>`
+    digest, _, parts = etag.partition("-")
+    if len(digest) == 32 and parts.isdigit() and int(parts) > 0:
+        return digest.lower(), int(parts)
+    return None
+
+
+def multipart_sizes(size, parts):
+    """ Part sizes (whole MiB) an upload of `size` bytes in `parts` may
+    have used, the usual ones first """
+    smallest = -(-size // (parts * MB))
+    largest = (size - 1) // ((parts - 1) * MB) if parts > 1 else smallest
+    return sorted(
+        (part_mb * MB for part_mb in range(smallest, largest + 1)),
+        key=lambda part_size: (
+            part_size // MB not in MULTIPART_MB, part_size
+        )
+    )
+
+
+def multipart_digests(path, part_sizes):
+    """ Etag digest of `path` uploaded in parts of each of `part_sizes` """
+    part_md5s = {part_size: [] for part_size in part_sizes}
+    current = {part_size: hashlib.md5() for part_size in part_sizes}
+    offset = 0
+    with open(path, "rb") as fin:
+        for block in iter(lambda: fin.read(MB), b""):
+            for part_size, digest in current.items():
+                # parts need not end on a block
+                start = 0
+                while start < len(block):
+                    end = min(
+                        len(block),
+                        start + part_size - (offset + start) % part_size
+                    )
+                    digest.update(block[start:end])
+                    if (offset + end) % part_size == 0:
+                        part_md5s[part_size].append(digest.digest())
+                        digest = current[part_size] = hashlib.md5()
+                    start = end
+            offset += len(block)
+    for part_size, digest in current.items():
+        if offset % part_size:
+            part_md5s[part_size].append(digest.digest())
+    return {
+        part_size: hashlib.md5(b"".join(md5s)).hexdigest()
+        for part_size, md5s in part_md5s.items()
+    }
+
+
+def verify_multipart(path, size, etag, part_size=None):
+    # the part size is not in the etag, the file is the uploaded one if
+    # any plausible part size gives the same digest. Uploads may use part
+    # sizes that are not whole MiB, so a mismatch only raises when the
+    # part size is given
+    digest, parts = etag_parts(etag)
+    if part_size is not None:
+        if multipart_digests(path, [part_size])[part_size] != digest:
+            raise RuntimeError(
+                f"{path}: does not match multipart etag {etag} with parts "
+                f"of {part_size} bytes"
+            )
+        return
+    tried = multipart_sizes(size, parts)[:MAX_PART_SIZES]
+    if digest not in multipart_digests(path, tried).values():
+        print(
+            f"{path}: can not verify etag {etag}, unusual part size (tried "
+            f"{', '.join(str(part // MB) for part in tried)} MiB)"
+        )
+
+
+def file_digest(path, algorithm, block_size=8 * 1024 * 1024):
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as fin:
+        for block in iter(lambda: fin.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def verify_file(path, size, etag="", sha256=None, etag_part_size=None):
+    """ Raise if `path` does not have the expected size and checksums
+
+    The etag is checked when it is the md5 of the file or of its parts
+    (s3 single part and multipart uploads). Without `etag_part_size` (the
+    part size in bytes of a multipart upload), a multipart etag that no
+    usual part size matches is only reported.
+    """
+    path = Path(path)
+    actual = path.stat().st_size
+    if size is not None and actual != size:
+        raise RuntimeError(f"{path}: expected {size} bytes, got {actual}")
+    if etag_parts(etag) is not None:
+        verify_multipart(path, actual, etag, etag_part_size)
+    checksums = (("md5", etag_md5(etag)), ("sha256", sha256))
+    for algorithm, expected in checksums:
+        if expected is None:
+            continue
+        digest = file_digest(path, algorithm)
+        if digest != expected.lower():
+            raise RuntimeError(
+                f"{path}: {algorithm} {digest} does not match {expected}"
+            )
+
+
+class DownloadState:
+    """ Sidecar file with the parts of a download already on disk.
+
+    Stored next to the partial file as json, it only applies to the same
+    url, size and etag, otherwise the download starts over.
+    """
+
+    def __init__(self, path, url, size, etag, part_size):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.info = dict(url=url, size=size, etag=etag, part_size=part_size)
+        self.done = set()
+        if self.path.exists():
+            saved = json.loads(self.path.read_text())
+            if {k: saved.get(k) for k in self.info.keys()} == self.info:
+                self.done = set(saved["done"])
+
+    def mark_done(self, part):
+        with self.lock:
+            self.done.add(part)
+            tmp_path = self.path.with_suffix(".tmp")
+            tmp_path.write_text(
+                json.dumps(dict(self.info, done=sorted(self.done)))
+            )
+            os.replace(tmp_path, self.path)
+
+
+def state_path(part_path):
+    return part_path.with_name(part_path.name + ".json")
+
+
+def fetch_range(session, url, part_path, start, end, bar, retries=5):
+    # bytes [start, end] of `url` written at the same offset of `part_path`
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(min(60, 2 ** attempt))
+        written = 0
+        try:
+            r = session.get(
+                url, headers={"Range": f"bytes={start}-{end}"},
+                stream=True, timeout=60
+            )
+            with r, open(part_path, "r+b") as fout:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise RuntimeError(f"Range request ignored by {url}")
+                fout.seek(start)
+                for block in r.iter_content(1024 * 1024):
+                    fout.write(block)
+                    written += len(block)
+                    bar.update(len(block))
+            if written != end - start + 1:
+                raise IOError(f"Short read of bytes {start}-{end}")
+            return
+        except (requests.RequestException, IOError):
+            # the part is downloaded again from its start
+            bar.update(-written)
+            if attempt == retries:
+                raise
+
+
+def fetch_stream(session, url, part_path, bar):
+    # servers without range support: a single stream, nothing to resume
+    with session.get(url, stream=True, timeout=60) as r:
+        r.raise_for_status()
+        with open(part_path, "wb") as fout:
+            for block in r.iter_content(1024 * 1024):
+                fout.write(block)
+                bar.update(len(block))
+
+
+def fetch_parts(
+    session, url, part_path, info, threads, part_size, retries, bar
+):
+    size = info["size"]
+    state = DownloadState(
+        state_path(part_path), url, size, info["etag"], part_size
+    )
+    if len(state.done) == 0 or not part_path.exists():
+        state.done = set()
+        with open(part_path, "wb") as fout:
+            fout.truncate(size)
+
+    parts = [
+        (part, start, min(start + part_size, size) - 1)
+        for part, start in enumerate(range(0, size, part_size))
+    ]
+    for part, start, end in parts:
+        if part in state.done:
+            bar.update(end - start + 1)
+
+    def fetch(part, start, end):
+        fetch_range(session, url, part_path, start, end, bar, retries)
+        state.mark_done(part)
+
+    with ThreadPoolExecutor(threads) as executor:
+        futures = [
+            executor.submit(fetch, part, start, end)
+            for part, start, end in parts if part not in state.done
+        ]
+        for future in futures:
+            future.result()
+
+
+def download(
+    url, save_dir, threads=8, part_mb=32, retries=5, sha256=None,
+    session=None, etag_part_size=None
+):
+    """ Download `url` into `save_dir` with concurrent range requests.
+
+    The file is written to `<name>.part`, with the parts already finished
+    recorded in `<name>.part.json`, so an interrupted download resumes
+    where it stopped. Once complete, its size is checked against the
+    server's and its checksum against `sha256` (if given) and the etag
+    (the md5 of the file or of its parts, uploaded in `etag_part_size`
+    bytes parts if given) before moving it into place. An
+    existing file is kept if it passes the same checks. Returns the path of
+    the downloaded file.
+    """
+    save_dir = Path(save_dir)
+    save_dir.mkdir(parents=True, exist_ok=True)
+    path = save_dir.joinpath(url.split("/")[-1])
+    part_path = path.with_name(path.name + ".part")
+    session = session or get_session(threads)
+    info = remote_info(session, url)
+
+    if path.exists():
+        try:
+            verify_file(
+                path, info["size"], info["etag"], sha256, etag_part_size
+            )
+            print(f"{path} already downloaded, skipping.")
+            return path
+        except RuntimeError as e:
+            print(f"Downloading again, {e}")
+            path.unlink()
+
+    bar = tqdm(
+        total=info["size"], unit="B", unit_scale=True, unit_divisor=1024,
+        desc=path.name
+    )
+    with bar:
+        if not info["ranges"] or info["size"] is None:
+            fetch_stream(session, url, part_path, bar)
+        else:
+            fetch_parts(
+                session, url, part_path, info, threads,
+                part_mb * 1024 * 1024, retries, bar
+            )
+
+    verify_file(
+        part_path, info["size"], info["etag"], sha256, etag_part_size
+    )
+    os.replace(part_path, path)
+    if state_path(part_path).exists():
+        state_path(part_path).unlink()
+    return path
@@ -0,0 +1,121 @@
+import os
+import shutil
+import tarfile
+import threading
+
+from tqdm import tqdm
+from pathlib import Path
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from indexing.process_cord import get_json_files, MetadataReader
+
+
+def needed_parses(meta_path):
+    # json files `process_cord` may read, as named in the metadata
+    needed = set()
+    reader = MetadataReader(meta_path, fix_dates=False)
+    for chunk in reader.iter_chunks():
+        for row in chunk.to_dict("records"):
+            needed.update(get_json_files(row))
+    return needed
+
+
+def previous_release(collection_dir, date):
+    # most recent extracted release other than `date`
+    releases = sorted(
+        path for path in Path(collection_dir).glob("cord19-*")
+        if path.is_dir() and path.name != f"cord19-{date}"
+    )
+    return releases[-1] if len(releases) else None
+
+
+def same_file(path, member):
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return False
+    return stat.st_size == member.size and int(stat.st_mtime) == member.mtime
+
+
+def link_file(source, dest):
+    # unchanged since the previous release, share it instead of writing it
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(source, dest)
+    except OSError:
+        shutil.copy2(source, dest)
+
+
+def write_file(dest, data, mtime):
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    dest.write_bytes(data)
+    os.utime(dest, (mtime, mtime))
+
+
+def check_futures(futures):
+    # raise the errors of finished futures, return the pending ones
+    pending = []
+    for future in futures:
+        if future.done():
+            future.result()
+        else:
+            pending.append(future)
+    return pending
+
+
+def extract_parses(tar_path, dest_dir, needed, previous_dir=None, workers=8):
+    """ Extract only the `needed` members of the parses tarball.
+
+    The tarball is read in a single sequential pass, files are written by a
+    pool of `workers` threads. Files already in `dest_dir` or, hard linked,
+    in `previous_dir` (an earlier release) are not written again when their
+    size and mtime match the member.
+    """
+    dest_dir = Path(dest_dir)
+    stats = Counter()
+    slots = threading.BoundedSemaphore(workers * 4)
+
+    def submit(executor, func, *args):
+        # bounds the members read ahead of the writers
+        slots.acquire()
+        future = executor.submit(func, *args)
+        future.add_done_callback(lambda _: slots.release())
+        futures.append(future)
+
+    futures = []
+    bar = tqdm(total=len(needed), desc="Extracting parses")
+    with ThreadPoolExecutor(workers) as executor, bar, \
+            tarfile.open(tar_path, "r|*") as tarball:
+        for member in tarball:
+            name = member.name[2:] if member.name.startswith("./") \
+                else member.name
+            if not member.isfile() or name not in needed:
+                stats["unreferenced"] += member.isfile()
+                continue
+
+            bar.update()
+            dest = dest_dir.joinpath(name)
+            if same_file(dest, member):
+                stats["present"] += 1
+            elif previous_dir is not None and \
+                    same_file(previous_dir.joinpath(name), member):
+                stats["linked"] += 1
+                submit(executor, link_file, previous_dir.joinpath(name), dest)
+            else:
+                stats["written"] += 1
+                data = tarball.extractfile(member).read()
+                submit(executor, write_file, dest, data, member.mtime)
+
+            if len(futures) > workers * 64:
+                futures = check_futures(futures)
+
+        for future in futures:
+            future.result()
+
+    print(
+        f"Parses: {stats['written']} written, {stats['linked']} linked from "
+        f"{previous_dir}, {stats['present']} already present, "
+        f"{stats['unreferenced']} not referenced by the metadata"
+    )
+    return stats
@@ -0,0 +1,101 @@
+import json
+import threading
+
+from pathlib import Path
+from collections import Counter
+
+
+class Checkpoint:
+    """ Local record of the papers whose documents are all indexed.
+
+    The actions of a paper are registered with `expect` before they reach
+    the sink, which `acknowledge`s them as bulk requests succeed. Once all
+    of them are, the cord_uid is appended to the checkpoint file, so an
+    interrupted run can be resumed without the papers already indexed.
+    Papers with rejected documents are never completed, a resumed run
+    indexes them again.
+
+    The first line of the file holds the settings of the run (release,
+    indices...), a checkpoint of other settings is not resumed.
+    """
+
+    def __init__(self, path, settings=None, resume=False):
+        self.path = Path(path)
+        self.settings = {
+            key: str(value) for key, value in (settings or {}).items()
+        }
+        self.completed = set()
+        # id() of the pending actions -> cord_uid, actions left per paper
+        self.pending = {}
+        self.remaining = Counter()
+        self.lock = threading.Lock()
+        self.resumed = resume and self._load()
+        if self.resumed:
+            print(
+                f"Resuming from {self.path}: {len(self.completed)} papers "
+                "already indexed"
+            )
+            self.file = open(self.path, "a")
+        else:
+            self.file = open(self.path, "w")
+            self.file.write(json.dumps(self.settings) + "\n")
+            self.file.flush()
+
+    def _load(self):
+        if not self.path.exists():
+            print(f"No checkpoint to resume: {self.path}")
+            return False
+
+        with open(self.path) as fin:
+            header = fin.readline()
+            if header == "" or json.loads(header) != self.settings:
+                print("Indexing settings changed, discarding checkpoint")
+                return False
+            # an interrupted write leaves a partial (unknown) cord_uid
+            self.completed = {line.strip() for line in fin}
+        return True
+
+    def close(self):
+        self.file.close()
+
+    def remove(self):
+        # once the run finished there is nothing to resume
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+    def incomplete(self):
+        # papers with documents not indexed (yet, or rejected)
+        with self.lock:
+            return set(self.remaining)
+
+    def expect(self, cord_uid, actions):
+        """ Register the bulk actions of a paper, before they are sent """
+        with self.lock:
+            for action in actions:
+                self.pending[id(action)] = cord_uid
+                self.remaining[cord_uid] += 1
+            if self.remaining[cord_uid] == 0:
+                # nothing to index
+                del self.remaining[cord_uid]
+                self._complete([cord_uid])
+
+    def acknowledge(self, actions):
+        """ Count `actions` as indexed, completes the papers they finish """
+        completed = []
+        with self.lock:
+            for action in actions:
+                cord_uid = self.pending.pop(id(action), None)
+                if cord_uid is None:
+                    continue
+                self.remaining[cord_uid] -= 1
+                if self.remaining[cord_uid] == 0:
+                    del self.remaining[cord_uid]
+                    completed.append(cord_uid)
+            self._complete(completed)
+
+    def _complete(self, cord_uids):
+        if len(cord_uids) == 0:
+            return
+        self.file.write("".join(f"{cord_uid}\n" for cord_uid in cord_uids))
+        self.file.flush()
+        self.completed.update(cord_uids)
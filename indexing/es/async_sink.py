@@ -0,0 +1,125 @@
+import time
+import asyncio
+
+from elasticsearch.helpers import async_streaming_bulk
+
+from es.bulk_sink import BulkSink, is_retryable
+
+
+class AsyncBulkSink(BulkSink):
+    """ asyncio counterpart of `BulkSink`, over an `AsyncElasticsearch`.
+
+    Same buffering, retries, dead letter and metrics, but `add`, `extend`,
+    `flush` and `close` are coroutines and it is used as an async context
+    manager. Full buffers are queued for `threads` sender tasks, each with
+    one request in flight, and `flush` waits while `2 * threads` buffers
+    are queued (backpressure).
+    """
+
+    def __init__(self, es_conn, threads=4, **kwargs):
+        super().__init__(es_conn, threads=threads, **kwargs)
+        self.senders = threads
+        self.queue = None
+        self.tasks = []
+
+    async def __aenter__(self):
+        self.queue = asyncio.Queue(self.senders * 2)
+        self.tasks = [
+            asyncio.create_task(self._sender()) for _ in range(self.senders)
+        ]
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            await self.close()
+        else:
+            # do not hide the original error
+            for task in self.tasks:
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+            self._close_dead_letter()
+
+    async def add(self, action):
+        size = self._prepare(action)
+        if self._is_full(size):
+            await self.flush()
+
+        self.buffer.append(action)
+        self.buffer_bytes += size
+
+    async def extend(self, actions):
+        for action in actions:
+            await self.add(action)
+
+    async def flush(self):
+        self._raise_error()
+        if len(self.buffer) == 0:
+            return
+
+        chunk = self._take_buffer()
+        start = time.perf_counter()
+        await self.queue.put(chunk)
+        if self.metrics is not None:
+            self.metrics.add_time(
+                "bulk_backpressure", time.perf_counter() - start
+            )
+
+    async def close(self):
+        try:
+            await self.flush()
+            for _ in self.tasks:
+                await self.queue.put(None)
+            await asyncio.gather(*self.tasks)
+        finally:
+            self._close_dead_letter()
+
+        self._raise_error()
+        self._print_summary()
+
+    async def _sender(self):
+        while True:
+            chunk = await self.queue.get()
+            if chunk is None:
+                return
+            if self.error is not None:
+                # drop the rest, `add` raises the error
+                continue
+            try:
+                await self._send(chunk)
+            except Exception as e:
+                self.error = e
+
+    async def _send(self, chunk):
+        # see `BulkSink._send`
+        pending = chunk
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await asyncio.sleep(self._backoff_seconds(attempt))
+                self._count(retries=1)
+
+            start = time.perf_counter()
+            try:
+                results = [
+                    result async for result in async_streaming_bulk(
+                        self.es_conn, pending,
+                        chunk_size=len(pending),
+                        max_chunk_bytes=self.max_bytes,
+                        max_retries=0,
+                        raise_on_error=False,
+                        yield_ok=True,
+                    )
+                ]
+            except Exception as e:
+                self._observe(pending, start, ok=False)
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                continue
+            self._observe(pending, start)
+
+            retry = self._handle_results(pending, results)
+            pending = [action for action, _ in retry]
+            if len(pending) == 0:
+                return
+
+        # out of retries
+        self._write_dead_letter(retry)
@@ -0,0 +1,284 @@
+import json
+import time
+import threading
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from elasticsearch.helpers import streaming_bulk
+from elasticsearch.exceptions import ConnectionTimeout
+
+
+def is_retryable(error):
+    # whole request rejected by a busy cluster or timed out
+    return (
+        isinstance(error, ConnectionTimeout) or
+        getattr(error, "status_code", None) == 429
+    )
+
+
+def action_size(action):
+    # ascii json with spaced separators is an upper bound of the bytes the
+    # client serializer produces, plus the two newlines of the bulk format
+    source = action.get("_source")
+    if isinstance(source, str):
+        # already serialized (ascii) json, sent as it is
+        meta = {k: v for k, v in action.items() if k != "_source"}
+        return len(json.dumps(meta, default=str)) + len(source) + 2
+    return len(json.dumps(action, default=str)) + 2
+
+
+class BulkSink:
+    """ Streams bulk actions to elastic search.
+
+    Actions from any index share the same buffer, which is sent as one bulk
+    request once it reaches `max_docs` documents or `max_bytes` bytes. Up to
+    `threads` requests run concurrently, when `2 * threads` requests are
+    pending `add` blocks until one finishes (backpressure).
+
+    Documents rejected with a 429 and requests that timed out or were
+    rejected as a whole are retried with exponential backoff, up to
+    `max_retries` times. Documents that still fail are appended to the
+    `dead_letter` NDJSON file, if given, one {"action", "error"} per line.
+
+    `index_names` maps the `_index` of the actions to the index actually
+    written (eg: the generation behind an alias).
+
+    With `metrics` (a `metrics.Metrics`), the latency of each request, the
+    bytes sent, the time `add` waits for a free slot and the documents
+    indexed, retried and rejected are recorded there too.
+
+    With `checkpoint` (a `checkpoint.Checkpoint`), the actions indexed by
+    each request are acknowledged to it.
+    """
+
+    def __init__(
+        self, es_conn, max_docs=500, max_bytes=10 * 1024 * 1024, threads=4,
+        max_retries=5, initial_backoff=2, max_backoff=120, dead_letter=None,
+        index_names=None, metrics=None, checkpoint=None
+    ):
+        self.es_conn = es_conn
+        self.metrics = metrics
+        self.checkpoint = checkpoint
+        if metrics is not None:
+            # exported even when nothing went wrong
+            metrics.count("bulk_retries", 0)
+            metrics.count("bulk_failed", 0)
+        self.index_names = index_names or {}
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.dead_letter = dead_letter
+        self.stats = Counter()
+        self.buffer = []
+        self.buffer_bytes = 0
+        self.error = None
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(threads * 2)
+        self.executor = ThreadPoolExecutor(threads)
+        self.dead_letter_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # do not hide the original error
+            self.executor.shutdown(wait=True)
+            self._close_dead_letter()
+
+    def add(self, action):
+        size = self._prepare(action)
+        if self._is_full(size):
+            self.flush()
+
+        self.buffer.append(action)
+        self.buffer_bytes += size
+
+    def extend(self, actions):
+        for action in actions:
+            self.add(action)
+
+    def flush(self):
+        self._raise_error()
+        if len(self.buffer) == 0:
+            return
+
+        chunk = self._take_buffer()
+        start = time.perf_counter()
+        self.slots.acquire()
+        if self.metrics is not None:
+            self.metrics.add_time(
+                "bulk_backpressure", time.perf_counter() - start
+            )
+        try:
+            future = self.executor.submit(self._send, chunk)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(self._done)
+
+    def close(self):
+        try:
+            self.flush()
+            self.executor.shutdown(wait=True)
+        finally:
+            self._close_dead_letter()
+
+        self._raise_error()
+        self._print_summary()
+
+    def _print_summary(self):
+        print(
+            f"Indexed {self.stats['indexed']} documents in "
+            f"{self.stats['requests']} requests "
+            f"({self.stats['retries']} retries, {self.stats['failed']} failed)"
+        )
+        if self.stats["failed"] and self.dead_letter is not None:
+            print(f"Failed documents written to: {self.dead_letter}")
+
+    def _prepare(self, action):
+        # renames the index of `action`, returns its size
+        if action.get("_index") in self.index_names:
+            action["_index"] = self.index_names[action["_index"]]
+        return action_size(action)
+
+    def _is_full(self, size):
+        # whether the buffer has to be sent before adding `size` bytes
+        return len(self.buffer) > 0 and (
+            len(self.buffer) >= self.max_docs or
+            self.buffer_bytes + size > self.max_bytes
+        )
+
+    def _take_buffer(self):
+        chunk = self.buffer
+        self.buffer = []
+        self.buffer_bytes = 0
+        return chunk
+
+    def _done(self, future):
+        self.slots.release()
+        error = future.exception()
+        if error is not None:
+            with self.lock:
+                if self.error is None:
+                    self.error = error
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def _backoff_seconds(self, attempt):
+        return min(
+            self.max_backoff, self.initial_backoff * 2 ** (attempt - 1)
+        )
+
+    def _backoff(self, attempt):
+        time.sleep(self._backoff_seconds(attempt))
+
+    def _send(self, chunk):
+        # the chunk is already bounded, make streaming_bulk send it in a
+        # single request (so a timeout means nothing was acknowledged) and
+        # do the retries here, where failures can be matched to actions
+        pending = chunk
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._backoff(attempt)
+                self._count(retries=1)
+
+            start = time.perf_counter()
+            try:
+                results = list(streaming_bulk(
+                    self.es_conn, pending,
+                    chunk_size=len(pending),
+                    max_chunk_bytes=self.max_bytes,
+                    max_retries=0,
+                    raise_on_error=False,
+                    yield_ok=True,
+                ))
+            except Exception as e:
+                self._observe(pending, start, ok=False)
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                continue
+            self._observe(pending, start)
+
+            retry = self._handle_results(pending, results)
+            pending = [action for action, _ in retry]
+            if len(pending) == 0:
+                return
+
+        # out of retries
+        self._write_dead_letter(retry)
+
+    def _handle_results(self, pending, results):
+        # count the results of a request, returns the (action, error) pairs
+        # to retry and writes the rest of the failures to the dead letter
+        retry, failed, acked = [], [], []
+        indexed = Counter()
+        for action, (ok, info) in zip(pending, results):
+            if ok:
+                indexed[action["_index"]] += 1
+                acked.append(action)
+                continue
+            _, item = next(iter(info.items()))
+            if item.get("status") == 429:
+                retry.append((action, item))
+            else:
+                failed.append((action, item))
+
+        self._count(
+            requests=1,
+            indexed=len(pending) - len(retry) - len(failed)
+        )
+        if self.metrics is not None:
+            for index, count in indexed.items():
+                self.metrics.count("docs_indexed", count, index=index)
+            self.metrics.count("docs_retried", len(retry))
+        if self.checkpoint is not None:
+            self.checkpoint.acknowledge(acked)
+        self._write_dead_letter(failed)
+        return retry
+
+    def _count(self, **counts):
+        with self.lock:
+            self.stats.update(counts)
+        if self.metrics is not None:
+            for name, value in counts.items():
+                self.metrics.count(f"bulk_{name}", value)
+
+    def _observe(self, actions, start, ok=True):
+        if self.metrics is None:
+            return
+        self.metrics.observe(
+            "bulk_latency_seconds", time.perf_counter() - start
+        )
+        self.metrics.count("bulk_requests_sent", ok=str(ok).lower())
+        self.metrics.count(
+            "bulk_bytes_sent", sum(action_size(a) for a in actions)
+        )
+
+    def _write_dead_letter(self, failed):
+        if len(failed) == 0:
+            return
+
+        self._count(failed=len(failed))
+        if self.dead_letter is None:
+            return
+
+        with self.lock:
+            if self.dead_letter_file is None:
+                self.dead_letter_file = open(self.dead_letter, "a")
+            for action, error in failed:
+                self.dead_letter_file.write(json.dumps(
+                    {"action": action, "error": error}, default=str
+                ) + "\n")
+            self.dead_letter_file.flush()
+
+    def _close_dead_letter(self):
+        if self.dead_letter_file is not None:
+            self.dead_letter_file.close()
+            self.dead_letter_file = None
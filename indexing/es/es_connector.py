@@ -1,6 +1,70 @@
+from urllib.parse import urlsplit, urlunsplit
+from elasticsearch import AsyncElasticsearch
 from elasticsearch_dsl import connections
 
 
-def get_connection(addr="localhost", port=9200):
-    connections.create_connection(hosts=[f"{addr}:{port}"])
+def get_hosts(addr="localhost", port=9200):
+    """ Node urls of a comma separated list of hosts.
+
+    Hosts without a scheme or a port use http and `port`, credentials
+    and path prefixes are kept (eg: "es1,es2:9201,https://user:pw@es3/es").
+    """
+    hosts = []
+    for host in addr.split(","):
+        host = host.strip()
+        if "://" not in host:
+            host = f"http://{host}"
+        url = urlsplit(host)
+        if url.port is None:
+            url = url._replace(netloc=f"{url.netloc}:{port}")
+        hosts.append(urlunsplit(url._replace(path=url.path.rstrip("/"))))
+    return hosts
+
+
+def ingest_node(node_info, node_config):
+    # sniffed nodes requests are balanced over
+    if "ingest" not in node_info.get("roles", []):
+        return None
+    return node_config
+
+
+def connection_options(
+    pool_size=10, timeout=None, compress=False, sniff=False,
+    sniff_interval=60
+):
+    """ Client options, requests are sent round-robin across nodes.
+
+    `pool_size` connections per node, `timeout` seconds per request (the
+    client's default when None) and gzip compressed bodies if `compress`.
+    With `sniff`, the ingest nodes of the cluster are discovered on start
+    and again (at most every `sniff_interval` seconds) when a node fails.
+    """
+    options = dict(
+        connections_per_node=pool_size,
+        http_compress=compress,
+        node_selector_class="round_robin",
+    )
+    if timeout is not None:
+        options.update(request_timeout=timeout)
+    if sniff:
+        options.update(
+            sniff_on_start=True,
+            sniff_on_node_failure=True,
+            min_delay_between_sniffing=sniff_interval,
+            sniffed_node_callback=ingest_node,
+        )
+    return options
+
+
+def get_connection(addr="localhost", port=9200, **options):
+    connections.create_connection(
+        hosts=get_hosts(addr, port), **connection_options(**options)
+    )
     return connections.get_connection()
+
+
+def get_async_connection(addr="localhost", port=9200, **options):
+    # has to be closed (`await es.close()`) inside the event loop using it
+    return AsyncElasticsearch(
+        hosts=get_hosts(addr, port), **connection_options(**options)
+    )
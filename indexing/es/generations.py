@@ -0,0 +1,132 @@
+from elasticsearch_dsl import connections
+
+
+def generation_name(alias, generation):
+    return f"{alias}-{generation}"
+
+
+def live_index(alias):
+    # index currently served under `alias`, a plain index with the alias
+    # name counts too (indices built before generations existed)
+    es = connections.get_connection()
+    if es.indices.exists_alias(name=alias):
+        return sorted(es.indices.get_alias(name=alias).keys())[-1]
+    if es.indices.exists(index=alias):
+        return alias
+    return None
+
+
+def list_generations(alias):
+    es = connections.get_connection()
+    prefix = generation_name(alias, "")
+    indices = es.indices.get(index=f"{prefix}*", ignore_unavailable=True)
+    return sorted(name for name in indices.keys() if name.startswith(prefix))
+
+
+def is_published(names):
+    # whether every index of `names` is the one served under its alias
+    return all(live_index(alias) == name for alias, name in names.items())
+
+
+def check_unpublished(names):
+    # a generation that is already live is never written into
+    for alias, name in names.items():
+        if live_index(alias) == name:
+            raise RuntimeError(f"{name} is already published as {alias}")
+
+
+def prepare_generation(names):
+    """ Make room for a new generation, `names` maps alias to index name.
+
+    Leftovers of a failed build of the same generation are removed, a
+    generation that is already live is never overwritten.
+    """
+    es = connections.get_connection()
+    check_unpublished(names)
+    for alias, name in names.items():
+        if es.indices.exists(index=name):
+            print(f"Removing unpublished generation: {name}")
+            es.indices.delete(index=name)
+
+
+def clone_generation(names):
+    """ Start a generation as a copy of the live one, to update it in place.
+
+    Returns whether every index could be cloned, otherwise nothing is
+    cloned and the generation has to be built from scratch.
+    """
+    es = connections.get_connection()
+    sources = {alias: live_index(alias) for alias in names.keys()}
+    if any(source is None for source in sources.values()):
+        return False
+
+    for alias, name in names.items():
+        source = sources[alias]
+        print(f"Cloning {source} into {name}")
+        # cloning requires a read-only source, reads are not affected
+        es.indices.put_settings(
+            index=source, body={"index.blocks.write": True}
+        )
+        try:
+            es.indices.clone(index=source, target=name)
+        finally:
+            es.indices.put_settings(
+                index=source, body={"index.blocks.write": None}
+            )
+        es.indices.put_settings(index=name, body={"index.blocks.write": None})
+
+    return True
+
+
+def verify_generation(names, min_ratio=0.5):
+    """ Sanity check a built generation before publishing it.
+
+    Every index must have documents, and not fewer than `min_ratio` times
+    the documents of the live index it replaces.
+    """
+    es = connections.get_connection()
+    for alias, name in names.items():
+        es.indices.refresh(index=name)
+        count = es.count(index=name)["count"]
+        live = live_index(alias)
+        live_count = es.count(index=live)["count"] if live else 0
+        print(f"{name}: {count} documents (live {alias}: {live_count})")
+        if count == 0 or count < live_count * min_ratio:
+            raise RuntimeError(
+                f"Refusing to publish {name}: {count} documents, "
+                f"{alias} has {live_count}"
+            )
+
+
+def publish_generation(names):
+    """ Point every alias to its new index in a single atomic request """
+    es = connections.get_connection()
+    actions = []
+    for alias, name in names.items():
+        live = live_index(alias)
+        if live == alias:
+            # a plain index is in the way of the alias
+            actions.append({"remove_index": {"index": alias}})
+        elif live is not None:
+            actions.append({"remove": {"index": live, "alias": alias}})
+        actions.append({"add": {"index": name, "alias": alias}})
+
+    es.indices.update_aliases(body={"actions": actions})
+    print("Published: " + ", ".join(
+        f"{alias} -> {name}" for alias, name in names.items()
+    ))
+
+
+def cleanup_generations(names, keep=2):
+    """ Delete all but the `keep` most recent generations of each alias """
+    es = connections.get_connection()
+    for alias, name in names.items():
+        live = live_index(alias)
+        old = [
+            gen for gen in list_generations(alias)
+            if gen != live and gen != name
+        ]
+        # the live generation counts towards the kept ones
+        for gen in old[:max(0, len(old) - (keep - 1))]:
+            print(f"Deleting old generation: {gen}")
+            es.indices.delete(index=gen)
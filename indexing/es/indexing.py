@@ -1,4 +1,7 @@
-from elasticsearch_dsl import Text, Keyword, Document, Index, Date
+import math
+
+from contextlib import contextmanager
+from elasticsearch_dsl import Text, Keyword, Document, Index, Date, Search
 
 
 index_settings = {"similarity": {"default": {"type": "BM25"}}}
@@ -45,18 +48,41 @@ class Paragraph_with_abs(Base):
         settings = index_settings
 
 
+class Paragraph_slim(Document):
+    # only what paragraphs are searched and filtered by, the rest of the
+    # paper is looked up in `papers` (see `paper_fields`)
+    cord_uid = Keyword()
+    paragraph_id = Keyword()
+    body = Text()
+    publish_time = Date()
+
+    class Index:
+        name = "paragraphs"
+        settings = index_settings
+
+
 class Abstract(Base):
     class Index:
         name = "abstracts"
         settings = index_settings
 
 
+# called with the new version whenever a `Version` is saved
+version_listeners = []
+
+
 class Version(Document):
     version = Date()
 
     class Index:
         name = "cord_version"
 
+    def save(self, **kwargs):
+        ret = super().save(**kwargs)
+        for listener in list(version_listeners):
+            listener(self.version)
+        return ret
+
 
 index_map = {
     "papers": Paper,
@@ -71,16 +97,168 @@ index_with_abs_map = {
 }
 
 
-def init_index(with_abs=False):
-    global index_map, index_with_abs_map
-    index_dict = index_with_abs_map if with_abs else index_map
-    for name, index in index_dict.items():
-        if not Index(name).exists():
-            index.init()
+# rough size on disk of the documents of one paper in each index, used to
+# size new indices
+bytes_per_paper = {
+    Paper: 40_000,
+    Paper_with_abs: 42_000,
+    Paragraph: 45_000,
+    Paragraph_with_abs: 110_000,
+    Paragraph_slim: 35_000,
+    Abstract: 2_000,
+}
+target_shard_bytes = 30 * 1024 ** 3
+best_compression_bytes = 5 * 1024 ** 3
+
+
+# cheap ingest: no refreshes, no replicas, translog fsync in background
+bulk_load_settings = {
+    "index.refresh_interval": "-1",
+    "index.number_of_replicas": 0,
+    "index.translog.durability": "async",
+}
+
+
+def index_docs(with_abs=False, slim=False):
+    # Document class of each index
+    index_dict = dict(index_with_abs_map if with_abs else index_map)
+    if slim:
+        index_dict["paragraphs"] = Paragraph_slim
+    return index_dict
+
+
+def index_profiles(
+    num_papers, with_abs=False, shards=None, best_compression=None,
+    slim=False
+):
+    """ Creation settings of each index for a corpus of `num_papers`.
+
+    By default shards hold ~30GB each and indices over 5GB use the
+    `best_compression` codec. `shards` ({index: count}) and
+    `best_compression` (index names) override the defaults.
+    """
+    shards = shards or {}
+    profiles = {}
+    for name, index in index_docs(with_abs, slim).items():
+        est_bytes = num_papers * bytes_per_paper[index]
+        profile = {
+            "number_of_shards": shards.get(
+                name, max(1, math.ceil(est_bytes / target_shard_bytes))
+            )
+        }
+        if best_compression is None:
+            compress = est_bytes > best_compression_bytes
+        else:
+            compress = name in best_compression
+        if compress:
+            profile["codec"] = "best_compression"
+        profiles[name] = profile
+
+    return profiles
+
+
+def index_names(with_abs=False, generation=None):
+    # name of the concrete index behind each index (alias when versioned)
+    return {
+        name: name if generation is None else f"{name}-{generation}"
+        for name in index_docs(with_abs).keys()
+    }
+
+
+def init_index(with_abs=False, profiles=None, names=None, slim=False):
+    profiles = profiles or {}
+    names = names or index_names(with_abs)
+    for name, index in index_docs(with_abs, slim).items():
+        if not Index(names[name]).exists():
+            new_index = index._index.clone(name=names[name])
+            new_index.settings(**profiles.get(name, {}))
+            new_index.save()
 
     Version.init()
 
 
+@contextmanager
+def bulk_load(with_abs=False, merge_timeout=3600, names=None, merge=True):
+    """ Cheap ingest settings on the indices while inside the block.
+
+    The previous settings are restored on exit, after a successful block
+    the indices are also refreshed and, with `merge`, force merged to a
+    single segment (not worth it for the few documents of an incremental
+    run).
+    """
+    names = names or index_names(with_abs)
+    saved = {}
+    for name in names.values():
+        index = Index(name)
+        settings = index.get_settings(flat_settings=True)[name]["settings"]
+        # missing keys are restored as None, back to the default
+        saved[name] = {key: settings.get(key) for key in bulk_load_settings}
+        index.put_settings(body=bulk_load_settings)
+
+    try:
+        yield
+    finally:
+        for name, settings in saved.items():
+            Index(name).put_settings(body=settings)
+
+    for name in names.values():
+        print(f"Refreshing{' and merging' if merge else ''}: {name}")
+        index = Index(name)
+        index.refresh()
+        if merge:
+            index.forcemerge(
+                max_num_segments=1, request_timeout=merge_timeout
+            )
+
+
+def delete_papers(cord_uids, with_abs=False, batch_size=1000, names=None):
+    # remove every document (paper, paragraphs and abstract) of the papers
+    names = names or index_names(with_abs)
+    search = Search(index=list(names.values())) \
+        .params(ignore_unavailable=True)
+    if search.count() == 0:
+        # nothing to delete, skip one request per batch on fresh indices
+        return
+
+    cord_uids = sorted(cord_uids)
+    for i in range(0, len(cord_uids), batch_size):
+        search \
+            .filter("terms", cord_uid=cord_uids[i:i + batch_size]) \
+            .params(conflicts="proceed", refresh=True) \
+            .delete()
+
+
+def paper_fields(cord_uids, index="papers"):
+    """ Fields of the papers of `cord_uids` but their body, by cord_uid.
+
+    The lookup of slim paragraphs, which only keep their cord_uid.
+    """
+    cord_uids = sorted(set(cord_uids))
+    if len(cord_uids) == 0:
+        return {}
+
+    search = Search(index=index) \
+        .filter("terms", cord_uid=cord_uids) \
+        .source(excludes=["body"])
+    return {
+        hit.cord_uid: hit.to_dict()
+        for hit in search[:len(cord_uids)].execute()
+    }
+
+
+def resolve_paragraphs(hits, index="papers"):
+    # slim paragraph hits (or sources) as complete paragraph documents
+    sources = [
+        hit.to_dict() if hasattr(hit, "to_dict") else dict(hit)
+        for hit in hits
+    ]
+    papers = paper_fields((source["cord_uid"] for source in sources), index)
+    return [
+        dict(papers.get(source["cord_uid"], {}), **source)
+        for source in sources
+    ]
+
+
 """
 def get_or_create_index(index_name="papers", addr="localhost", port=9200):
     connections.create_connection(hosts=[f"{addr}:{port}"])
@@ -0,0 +1,139 @@
+import os
+import gzip
+import json
+import time
+
+from pathlib import Path
+from collections import Counter
+
+
+MANIFEST = "manifest.json"
+
+
+class NDJSONSink:
+    """ Writes bulk actions into gzipped NDJSON files, for a later replay.
+
+    Takes the actions of `BulkSink` (`add`, `extend`, context manager) but
+    writes them in the bulk format (an action line and a source line per
+    document) into `<index>-<shard>.ndjson.gz` files of `export_dir`, a new
+    shard every `shard_docs` documents. On close, `manifest.json` lists the
+    files (index, documents, bytes) and `info` about the export. Shards
+    are renamed into place once complete and the manifest is written last,
+    so an interrupted export has no manifest.
+    """
+
+    def __init__(
+        self, export_dir, shard_docs=100_000, info=None, compresslevel=6
+    ):
+        self.export_dir = Path(export_dir)
+        self.shard_docs = shard_docs
+        self.info = info or {}
+        self.compresslevel = compresslevel
+        self.stats = Counter()
+        self.open_files = {}
+        self.files = []
+        self.export_dir.mkdir(parents=True, exist_ok=True)
+        # whatever a previous export left
+        for path in self.export_dir.glob("*.ndjson.gz*"):
+            path.unlink()
+        self.export_dir.joinpath(MANIFEST).unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            for index in list(self.open_files):
+                self.open_files.pop(index)["file"].close()
+
+    def add(self, action):
+        index = action["_index"]
+        source = action["_source"]
+        if not isinstance(source, str):
+            source = json.dumps(source)
+
+        shard = self.open_files.get(index)
+        if shard is None or shard["docs"] >= self.shard_docs:
+            shard = self._next_shard(index)
+        meta = {"_index": index}
+        if "_id" in action:
+            meta.update(_id=action["_id"])
+        line = json.dumps({"index": meta}) + "\n" + source + "\n"
+        shard["file"].write(line)
+        shard["docs"] += 1
+        shard["bytes"] += len(line)
+
+    def extend(self, actions):
+        for action in actions:
+            self.add(action)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        for index in list(self.open_files):
+            self._close_shard(index)
+
+        manifest = dict(
+            self.info,
+            created=time.strftime("%Y-%m-%dT%H:%M:%S"),
+            docs=dict(self.stats),
+            files=self.files,
+        )
+        tmp_path = self.export_dir.joinpath(f"{MANIFEST}.tmp")
+        tmp_path.write_text(json.dumps(manifest, indent=2))
+        os.replace(tmp_path, self.export_dir.joinpath(MANIFEST))
+        print(
+            f"Exported {sum(self.stats.values())} documents into "
+            f"{len(self.files)} files in {self.export_dir}"
+        )
+
+    def _next_shard(self, index):
+        if index in self.open_files:
+            self._close_shard(index)
+        number = sum(1 for entry in self.files if entry["index"] == index)
+        name = f"{index}-{number:05d}.ndjson.gz"
+        shard = dict(
+            name=name,
+            docs=0,
+            bytes=0,
+            file=gzip.open(
+                self.export_dir.joinpath(f"{name}.tmp"), "wt",
+                compresslevel=self.compresslevel
+            ),
+        )
+        self.open_files[index] = shard
+        return shard
+
+    def _close_shard(self, index):
+        shard = self.open_files.pop(index)
+        shard["file"].close()
+        os.replace(
+            self.export_dir.joinpath(f"{shard['name']}.tmp"),
+            self.export_dir.joinpath(shard["name"]),
+        )
+        self.files.append(dict(
+            file=shard["name"], index=index, docs=shard["docs"],
+            bytes=shard["bytes"],
+        ))
+        self.stats[index] += shard["docs"]
+
+
+def read_manifest(export_dir):
+    path = Path(export_dir).joinpath(MANIFEST)
+    if not path.exists():
+        raise FileNotFoundError(
+            f"No {MANIFEST} in {export_dir}, missing or incomplete export"
+        )
+    return json.loads(path.read_text())
+
+
+def iter_actions(path, index):
+    # bulk actions of an exported file, the sources are not parsed
+    with gzip.open(path, "rt") as fin:
+        for line in fin:
+            action = dict(json.loads(line)["index"], _index=index)
+            action.update(_source=next(fin).rstrip("\n"))
+            yield action
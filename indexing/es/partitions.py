@@ -0,0 +1,85 @@
+import socket
+
+from datetime import datetime
+from elasticsearch import NotFoundError
+from elasticsearch_dsl import (
+    Document, Keyword, Integer, Long, Date, Search, connections
+)
+
+
+class Partition(Document):
+    """ Completion marker of a partition of a release """
+    release = Keyword()
+    partition = Integer()
+    partitions = Integer()
+    docs = Long()
+    failed = Long()
+    host = Keyword()
+    finished = Date()
+
+    class Index:
+        name = "cord_partitions"
+
+
+def marker_id(release, index, count):
+    return f"{release}-{index}-of-{count}"
+
+
+def clear_partition(release, index, count):
+    # a rerun is not finished until it says so
+    es = connections.get_connection()
+    try:
+        es.delete(
+            index=Partition._index._name,
+            id=marker_id(release, index, count),
+            refresh=True,
+        )
+    except NotFoundError:
+        pass
+
+
+def mark_partition(release, index, count, docs=0, failed=0):
+    Partition.init()
+    marker = Partition(
+        release=release,
+        partition=index,
+        partitions=count,
+        docs=docs,
+        failed=failed,
+        host=socket.gethostname(),
+        finished=datetime.now(),
+    )
+    marker.meta.id = marker_id(release, index, count)
+    marker.save(refresh=True)
+    print(f"Partition {index}/{count} of {release} finished")
+
+
+def check_partitions(release, count):
+    """ Raise unless all `count` partitions of `release` indexed everything """
+    search = Search(index=Partition._index._name) \
+        .params(ignore_unavailable=True) \
+        .filter("term", release=release) \
+        .filter("term", partitions=count)
+    markers = {hit.partition: hit for hit in search[:count].execute()}
+    for index, marker in sorted(markers.items()):
+        print(
+            f"Partition {index}/{count}: {marker.docs} documents "
+            f"({marker.failed} failed) on {marker.host} at {marker.finished}"
+        )
+
+    missing = sorted(set(range(count)) - markers.keys())
+    if len(missing):
+        raise RuntimeError(
+            f"Partitions of {release} not finished: "
+            + ", ".join(f"{index}/{count}" for index in missing)
+        )
+    # run again, the documents that went through are overwritten
+    failed = sorted(
+        index for index, marker in markers.items() if marker.failed
+    )
+    if len(failed):
+        raise RuntimeError(
+            f"Partitions of {release} with rejected documents: "
+            + ", ".join(f"{index}/{count}" for index in failed)
+        )
+    return markers
@@ -0,0 +1,93 @@
+import json
+
+from functools import lru_cache
+
+
+class Shared:
+    """ Fields shared by every document of a paper, serialized only once """
+
+    __slots__ = ("fields", "json")
+
+    def __init__(self, fields):
+        self.fields = fields
+        # members of the json object, without braces, to splice into the
+        # source of each document
+        self.json = json.dumps(fields)[1:-1]
+
+
+class Record:
+    """ Lightweight stand-in for the Document classes in `es.indexing`.
+
+    Holds the index name, the fields shared with the rest of the paper
+    (not copied) and its own fields. Supports the item and attribute reads
+    the pipeline does on documents, `to_dict` like `Document.to_dict` and
+    `to_action`, a bulk action whose source is already serialized. Their
+    `_id` is the cord_uid, plus the paragraph_id for paragraphs.
+    """
+
+    __slots__ = ("index", "shared", "fields")
+
+    def __init__(self, index, shared, fields):
+        self.index = index
+        self.shared = shared
+        self.fields = fields
+
+    def __getitem__(self, key):
+        if key in self.fields:
+            return self.fields[key]
+        return self.shared.fields[key]
+
+    def __getattr__(self, key):
+        # only reached for names that are not slots
+        if key in Record.__slots__:
+            raise AttributeError(key)
+        try:
+            return self[key]
+        except KeyError:
+            raise AttributeError(key)
+
+    def source(self):
+        members = [json.dumps(self.fields)[1:-1], self.shared.json]
+        return "{" + ", ".join(m for m in members if m != "") + "}"
+
+    def doc_id(self):
+        # deterministic, so indexing a document again overwrites it
+        if "paragraph_id" in self.fields:
+            return f"{self['cord_uid']}-{self.fields['paragraph_id']}"
+        return self["cord_uid"]
+
+    def to_action(self):
+        # the client sends string sources as they are
+        return {
+            "_index": self.index, "_id": self.doc_id(),
+            "_source": self.source(),
+        }
+
+    def to_dict(self, include_meta=False):
+        source = dict(self.shared.fields, **self.fields)
+        if include_meta:
+            return {
+                "_index": self.index, "_id": self.doc_id(), "_source": source
+            }
+        return source
+
+
+class RecordType:
+    """ Builds records for the index and mapping of a Document class """
+
+    def __init__(self, doc_cls):
+        self.index = doc_cls._index._name
+        self.fields = frozenset(doc_cls._doc_type.mapping)
+
+    def __call__(self, shared, **fields):
+        unknown = (fields.keys() | shared.fields.keys()) - self.fields
+        if len(unknown):
+            raise ValueError(
+                f"Fields not in the mapping of `{self.index}`: {unknown}"
+            )
+        return Record(self.index, shared, fields)
+
+
+@lru_cache(maxsize=None)
+def record_type(doc_cls):
+    return RecordType(doc_cls)
@@ -0,0 +1,262 @@
+import json
+import time
+import queue
+import threading
+
+from datetime import datetime
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+from elasticsearch_dsl import MultiSearch
+
+from es.indexing import Abstract, Version, index_docs, version_listeners
+
+
+def filtered_search(
+    search, text, journal=None, authors=None, since=None, until=None,
+    size=10
+):
+    # BM25 match of `text` on the body, filtered by exact journal and
+    # authors and a [since, until) publish_time range
+    search = search.query("match", body=text)
+    if journal is not None:
+        search = search.filter("term", **{"journal.keyword": journal})
+    if authors is not None:
+        search = search.filter("term", **{"authors.keyword": authors})
+    if since is not None or until is not None:
+        bounds = {}
+        if since is not None:
+            bounds.update(gte=since)
+        if until is not None:
+            bounds.update(lt=until)
+        search = search.filter("range", publish_time=bounds)
+    return search[:size]
+
+
+def paper_search(text, with_abs=False, index="papers", **filters):
+    """ Search of papers, hits are `Paper` (or `Paper_with_abs`) """
+    doc_cls = index_docs(with_abs)["papers"]
+    return filtered_search(doc_cls.search(index=index), text, **filters)
+
+
+def paragraph_search(
+    text, with_abs=False, slim=False, index="paragraphs", **filters
+):
+    """ Search of paragraphs, hits are `Paragraph` documents.
+
+    Slim paragraphs can not be filtered by journal or authors, see
+    `resolve_paragraphs` for the rest of their fields.
+    """
+    doc_cls = index_docs(with_abs, slim)["paragraphs"]
+    return filtered_search(doc_cls.search(index=index), text, **filters)
+
+
+def abstract_search(text, index="abstracts", **filters):
+    """ Search of abstracts, hits are `Abstract` documents """
+    return filtered_search(Abstract.search(index=index), text, **filters)
+
+
+def version_str(version):
+    # a cord_version as read back from the index, whatever it was saved as
+    value = Version._doc_type.mapping["version"].deserialize(version)
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    return str(value)
+
+
+def current_version(using="default"):
+    # latest saved cord_version, None before the first one
+    search = Version.search(using=using) \
+        .params(ignore_unavailable=True) \
+        .sort("-version")[:1]
+    hits = search.execute().hits
+    return version_str(hits[0].version) if len(hits) else None
+
+
+class CachedSearch:
+    """ Runs searches in `_msearch` batches, caching their responses.
+
+    Searches submitted concurrently (eg: by the threads of a server) are
+    collected by a background thread for up to `max_wait` seconds, or
+    `max_batch` searches, and sent in a single `_msearch` request, the
+    same search submitted twice in a batch is sent once.
+
+    Responses are kept in an LRU cache of `max_size` entries for `ttl`
+    seconds, keyed by the indices and body of the search and the current
+    `cord_version`. The cache is cleared when a new `Version` is saved in
+    this process (it becomes the current one, if newer) and when the
+    latest version changes otherwise (eg: the weekly indexing), which is
+    checked every `version_ttl` seconds. Responses to searches sent before
+    the version changed are not cached.
+    """
+
+    def __init__(
+        self, using="default", max_size=1024, ttl=300, max_batch=32,
+        max_wait=0.005, version_ttl=30
+    ):
+        self.using = using
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.version_ttl = version_ttl
+        self.stats = Counter()
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.version_lock = threading.Lock()
+        self.version = None
+        self.version_checked = None
+        self.pending = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        version_listeners.append(self.invalidate)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.invalidate in version_listeners:
+            version_listeners.remove(self.invalidate)
+        self.pending.put(None)
+        self.thread.join()
+
+    def search(self, search):
+        """ Response of `search`, blocks until it is available """
+        return self.submit(search).result()
+
+    def msearch(self, searches):
+        # responses of `searches`, in order, sent together
+        futures = [self.submit(search) for search in searches]
+        return [future.result() for future in futures]
+
+    def submit(self, search):
+        """ Future of the response of `search` """
+        key = self._key(search)
+        future = Future()
+        response = self._cached(key)
+        if response is not None:
+            future.set_result(response)
+        else:
+            self.pending.put((key, search, future))
+        return future
+
+    def invalidate(self, version=None):
+        # a saved `version` replaces the current one if newer, without
+        # searching again. Otherwise it is looked up by the next search
+        with self.lock:
+            self.cache.clear()
+            if version is None or self.version_checked is None:
+                self.version_checked = None
+                return
+            version = version_str(version)
+            if self.version is None or version > self.version:
+                self.version = version
+            self.version_checked = time.monotonic()
+
+    def _key(self, search):
+        return json.dumps(
+            [search._index, search.to_dict()], sort_keys=True, default=str
+        ) + f"@{self._current_version()}"
+
+    def _fresh_version(self):
+        with self.lock:
+            return self.version_checked is not None and (
+                time.monotonic() - self.version_checked < self.version_ttl
+            )
+
+    def _current_version(self):
+        if self._fresh_version():
+            return self.version
+
+        # a single lookup when several threads find it stale
+        with self.version_lock:
+            if self._fresh_version():
+                return self.version
+            version = current_version(self.using)
+            with self.lock:
+                if version != self.version:
+                    self.cache.clear()
+                self.version = version
+                self.version_checked = time.monotonic()
+        return version
+
+    def _cached(self, key):
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.stats["misses"] += 1
+                return None
+            self.cache.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[1]
+
+    def _store(self, key, response):
+        with self.lock:
+            if not key.endswith(f"@{self.version}"):
+                # sent before the version changed, would never be hit
+                return
+            self.cache[key] = (time.monotonic() + self.ttl, response)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+
+    def _next_batch(self):
+        # pending searches by key, None once closed
+        item = self.pending.get()
+        if item is None:
+            return None
+        batch = {}
+        deadline = time.monotonic() + self.max_wait
+        while item is not None:
+            key, search, future = item
+            batch.setdefault(key, (search, []))[1].append(future)
+            if len(batch) >= self.max_batch:
+                break
+            try:
+                item = self.pending.get(
+                    timeout=max(0, deadline - time.monotonic())
+                )
+            except queue.Empty:
+                break
+            if item is None:
+                # close once this batch is sent
+                self.pending.put(None)
+        return batch
+
+    def _run(self):
+        while (batch := self._next_batch()) is not None:
+            self._send(batch)
+
+    def _send(self, batch):
+        multi = MultiSearch(using=self.using)
+        for search, _ in batch.values():
+            multi = multi.add(search)
+        try:
+            responses = multi.execute(raise_on_error=False)
+        except Exception as e:
+            for _, futures in batch.values():
+                for future in futures:
+                    future.set_exception(e)
+            return
+
+        self.stats["requests"] += 1
+        self.stats["searches"] += len(batch)
+        for (key, (search, futures)), response in zip(
+            batch.items(), responses
+        ):
+            error = None
+            if response is None:
+                # failed, run alone to get the error
+                try:
+                    response = search.execute()
+                except Exception as e:
+                    error = e
+            if error is None:
+                self._store(key, response)
+            for future in futures:
+                if error is None:
+                    future.set_result(response)
+                else:
+                    future.set_exception(error)
@@ -1,8 +1,13 @@
+import os
+
 from pyspark.sql import SparkSession
 
 
-components_path = "/data/qaservers/search/spark/config/elasticsearch-hadoop-7.13.1"  # noqa: E501
-elastispark = f"{components_path}/dist/elasticsearch-spark-20_2.11-7.13.1.jar"
+# es-hadoop for spark 3.x (scala 2.12, as pyspark 3.x) and elasticsearch 8
+components_path = "/data/qaservers/search/spark/config/elasticsearch-hadoop-8.13.4"  # noqa: E501
+elastispark = f"{components_path}/dist/elasticsearch-spark-30_2.12-8.13.4.jar"
+# fetched from maven central when the jar is not there
+elastispark_package = "org.elasticsearch:elasticsearch-spark-30_2.12:8.13.4"
 
 
 def get_session(spark_config=None, es_config=None):
@@ -10,14 +15,25 @@ def get_session(spark_config=None, es_config=None):
     es_config = es_config or {}
     sp_addr = spark_config.get("addr", "localhost")
     sp_port = spark_config.get("port", 7077)
+    # eg: `local[*]` to run everything in this machine
+    master = spark_config.get("master", f"spark://{sp_addr}:{sp_port}")
+    jar = spark_config.get("jar")
+    if jar is None and os.path.exists(elastispark):
+        jar = elastispark
+    es_addr = es_config.get("addr", "localhost")
     es_port = es_config.get("port", 9200)
-    print(f"Connecting to spark {sp_addr}:{sp_port}")
+    print(f"Connecting to spark {master}")
 
-    return SparkSession \
-        .builder \
-        .master(f"spark://{sp_addr}:{sp_port}") \
-        .appName("ElasticSpark-1") \
-        .config("spark.driver.extraClassPath", elastispark) \
+    builder = SparkSession.builder.master(master).appName("ElasticSpark-1")
+    if jar is not None:
+        builder = builder \
+            .config("spark.driver.extraClassPath", jar) \
+            .config("spark.jars", jar)
+    else:
+        print(f"No {elastispark}, using {elastispark_package}")
+        builder = builder.config("spark.jars.packages", elastispark_package)
+    return builder \
+        .config("spark.es.nodes", es_addr) \
         .config("spark.es.port", es_port) \
         .config("spark.driver.memory", "8G") \
         .config("spark.executor.memory", "12G") \
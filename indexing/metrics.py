@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import threading
+
+from collections import Counter
+from contextlib import contextmanager
+
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class Metrics:
+    """ Per-stage timers, counters and histograms of an indexing run.
+
+    Counters take labels as keyword arguments (eg: `docs`, index=papers).
+    Parse workers keep their own metrics and hand them to the parent with
+    their results (`pop` / `merge`), so stage times are summed over every
+    process and may add up to more than the duration of the run.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.seconds = Counter()
+        self.counters = Counter()
+        self.histograms = {}
+
+    def add_time(self, stage, secs):
+        with self.lock:
+            self.seconds[stage] += secs
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def timed_iter(self, iterable, stage):
+        # time spent producing each item, not consuming it
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(stage, time.perf_counter() - start)
+                return
+            self.add_time(stage, time.perf_counter() - start)
+            yield item
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS):
+        with self.lock:
+            hist = self.histograms.setdefault(name, dict(
+                buckets=list(buckets), counts=[0] * len(buckets),
+                count=0, sum=0.0,
+            ))
+            for i, bound in enumerate(hist["buckets"]):
+                if value <= bound:
+                    hist["counts"][i] += 1
+                    break
+            hist["count"] += 1
+            hist["sum"] += value
+
+    def pop(self):
+        """ Picklable state, resetting it (to send it to another process) """
+        with self.lock:
+            state = (self.seconds, self.counters, self.histograms)
+            self.seconds, self.counters, self.histograms = \
+                Counter(), Counter(), {}
+        return state
+
+    def merge(self, state):
+        seconds, counters, histograms = state
+        with self.lock:
+            self.seconds.update(seconds)
+            self.counters.update(counters)
+            for name, other in histograms.items():
+                hist = self.histograms.setdefault(name, dict(
+                    other, counts=[0] * len(other["counts"]),
+                    count=0, sum=0.0,
+                ))
+                hist["counts"] = [
+                    a + b for a, b in zip(hist["counts"], other["counts"])
+                ]
+                hist["count"] += other["count"]
+                hist["sum"] += other["sum"]
+
+    def report(self, **info):
+        counters = {}
+        for (name, labels), value in sorted(self.counters.items()):
+            if len(labels) == 0:
+                counters[name] = value
+                continue
+            label = ",".join(f"{k}={v}" for k, v in labels)
+            counters.setdefault(name, {})[label] = value
+
+        return dict(
+            info,
+            started=time.strftime(
+                "%Y-%m-%dT%H:%M:%S", time.localtime(self.started)
+            ),
+            duration_seconds=round(time.time() - self.started, 3),
+            stage_seconds={
+                stage: round(secs, 3)
+                for stage, secs in sorted(self.seconds.items())
+            },
+            counters=counters,
+            histograms=self.histograms,
+        )
+
+    def write_json(self, path, **info):
+        write_atomic(path, json.dumps(self.report(**info), indent=2))
+        print(f"Run report written to: {path}")
+
+    def write_prometheus(self, path, prefix="cord19_index", success=True):
+        """ Textfile for the node_exporter textfile collector """
+        lines = []
+
+        def gauge(name, help_text, samples):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            for labels, value in samples:
+                lines.append(f"{prefix}_{name}{format_labels(labels)} {value}")
+
+        gauge("last_run_timestamp_seconds", "End of the last run", [
+            ((), round(time.time(), 3))
+        ])
+        gauge("last_run_success", "Whether the last run succeeded", [
+            ((), int(success))
+        ])
+        gauge("run_duration_seconds", "Duration of the last run", [
+            ((), round(time.time() - self.started, 3))
+        ])
+        gauge("stage_seconds", "Time spent in each stage of the last run", [
+            ((("stage", stage),), round(secs, 6))
+            for stage, secs in sorted(self.seconds.items())
+        ])
+        by_name = {}
+        for (name, labels), value in sorted(self.counters.items()):
+            by_name.setdefault(name, []).append((labels, value))
+        for name, samples in by_name.items():
+            gauge(name, f"{name} of the last run", samples)
+
+        for name, hist in sorted(self.histograms.items()):
+            lines.append(f"# HELP {prefix}_{name} {name} of the last run")
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            cumulative = 0
+            for bound, count in zip(hist["buckets"], hist["counts"]):
+                cumulative += count
+                lines.append(
+                    f'{prefix}_{name}_bucket{{le="{bound}"}} {cumulative}'
+                )
+            lines.append(
+                f'{prefix}_{name}_bucket{{le="+Inf"}} {hist["count"]}'
+            )
+            lines.append(f"{prefix}_{name}_sum {round(hist['sum'], 6)}")
+            lines.append(f"{prefix}_{name}_count {hist['count']}")
+
+        write_atomic(path, "\n".join(lines) + "\n")
+        print(f"Prometheus metrics written to: {path}")
+
+
+def format_labels(labels):
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def write_atomic(path, text):
+    # the collector must never read a half written file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as fout:
+        fout.write(text)
+    os.replace(tmp_path, path)
@@ -0,0 +1,225 @@
+import os
+import time
+import hashlib
+import numpy as np
+import pyarrow as pa
+
+from pathlib import Path
+
+
+# bump when the cached paragraphs change (eg: how parses are split or
+# stripped), segments of other versions are dropped
+FORMAT_VERSION = 1
+
+PARTS_SCHEMA = pa.schema([
+    ("paragraph_id", pa.int32()),
+    ("text", pa.large_string()),
+    ("hit", pa.bool_()),
+])
+
+FILES_SCHEMA = pa.schema([
+    ("file", pa.string()),
+    ("mtime", pa.int64()),
+    ("size", pa.int64()),
+    ("offset", pa.int64()),
+    ("count", pa.int64()),
+])
+
+
+def write_table(path, table):
+    tmp_path = f"{path}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def cache_key(keywords):
+    # what the cached entries depend on besides the json files
+    digest = hashlib.sha1("\n".join(keywords).encode()).hexdigest()
+    return f"{FORMAT_VERSION}-{digest}"
+
+
+def read_table(path):
+    # memory mapped, the columns are not copied into memory
+    return pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+
+
+class ParseCache:
+    """ Parsed json files, stored as Arrow segments in `cache_dir`.
+
+    Keeps the non empty, stripped paragraphs of each json file (as
+    (paragraph_id, text, keyword hit)) keyed by the file name and the mtime
+    and size it had when parsed. Each segment is a `.parts.arrow` table
+    with a row per paragraph and a `.files.arrow` table locating the
+    paragraphs of each file, segments are memory mapped when loaded and
+    newer entries of a file replace older ones.
+
+    The keyword hits depend on `keywords`, segments written for other
+    keywords (or another `FORMAT_VERSION`) are deleted when loading.
+
+    New entries are kept until `save` or until they take `flush_mb`, then
+    written as a new segment. Once there are more than `max_segments`, they
+    are merged into one without the replaced entries.
+    """
+
+    def __init__(
+        self, cache_dir, keywords=(), flush_mb=256, max_segments=32
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.key = cache_key(keywords)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.flush_bytes = flush_mb * 1024 * 1024
+        self.max_segments = max_segments
+        self.pending = []
+        self.pending_bytes = 0
+        self.load()
+
+    def segment_names(self):
+        # only complete segments, the files table is written last
+        return sorted(
+            path.name[:-len(".files.arrow")]
+            for path in self.cache_dir.glob("segment-*.files.arrow")
+        )
+
+    def load(self):
+        self.segments = []
+        self.index = {}
+        stale = []
+        for name in self.segment_names():
+            files = read_table(self.cache_dir.joinpath(f"{name}.files.arrow"))
+            metadata = files.schema.metadata or {}
+            if metadata.get(b"cache_key") != self.key.encode():
+                stale.append(name)
+                continue
+            parts = read_table(self.cache_dir.joinpath(f"{name}.parts.arrow"))
+            seg = len(self.segments)
+            self.segments.append((name, parts))
+            columns = files.to_pydict()
+            for file, mtime, size, offset, count in zip(
+                columns["file"], columns["mtime"], columns["size"],
+                columns["offset"], columns["count"]
+            ):
+                self.index[file] = (seg, mtime, size, offset, count)
+
+        if len(stale):
+            print(
+                f"Dropping {len(stale)} parse cache segments of other "
+                "keywords or format"
+            )
+            self.remove_segments(stale)
+
+    def __len__(self):
+        return len(self.index)
+
+    def get(self, json_file, mtime, size):
+        entry = self.index.get(json_file)
+        if entry is None or entry[1:3] != (mtime, size):
+            return None
+
+        seg, _, _, offset, count = entry
+        parts = self.segments[seg][1].slice(offset, count)
+        return list(zip(
+            parts.column("paragraph_id").to_pylist(),
+            parts.column("text").to_pylist(),
+            parts.column("hit").to_pylist(),
+        ))
+
+    def put(self, json_file, mtime, size, parts):
+        self.extend([(json_file, mtime, size, parts)])
+
+    def pop(self):
+        # entries added in this process, to hand them to another one
+        pending = self.pending
+        self.pending = []
+        self.pending_bytes = 0
+        return pending
+
+    def extend(self, entries):
+        for entry in entries:
+            self.pending.append(entry)
+            self.pending_bytes += sum(len(text) for _, text, _ in entry[3])
+        if self.pending_bytes >= self.flush_bytes:
+            self.flush()
+
+    def flush(self):
+        entries = self.pop()
+        if len(entries) == 0:
+            return
+
+        files = {name: [] for name in FILES_SCHEMA.names}
+        parts = {name: [] for name in PARTS_SCHEMA.names}
+        offset = 0
+        for json_file, mtime, size, file_parts in entries:
+            for name, value in zip(
+                FILES_SCHEMA.names,
+                (json_file, mtime, size, offset, len(file_parts))
+            ):
+                files[name].append(value)
+            for paragraph_id, text, hit in file_parts:
+                parts["paragraph_id"].append(paragraph_id)
+                parts["text"].append(text)
+                parts["hit"].append(hit)
+            offset += len(file_parts)
+
+        self.write_segment(
+            f"segment-{time.time_ns()}",
+            pa.table(files, schema=FILES_SCHEMA),
+            pa.table(parts, schema=PARTS_SCHEMA),
+        )
+
+    def write_segment(self, name, files, parts):
+        write_table(self.cache_dir.joinpath(f"{name}.parts.arrow"), parts)
+        write_table(
+            self.cache_dir.joinpath(f"{name}.files.arrow"),
+            files.replace_schema_metadata({"cache_key": self.key}),
+        )
+
+    def remove_segments(self, names):
+        # the files table first, a partly removed segment is not loaded
+        for name in names:
+            for kind in ("files", "parts"):
+                self.cache_dir.joinpath(f"{name}.{kind}.arrow").unlink(
+                    missing_ok=True
+                )
+
+    def save(self):
+        self.flush()
+        if len(self.segment_names()) > self.max_segments:
+            self.compact()
+        self.load()
+
+    def compact(self):
+        """ Merge every segment into one, keeping the latest entries """
+        self.load()
+        live = {}
+        for json_file, (seg, mtime, size, offset, count) in \
+                self.index.items():
+            live.setdefault(seg, []).append(
+                (json_file, mtime, size, offset, count)
+            )
+
+        files, parts = [], []
+        offset = 0
+        for seg, (_, table) in enumerate(self.segments):
+            keep = np.zeros(table.num_rows, dtype=bool)
+            entries = sorted(live.get(seg, []), key=lambda e: e[3])
+            for json_file, mtime, size, start, count in entries:
+                keep[start:start + count] = True
+                files.append((json_file, mtime, size, offset, count))
+                offset += count
+            parts.append(table.filter(pa.array(keep)))
+
+        old = [name for name, _ in self.segments]
+        self.write_segment(
+            f"segment-{time.time_ns()}",
+            pa.table(
+                dict(zip(FILES_SCHEMA.names, zip(*files))) if len(files)
+                else {name: [] for name in FILES_SCHEMA.names},
+                schema=FILES_SCHEMA,
+            ),
+            pa.concat_tables(parts) if len(parts)
+            else PARTS_SCHEMA.empty_table(),
+        )
+        self.segments = []
+        self.remove_segments(old)
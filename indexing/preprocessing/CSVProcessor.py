@@ -9,9 +9,24 @@ from datetime import datetime
 class CSVProcessor:
     """ Class that contains methods to process csv data. """
 
+    months = {v: k for k, v in enumerate(calendar.month_abbr)}
+
+    def fix_dates(self, dates, cache=None):
+        """ Fix a whole column, parsing each distinct value only once
+
+        Pass the same `cache` dict to reuse results across chunks.
+        """
+        fixed = {} if cache is None else cache
+        # fix_date handles missing values by their string form anyway
+        dates = dates.fillna("nan")
+        for date in dates.unique():
+            if date not in fixed:
+                fixed[date] = self.fix_date(date)
+        return dates.map(fixed)
+
     def fix_date(self, input_date):
         """ Function """
-        months = {v: k for k, v in enumerate(calendar.month_abbr)}
+        months = self.months
         input_date = str(input_date)
 
         if input_date == "nan":
@@ -10,10 +10,7 @@ from CSVProcessor import CSVProcessor  # noqa: E402
 def fix_dates(input_csv, output_csv):
     df = pd.read_csv(input_csv)
     csv_processor = CSVProcessor()
-    df["publish_time"] = df.apply(
-        lambda row: csv_processor.fix_date(row['publish_time']),
-        axis=1
-    )
+    df["publish_time"] = csv_processor.fix_dates(df["publish_time"])
     output_dir = os.path.dirname(os.path.abspath(output_csv))
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
@@ -0,0 +1,93 @@
+import re
+
+
+KEYWORDS = [
+    "coronavirus 2019",
+    "coronavirus disease 19",
+    "cov2",
+    "cov-2",
+    "covid",
+    "ncov 2019",
+    "2019ncov",
+    "2019-ncov",
+    "2019 ncov",
+    "novel coronavirus",
+    "sarscov2",
+    "sars-cov-2",
+    "sars cov 2",
+    "severe acute respiratory syndrome coronavirus 2",
+    "wuhan coronavirus",
+    "wuhan pneumonia",
+    "wuhan virus"
+]
+
+
+def build_trie(keywords):
+    trie = {}
+    for kw in keywords:
+        node = trie
+        for char in kw:
+            node = node.setdefault(char, {})
+        # empty key marks the end of a keyword
+        node[""] = {}
+
+    return trie
+
+
+def trie_to_regex(node):
+    alternatives = [
+        re.escape(char) + trie_to_regex(child)
+        for char, child in sorted(node.items()) if char != ""
+    ]
+    if len(alternatives) == 0:
+        return ""
+
+    optional = "" in node
+    if len(alternatives) == 1 and not optional:
+        return alternatives[0]
+
+    pattern = "(?:" + "|".join(alternatives) + ")"
+    return pattern + "?" if optional else pattern
+
+
+class KeywordMatcher:
+    """ Matches a set of keywords in a single pass over lowercased text.
+
+    Keywords are compiled into one regex shaped like a trie (shared
+    prefixes are only tested once), so each text is lowercased and scanned
+    once, no matter how many keywords there are.
+    """
+
+    def __init__(self, keywords=None):
+        self.keywords = [
+            kw.lower() for kw in (KEYWORDS if keywords is None else keywords)
+        ]
+        pattern = trie_to_regex(build_trie(self.keywords))
+        self.regex = re.compile(pattern)
+        # lookahead reports every (possibly overlapping) occurrence
+        self.overlapped_regex = re.compile(f"(?=({pattern}))")
+
+    @staticmethod
+    def _join(texts):
+        # keywords never contain a newline, so joining texts can not create
+        # matches across text boundaries
+        return "\n".join(texts).lower()
+
+    def search(self, *texts):
+        """ Whether any keyword appears in any of the given texts """
+        return self.regex.search(self._join(texts)) is not None
+
+    def findall(self, *texts):
+        """ Set of keywords appearing in any of the given texts """
+        text = self._join(texts)
+        found = set()
+        for match in self.overlapped_regex.finditer(text):
+            matched = match.group(1)
+            found.add(matched)
+            # the regex prefers the longest keyword at each position, add
+            # the keywords that are a prefix of it
+            for kw in self.keywords:
+                if kw not in found and matched.startswith(kw):
+                    found.add(kw)
+
+        return found
@@ -0,0 +1,102 @@
+import os
+import sys
+import hashlib
+import pandas as pd
+
+sys.path.append(os.path.dirname(__file__))
+from CSVProcessor import CSVProcessor  # noqa: E402
+
+
+def partition_of(cord_uid, count):
+    # stable across processes and hosts, unlike hash()
+    digest = hashlib.sha1(cord_uid.encode()).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+class MetadataReader:
+    """ Streams metadata.csv as groups of rows sharing a cord_uid.
+
+    Only the columns used for indexing are read, as plain strings, in
+    chunks of `chunksize` rows, fixing `publish_time` on the way. A first
+    pass over the cord_uid column finds the duplicated ids, only the rows of
+    those are kept until all their duplicates have been read, every other
+    row is yielded right away. Each iteration reads the file again.
+
+    With `partition` (index, count), only the cord_uids of that partition
+    (see `partition_of`) are read, all the rows of a cord_uid share it.
+    """
+
+    columns = [
+        "cord_uid",
+        "title",
+        "abstract",
+        "publish_time",
+        "url",
+        "journal",
+        "authors",
+        "pmc_json_files",
+        "pdf_json_files",
+    ]
+
+    def __init__(
+        self, meta_path, fix_dates=True, chunksize=10000, partition=None
+    ):
+        self.meta_path = meta_path
+        self.fix_dates = fix_dates
+        self.chunksize = chunksize
+        self.partition = partition
+        uids = pd.read_csv(
+            meta_path, usecols=["cord_uid"], dtype=str
+        )["cord_uid"]
+        if partition is not None:
+            uids = uids[self.in_partition(uids)]
+        counts = uids.fillna("").value_counts()
+        self.total = len(counts)
+        self.duplicates = counts[counts > 1].to_dict()
+
+    def __len__(self):
+        return self.total
+
+    def in_partition(self, uids):
+        index, count = self.partition
+        return uids.fillna("").map(
+            lambda cord_uid: partition_of(cord_uid, count) == index
+        )
+
+    def iter_chunks(self):
+        csv_processor = CSVProcessor()
+        fixed_dates = {}
+        chunks = pd.read_csv(
+            self.meta_path,
+            usecols=lambda col: col in self.columns,
+            dtype=str,
+            chunksize=self.chunksize,
+        )
+        for chunk in chunks:
+            if self.partition is not None:
+                chunk = chunk[self.in_partition(chunk["cord_uid"])]
+            if self.fix_dates:
+                chunk["publish_time"] = csv_processor.fix_dates(
+                    chunk["publish_time"], fixed_dates
+                )
+            yield chunk.fillna("")
+
+    def __iter__(self):
+        pending = {}
+        for chunk in self.iter_chunks():
+            for row in chunk.to_dict("records"):
+                cord_uid = row["cord_uid"]
+                count = self.duplicates.get(cord_uid)
+                if count is None:
+                    yield [row]
+                    continue
+
+                rows = pending.setdefault(cord_uid, [])
+                rows.append(row)
+                if len(rows) == count:
+                    del pending[cord_uid]
+                    yield rows
+
+        # only if the file changed between passes
+        for rows in pending.values():
+            yield rows
@@ -1,26 +1,72 @@
 import os
 import sys
 import json
+import time
+import asyncio
+import hashlib
+import tarfile
 import argparse
-import pandas as pd
 
 from tqdm import tqdm
+from contextlib import nullcontext
+from elasticsearch import BadRequestError
+from elasticsearch_dsl import Index
 from pathlib import Path
 from functools import partial
-from collections import defaultdict
-from elasticsearch.helpers import bulk
+from collections import defaultdict, deque, Counter
+from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 sys.path.append(os.path.dirname(__file__))
 from es.indexing import (   # noqa: E402
     init_index,
+    index_names,
+    index_profiles,
+    bulk_load as bulk_load_profile,
+    delete_papers,
     Paper,
     Paper_with_abs,
     Paragraph,
     Paragraph_with_abs,
+    Paragraph_slim,
     Abstract,
     Version,
 )
-from es.es_connector import get_connection  # noqa: E402
+from es.es_connector import get_connection, get_async_connection  # noqa
+from es.bulk_sink import BulkSink  # noqa: E402
+from es.async_sink import AsyncBulkSink  # noqa: E402
+from es.ndjson_sink import NDJSONSink  # noqa: E402
+from es.generations import (  # noqa: E402
+    is_published,
+    check_unpublished,
+    prepare_generation,
+    clone_generation,
+    verify_generation,
+    publish_generation,
+    cleanup_generations,
+)
+from es.records import Record, Shared, record_type  # noqa: E402
+from es.partitions import (  # noqa: E402
+    clear_partition,
+    mark_partition,
+    check_partitions,
+)
+from state_store import StateStore  # noqa: E402
+from checkpoint import Checkpoint  # noqa: E402
+from metrics import Metrics  # noqa: E402
+from parse_cache import ParseCache  # noqa: E402
+from preprocessing.keywords import KeywordMatcher  # noqa: E402
+from preprocessing.metadata_reader import MetadataReader  # noqa: E402
+
+
+kword_matcher = KeywordMatcher()
+# of this process, workers send theirs back with their results
+metrics = Metrics()
+# set by `process_metadata` when caching parses, and in the workers by
+# `init_worker`
+parse_cache = None
+# set the same way, index `Paragraph_slim` documents
+slim_paragraphs = False
 
 
 def get_parser(parser=None, requires=True):
@@ -35,13 +81,11 @@ def get_parser(parser=None, requires=True):
         "-d", "--data_dir", type=str, required=requires,
         help="Directory containing cord19 data"
     )
+    add_connection_args(parser)
     parser.add_argument(
-        "-a", "--address", type=str, default="0.0.0.0",
-        help="Elastic search address"
-    )
-    parser.add_argument(
-        "-p", "--port", type=int, default=9200,
-        help="Elastic search port"
+        "--parses_tar", type=str, default=None,
+        help="Stream json parses from this `document_parses.tar.gz` instead "
+        "of reading them from `<data_dir>`"
     )
     parser.add_argument(
         "-i", "--incl_abs", action="store_true",
@@ -49,30 +93,211 @@ def get_parser(parser=None, requires=True):
         "wont create <abstracts> index"
     )
     parser.add_argument(
-        "-bs", "--batch_size", type=int, default=100,
-        help="Batch size for bulk saving"
+        "--slim_paragraphs", action="store_true",
+        help="Only keep cord_uid, paragraph_id, body and publish_time in "
+        "<paragraphs>, the rest of the paper is looked up in <papers>"
+    )
+    add_bulk_args(parser)
+    add_index_args(parser)
+    parser.add_argument(
+        "--incremental", action="store_true",
+        help="Only index new or changed papers (and delete removed ones) "
+        "since the last incremental run"
+    )
+    parser.add_argument(
+        "--state_db", type=str, default=None,
+        help="SQLite file with the state of incremental runs "
+        "(default: `<data_dir>/../index_state.sqlite`)"
+    )
+    parser.add_argument(
+        "--skip_published", action="store_true",
+        help="Do nothing when the generation of the release is already "
+        "published (with --versioned), instead of failing"
+    )
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="Skip the papers a previous (failed) run of the same release "
+        "and settings already indexed, as recorded in its checkpoint"
+    )
+    parser.add_argument(
+        "--checkpoint", type=str, default=None,
+        help="File where the indexed papers are recorded after each bulk "
+        "request (default: `<data_dir>/index_checkpoint.txt`)"
+    )
+    parser.add_argument(
+        "--partition", type=parse_partition, default=None, metavar="I/N",
+        help="Only index the I-th (from 0) of N disjoint partitions of the "
+        "papers (by a hash of their cord_uid), for runs on several hosts. "
+        "The release is not published, see --publish_partitions"
+    )
+    parser.add_argument(
+        "--publish_partitions", type=int, default=None, metavar="N",
+        help="Do not index, publish the release once its N partitions "
+        "finished (fails otherwise)"
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=1,
+        help="Number of processes used to parse papers (1 disables the pool)"
+    )
+    parser.add_argument(
+        "--async_ingest", action="store_true",
+        help="Read json files, parse them and send bulk requests as "
+        "concurrent asyncio stages"
+    )
+    parser.add_argument(
+        "--readers", type=int, default=8,
+        help="Threads reading json files (with --async_ingest)"
+    )
+    parser.add_argument(
+        "--read_ahead", type=int, default=16,
+        help="Chunks of 8 papers read ahead of the parsing processes "
+        "(with --async_ingest)"
+    )
+    parser.add_argument(
+        "--parse_cache", type=str, default=None,
+        help="Directory caching the parsed json files across runs "
+        "(only used when reading them from `<data_dir>`)"
+    )
+    parser.add_argument(
+        "--export_dir", type=str, default=None,
+        help="Do not connect to elastic search, write the documents as "
+        "gzipped NDJSON files here instead (see `replay_cord.py`)"
     )
+    parser.add_argument(
+        "--shard_docs", type=int, default=100_000,
+        help="Documents per exported file"
+    )
+    add_metrics_args(parser)
 
     return parser
 
 
+def add_connection_args(parser):
+    # elastic search hosts and client options
+    parser.add_argument(
+        "-a", "--address", type=str, default="0.0.0.0",
+        help="Elastic search address, or comma separated hosts to balance "
+        "requests over (eg: es1,es2:9201,https://es3)"
+    )
+    parser.add_argument(
+        "-p", "--port", type=int, default=9200,
+        help="Elastic search port (of the hosts without one)"
+    )
+    parser.add_argument(
+        "--pool_size", type=int, default=10,
+        help="Connections kept to each elastic search node"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=None,
+        help="Seconds before an elastic search request times out "
+        "(default: the client's)"
+    )
+    parser.add_argument(
+        "--http_compress", action="store_true",
+        help="Gzip the bodies of the requests"
+    )
+    parser.add_argument(
+        "--sniff", action="store_true",
+        help="Discover the ingest nodes of the cluster on start and when a "
+        "node fails, requests are balanced over all of them"
+    )
+
+
+def add_bulk_args(parser):
+    # bulk requests, see `BulkSink`
+    parser.add_argument(
+        "-bs", "--batch_size", type=int, default=500,
+        help="Maximum number of documents (of any index) per bulk request"
+    )
+    parser.add_argument(
+        "--chunk_mb", type=int, default=10,
+        help="Maximum size in MB of a bulk request"
+    )
+    parser.add_argument(
+        "--bulk_threads", type=int, default=4,
+        help="Number of bulk requests sent concurrently"
+    )
+    parser.add_argument(
+        "--max_retries", type=int, default=5,
+        help="Retries of rejected (429) or timed out bulk requests"
+    )
+    parser.add_argument(
+        "--dead_letter", type=str, default=None,
+        help="NDJSON file for documents that failed to index "
+        "(default: `dead_letter.ndjson` in the data directory)"
+    )
+
+
+def add_index_args(parser):
+    # settings of new indices and their publishing
+    parser.add_argument(
+        "--bulk_load", action="store_true",
+        help="Disable refreshes and replicas while indexing, then restore "
+        "them and force merge the indices (unless updated incrementally)"
+    )
+    parser.add_argument(
+        "--shards", type=str, nargs="+", default=None, metavar="INDEX=N",
+        help="Number of shards of new indices (default: by corpus size)"
+    )
+    parser.add_argument(
+        "--best_compression", type=str, nargs="*", default=None,
+        metavar="INDEX",
+        help="New indices using best_compression (default: by corpus size)"
+    )
+    parser.add_argument(
+        "--versioned", action="store_true",
+        help="Build release-stamped indices (eg: papers-2022-06-02) and "
+        "atomically point the index aliases to them once verified"
+    )
+    parser.add_argument(
+        "--keep_generations", type=int, default=2,
+        help="Generations of each index kept when versioned (including the "
+        "published one)"
+    )
+
+
+def add_metrics_args(parser):
+    # run report and Prometheus textfile
+    parser.add_argument(
+        "--report", type=str, default=None,
+        help="Write a json report of the run (stage times and counters)"
+    )
+    parser.add_argument(
+        "--prom_file", type=str, default=None,
+        help="Write the run metrics as a Prometheus textfile (eg: into the "
+        "node_exporter textfile collector directory)"
+    )
+
+
 def parse_flags():
     return get_parser().parse_args()
 
 
-def flatten(array):
-    ret = []
-    for el in array:
-        if not isinstance(el, list):
-            ret.append(el)
-        else:
-            ret.extend(flatten(el))
+def parse_partition(partition):
+    # "2/8" -> (2, 8), partitions are numbered from 0
+    index, _, count = partition.partition("/")
+    index, count = int(index), int(count)
+    if not 0 <= index < count:
+        raise ValueError(f"Invalid partition: {partition}")
+    return index, count
+
+
+def parse_shards(shards):
+    # ["papers=2", ...] -> {"papers": 2, ...}
+    ret = {}
+    for item in shards or []:
+        name, _, count = item.partition("=")
+        ret[name] = int(count)
     return ret
 
 
-def bulk_save(es_conn, batch):
-    data = [el.to_dict(True) for el in flatten(batch.values())]
-    bulk(es_conn, data)
+def to_action(doc):
+    # documents coming back from worker processes are already serialized
+    if isinstance(doc, dict):
+        return doc
+    if isinstance(doc, Record):
+        return doc.to_action()
+    return doc.to_dict(True)
 
 
 def base_doc_from_row(row, incl_abs=False):
@@ -92,66 +317,64 @@ def base_doc_from_row(row, incl_abs=False):
     return params
 
 
-def paragraph_from_row(row, part_idx, part_text, incl_abs):
-    par_cls = Paragraph_with_abs if incl_abs else Paragraph
-    par_params = base_doc_from_row(row, incl_abs)
-    par_params.update(
+def shared_from_row(row, incl_abs=False):
+    # per paper fields, shared by all its documents
+    return Shared(base_doc_from_row(row, incl_abs))
+
+
+def paragraph_shared_from_row(row, incl_abs=False, shared=None):
+    # fields shared by the paragraphs of a paper, all of the paper's (given
+    # as `shared`) unless the paragraphs are slim
+    if slim_paragraphs:
+        return Shared(dict(
+            cord_uid=row["cord_uid"],
+            publish_time=row["publish_time"].strip(),
+        ))
+    if shared is None:
+        shared = shared_from_row(row, incl_abs)
+    return shared
+
+
+def paragraph_from_row(row, part_idx, part_text, incl_abs, shared=None):
+    if slim_paragraphs:
+        par_cls = Paragraph_slim
+    else:
+        par_cls = Paragraph_with_abs if incl_abs else Paragraph
+    if shared is None:
+        shared = paragraph_shared_from_row(row, incl_abs)
+
+    return record_type(par_cls)(
+        shared,
         paragraph_id=part_idx,
         body=part_text,
     )
 
-    return par_cls(**par_params)
-
 
-def paper_from_row(row, full_text, incl_abs):
+def paper_from_row(row, full_text, incl_abs, shared=None):
     paper_cls = Paper_with_abs if incl_abs else Paper
-    paper_params = base_doc_from_row(row, incl_abs)
-    paper_params.update(body=full_text)
-    return paper_cls(**paper_params)
+    if shared is None:
+        shared = shared_from_row(row, incl_abs)
+
+    return record_type(paper_cls)(shared, body=full_text)
 
 
 def abstract_from_row(row):
-    params = base_doc_from_row(row)
-    params.update(body=row["abstract"].strip())
-    return Abstract(**params)
+    return record_type(Abstract)(
+        shared_from_row(row), body=row["abstract"].strip()
+    )
 
 
 def filter_by_kwords(row=None, text=""):
-    keywords = [
-        "coronavirus 2019",
-        "coronavirus disease 19",
-        "cov2",
-        "cov-2",
-        "covid",
-        "ncov 2019",
-        "2019ncov",
-        "2019-ncov",
-        "2019 ncov",
-        "novel coronavirus",
-        "sarscov2",
-        "sars-cov-2",
-        "sars cov 2",
-        "severe acute respiratory syndrome coronavirus 2",
-        "wuhan coronavirus",
-        "wuhan pneumonia",
-        "wuhan virus"
-    ]
-
-    ret = False
     title, abstract = "", ""
     if row is not None:
         title = row["title"].strip()
         abstract = row["abstract"].strip()
 
-    for kw in keywords:
-        if kw in title.lower() or kw in abstract.lower() or kw in text.lower():
-            ret = True
-            break
-
-    return ret
+    return kword_matcher.search(title, abstract, text)
 
 
 def get_part_len_from_row_data(row_data, part, incl_abs):
+    part_value = ""
     if part == "abstract" and not incl_abs:
         if (
             row_data.get("abstracts") is not None and
@@ -171,57 +394,156 @@ def get_part_len_from_row_data(row_data, part, incl_abs):
     return len(part_value)
 
 
-def deduplicate(orig, new, incl_abs):
+def dedup_key(row_data, incl_abs):
     # keep the longest data, order:
     # - longest abstract
     # - longest paper body
     # - data with more paragraphs
     # - else: first
-    ret = orig
     parts = ["abstract", "body", "paragraphs"]
-    for pa in parts:
-        orig_pa_len = get_part_len_from_row_data(orig, pa, incl_abs)
-        new_pa_len = get_part_len_from_row_data(new, pa, incl_abs)
-        if orig_pa_len != new_pa_len:
-            ret = orig if orig_pa_len > new_pa_len else new
-            break
+    return tuple(
+        get_part_len_from_row_data(row_data, pa, incl_abs) for pa in parts
+    )
 
-    return ret
 
+def deduplicate(orig, new, incl_abs):
+    if dedup_key(new, incl_abs) > dedup_key(orig, incl_abs):
+        return new
+    return orig
 
-def process_paper_body(row, json_path, incl_abs):
-    full_text = ""
-    samples = []
-    full_text_dict = json.load(open(json_path, "r"))
-    body_text = full_text_dict["body_text"]
-    if len(body_text):
-        for part_idx, part in enumerate(body_text):
+
+def dedup_bounds(base_dir, incl_abs, row, parses=None):
+    # lower and upper bounds of the `dedup_key` of a row, only from its
+    # metadata and the size of its json files (no parsing). The abstract
+    # length is exact unless it depends on the body matching the keywords,
+    # the body can not be longer than the largest json file
+    abstract_len = len(row["abstract"].strip())
+    row_match = filter_by_kwords(row=row)
+    sizes = json_file_sizes(base_dir, row, parses)
+    if len(sizes) == 0:
+        # exact, the paper (if any) has an empty body
+        with_paper = incl_abs and row_match
+        abstract_len = abstract_len if row_match else 0
+        key = (abstract_len, 0, 1 if with_paper else 0)
+        return key, key
+
+    if not incl_abs:
+        abstract_len = abstract_len if row_match else 0
+        return (abstract_len, 0, 0), (abstract_len, max(sizes), float("inf"))
+
+    lower_abstract_len = abstract_len if row_match else 0
+    return (
+        (lower_abstract_len, 0, 0),
+        (abstract_len, max(sizes), float("inf"))
+    )
+
+
+def body_parts(json_data):
+    # non empty paragraphs of a parse, as (paragraph_id, text, keyword hit)
+    with metrics.stage("json_parsing"):
+        full_text_dict = json.loads(json_data)
+    metrics.count("json_files_parsed")
+    parts = []
+    # timed as a whole, timing each call would slow it down
+    with metrics.stage("keyword_filtering"):
+        for part_idx, part in enumerate(full_text_dict["body_text"]):
             part_text = part["text"].strip()
             if part_text != "":
-                full_text += part_text + "\n"
-                if filter_by_kwords(text=part_text):
-                    samples.append(
-                        paragraph_from_row(row, part_idx, part_text, incl_abs)
-                    )
+                parts.append(
+                    (part_idx, part_text, filter_by_kwords(text=part_text))
+                )
+
+    return parts
 
+
+def paper_body_from_parts(row, parts, incl_abs, shared=None):
+    full_text = "".join(part_text + "\n" for _, part_text, _ in parts)
+    samples = [
+        paragraph_from_row(row, part_idx, part_text, incl_abs, shared)
+        for part_idx, part_text, hit in parts if hit
+    ]
     return full_text.strip(), samples
 
 
-def process_paper(base_dir, incl_abs, row):
-    batch = defaultdict(list)
-    full_text = ""
-    paragraphs = []
+def process_paper_body(row, json_data, incl_abs, shared=None):
+    return paper_body_from_parts(row, body_parts(json_data), incl_abs, shared)
 
-    # print(f"Processing {cord_uid}")
+
+def get_json_files(row):
     # prefer pmc files
     field = row.get("pmc_json_files", row.get("pdf_json_files", ""))
-    for json_path in [pa for pa in field.split("; ") if pa.strip() != ""]:
-        json_path = base_dir.joinpath(json_path)
+    return [pa for pa in field.split("; ") if pa.strip() != ""]
+
+
+def iter_json_files(base_dir, row, parses=None):
+    # (name, contents) of the json files of a row, read from `base_dir` or,
+    # when streaming the parses tarball, taken from the given members
+    for json_file in get_json_files(row):
+        if parses is not None:
+            if json_file in parses:
+                yield json_file, parses[json_file]
+            continue
+
+        json_path = base_dir.joinpath(json_file)
         if not json_path.exists() or not json_path.is_file():
             # pdf file does not exist
             continue
+        with metrics.stage("json_reading"):
+            json_data = json_path.read_bytes()
+        yield json_file, json_data
+
+
+def iter_body_parts(base_dir, row, parses=None):
+    # like `iter_json_files` but parsed, through the parse cache if any
+    # (only files read from `base_dir`, the tarball has no mtimes)
+    if parse_cache is None or parses is not None:
+        for json_file, json_data in iter_json_files(base_dir, row, parses):
+            yield json_file, body_parts(json_data)
+        return
+
+    for json_file in get_json_files(row):
+        json_path = base_dir.joinpath(json_file)
+        if not json_path.is_file():
+            continue
+
+        stat = json_path.stat()
+        parts = parse_cache.get(json_file, stat.st_mtime_ns, stat.st_size)
+        metrics.count("parse_cache", result="miss" if parts is None else "hit")
+        if parts is None:
+            with metrics.stage("json_reading"):
+                json_data = json_path.read_bytes()
+            parts = body_parts(json_data)
+            parse_cache.put(json_file, stat.st_mtime_ns, stat.st_size, parts)
+        yield json_file, parts
+
+
+def json_file_sizes(base_dir, row, parses=None):
+    sizes = []
+    for json_file in get_json_files(row):
+        if parses is not None:
+            if json_file in parses:
+                sizes.append(len(parses[json_file]))
+            continue
+
+        json_path = base_dir.joinpath(json_file)
+        if json_path.is_file():
+            sizes.append(json_path.stat().st_size)
 
-        full_text, samples = process_paper_body(row, json_path, incl_abs)
+    return sizes
+
+
+def process_paper(base_dir, incl_abs, row, parses=None):
+    batch = defaultdict(list)
+    full_text = ""
+    paragraphs = []
+    shared = shared_from_row(row, incl_abs)
+    par_shared = paragraph_shared_from_row(row, incl_abs, shared)
+
+    # print(f"Processing {cord_uid}")
+    for _, parts in iter_body_parts(base_dir, row, parses):
+        full_text, samples = paper_body_from_parts(
+            row, parts, incl_abs, par_shared
+        )
         if full_text != "":
             paragraphs.extend(samples)
             # found, dont search for other versions of the paper
@@ -229,16 +551,22 @@ def process_paper(base_dir, incl_abs, row):
 
     # else paper without file
     full_text = full_text.strip()
-    if full_text != "" and filter_by_kwords(text=full_text):
-        batch["papers"].append(paper_from_row(row, full_text, incl_abs))
+    # keywords can not span paragraphs, so the full text matches only if
+    # some paragraph did, no need to scan it again
+    if full_text != "" and len(paragraphs) > 0:
+        batch["papers"].append(
+            paper_from_row(row, full_text, incl_abs, shared)
+        )
         # paragraphs will be empty if paper without body
         batch["paragraphs"].extend(paragraphs)
     elif incl_abs and filter_by_kwords(row=row):
         # include article in "papers" and "paragraphs" indices,
         # even if it has no body text
         # another paper without body
-        batch["papers"].append(paper_from_row(row, "", incl_abs))
-        batch["paragraphs"].append(paragraph_from_row(row, 0, "", incl_abs))
+        batch["papers"].append(paper_from_row(row, "", incl_abs, shared))
+        batch["paragraphs"].append(
+            paragraph_from_row(row, 0, "", incl_abs, par_shared)
+        )
 
     if not incl_abs:
         if row["abstract"].strip() != "" and filter_by_kwords(row=row):
@@ -248,39 +576,476 @@ def process_paper(base_dir, incl_abs, row):
     return batch
 
 
+def is_dominated(bounds, j):
+    # whether row `j` can not be the first row with the largest key
+    upper = bounds[j][1]
+    for i, (lower, _) in enumerate(bounds):
+        if i != j and (upper < lower or (upper == lower and i < j)):
+            return True
+    return False
+
+
+def process_group(base_dir, incl_abs, rows, parses=None, stats=None):
+    """ Process the duplicates of a cord_uid and keep the best one.
+
+    Picks the same row as folding `deduplicate` over every processed row,
+    but ranks them first with `dedup_bounds` and only parses the json of
+    the rows that may still win.
+    """
+    if len(rows) == 0:
+        return None
+    if len(rows) == 1:
+        return process_paper(base_dir, incl_abs, rows[0], parses)
+
+    metrics.count("duplicated_papers")
+    with metrics.stage("dedup"):
+        bounds = [
+            dedup_bounds(base_dir, incl_abs, row, parses) for row in rows
+        ]
+    unparsed = {j for j, (lower, upper) in enumerate(bounds) if lower != upper}
+    row_data = [None] * len(rows)
+    candidates = list(range(len(rows)))
+    while True:
+        candidates = [j for j in candidates if not is_dominated(bounds, j)]
+        pending = [j for j in candidates if row_data[j] is None]
+        if len(pending) == 0 or (len(candidates) == 1 and len(pending) == 1):
+            break
+
+        # process the most promising row
+        j = max(pending, key=lambda j: bounds[j][1])
+        row_data[j] = process_paper(base_dir, incl_abs, rows[j], parses)
+        key = dedup_key(row_data[j], incl_abs)
+        bounds[j] = (key, key)
+        unparsed.discard(j)
+
+    winner = candidates[0]
+    if row_data[winner] is None:
+        row_data[winner] = process_paper(
+            base_dir, incl_abs, rows[winner], parses
+        )
+        unparsed.discard(winner)
+
+    if stats is not None:
+        # each of these would have parsed at least one json file
+        stats["json_parses_saved"] += len(unparsed)
+
+    return row_data[winner]
+
+
+def group_hash(base_dir, rows, parses=None):
+    # hash of everything a cord_uid is indexed from: its metadata rows and
+    # the json files they may be read from
+    digest = hashlib.sha1()
+    digest.update(json.dumps(rows, sort_keys=True, default=str).encode())
+    for row in rows:
+        for json_file, json_data in iter_json_files(base_dir, row, parses):
+            digest.update(json_file.encode())
+            digest.update(json_data)
+
+    return digest.hexdigest()
+
+
+def worker_args():
+    # settings of `process_metadata` for `init_worker`
+    cache_dir = parse_cache.cache_dir if parse_cache is not None else None
+    return cache_dir, slim_paragraphs
+
+
+def init_worker(cache_dir=None, slim=False):
+    # settings are passed rather than inherited, so workers can also be
+    # spawned. Forked ones start with a copy of what the parent recorded
+    # so far, which it would count again when merging what they send back
+    global parse_cache, slim_paragraphs
+    metrics.pop()
+    slim_paragraphs = slim
+    if cache_dir is None:
+        parse_cache = None
+    elif parse_cache is not None and parse_cache.cache_dir == cache_dir:
+        parse_cache.pop()
+    else:
+        parse_cache = ParseCache(cache_dir, kword_matcher.keywords)
+
+
+def process_group_chunk(base_dir, incl_abs, chunk):
+    # serialize in the worker, shipping plain dicts back to the parent is
+    # cheaper than pickling Documents (and does not re-validate fields)
+    results = []
+    stats = Counter()
+    for rows, parses in chunk:
+        final_row = process_group(base_dir, incl_abs, rows, parses, stats)
+        if final_row is not None:
+            with metrics.stage("serialization"):
+                final_row = {
+                    key: [to_action(doc) for doc in value]
+                    for key, value in final_row.items()
+                }
+        results.append(final_row)
+
+    cached = parse_cache.pop() if parse_cache is not None else []
+    return results, stats, metrics.pop(), cached
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+
+    if len(chunk):
+        yield chunk
+
+
+def imap_bounded(pool, func, iterable, max_pending):
+    # like `Pool.imap` but without consuming the whole input up front, at
+    # most `max_pending` tasks are queued or running at any time
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+
+    while len(pending):
+        yield pending.popleft().get()
+
+
+def iter_tar_groups(tar_path, groups):
+    """ Join groups to their json parses while streaming the tarball.
+
+    Members are read in a single sequential pass and each group is yielded
+    as (rows, parses) as soon as all its json files arrived (parses maps
+    each file name to its contents). Groups whose files are not in the
+    tarball are yielded at the end with whatever was found.
+
+    Memory is not bounded by a group: the members come in any order, so
+    every group is read from `groups` before the first member and the rows
+    of those with json files are kept until their files arrive. A group
+    also keeps the parses it got until its last file arrives, until the
+    end for the groups missing files from the tarball.
+    """
+    waiting = {}
+    by_file = defaultdict(list)
+    for group_id, rows in enumerate(groups):
+        json_files = {jf for row in rows for jf in get_json_files(row)}
+        if len(json_files) == 0:
+            yield rows, {}
+            continue
+
+        waiting[group_id] = (rows, json_files, {})
+        for json_file in json_files:
+            by_file[json_file].append(group_id)
+
+    with tarfile.open(tar_path, "r|*") as tarball:
+        for member in metrics.timed_iter(tarball, "json_reading"):
+            name = member.name[2:] if member.name.startswith("./") \
+                else member.name
+            if not member.isfile() or name not in by_file:
+                continue
+
+            with metrics.stage("json_reading"):
+                json_data = tarball.extractfile(member).read()
+            for group_id in by_file.pop(name):
+                rows, json_files, parses = waiting[group_id]
+                parses[name] = json_data
+                if len(parses) == len(json_files):
+                    del waiting[group_id]
+                    yield rows, parses
+
+    # referenced files missing from the tarball
+    metrics.count("groups_missing_parses", len(waiting))
+    for rows, _, parses in waiting.values():
+        yield rows, parses
+
+
+def iter_group_sources(groups, parses_tar=None):
+    if parses_tar is None:
+        return ((rows, None) for rows in groups)
+    return iter_tar_groups(parses_tar, groups)
+
+
+def iter_processed_groups(
+    groups, base_dir, incl_abs, workers=1, chunk_size=8, stats=None
+):
+    stats = Counter() if stats is None else stats
+    if workers <= 1:
+        for rows, parses in groups:
+            yield process_group(base_dir, incl_abs, rows, parses, stats)
+        return
+
+    processor = partial(process_group_chunk, base_dir, incl_abs)
+    with Pool(
+        workers, initializer=init_worker, initargs=worker_args()
+    ) as pool:
+        chunks = chunked(groups, chunk_size)
+        for results, chunk_stats, chunk_metrics, cached in imap_bounded(
+            pool, processor, chunks, workers * 2
+        ):
+            stats.update(chunk_stats)
+            metrics.merge(chunk_metrics)
+            if parse_cache is not None:
+                parse_cache.extend(cached)
+            yield from results
+
+
+def select_incremental(
+    state, base_dir, groups, total, incl_abs, names=None, skip=()
+):
+    hashes = {}
+    for rows, parses in tqdm(groups, total=total, desc="Hashing metadata"):
+        hashes[rows[0]["cord_uid"]] = group_hash(base_dir, rows, parses)
+
+    update, removed = state.diff(hashes)
+    print(
+        f"Incremental run: {len(update)} new or changed papers, "
+        f"{len(removed)} removed, {len(hashes) - len(update)} unchanged"
+    )
+    # already updated by the run being resumed
+    update -= set(skip)
+    # new papers too, they may be leftovers of an interrupted run
+    delete_papers(update | removed, incl_abs, names=names)
+    return update
+
+
 def process_metadata(
-    es_conn, base_dir, meta_path, incl_abs=False, batch_size=100
+    sink, base_dir, meta_path, incl_abs=False, workers=1, state=None,
+    parses_tar=None, names=None, cache_dir=None, slim=False, readers=8,
+    read_ahead=16, partition=None, checkpoint=None
 ):
+    """ Index the papers of `meta_path` into `sink`.
+
+    With an `AsyncBulkSink`, papers are read, parsed and sent by the
+    concurrent stages of `process_groups_async`. With `partition` (index,
+    count), only the papers of that partition. With a `checkpoint`, the
+    papers it completed are skipped and the rest registered in it.
+    """
+    global parse_cache, slim_paragraphs
     base_dir = Path(base_dir)
-    batch = defaultdict(list)
-    df = pd.read_csv(meta_path).fillna("")
-    total = len(df)
-    data = df.groupby("cord_uid")
-    processor = partial(process_paper, base_dir, incl_abs)
+    slim_paragraphs = slim
+    if cache_dir is not None:
+        parse_cache = ParseCache(cache_dir, kword_matcher.keywords)
+        print(f"Parse cache with {len(parse_cache)} json files: {cache_dir}")
+    try:
+        skip = checkpoint.completed if checkpoint is not None else set()
+        groups, total = select_groups(
+            base_dir, meta_path, incl_abs, state, parses_tar, names,
+            partition, skip
+        )
+        if isinstance(sink, AsyncBulkSink):
+            asyncio.run(ingest_async(
+                sink, base_dir, groups, total, incl_abs, workers, readers,
+                read_ahead, checkpoint
+            ))
+        else:
+            process_groups(
+                sink, base_dir, groups, total, incl_abs, workers, checkpoint
+            )
+    finally:
+        # also when indexing failed, the next attempt skips the parsing
+        if parse_cache is not None:
+            parse_cache.save()
+            parse_cache = None
+        slim_paragraphs = False
+
+
+def select_groups(
+    base_dir, meta_path, incl_abs, state, parses_tar, names, partition=None,
+    skip=()
+):
+    # (rows, parses) of the cord_uids to index and how many there are
+    with metrics.stage("csv_loading"):
+        reader = MetadataReader(meta_path, partition=partition)
+    groups = metrics.timed_iter(reader, "csv_loading")
+    total = len(reader)
+    if state is not None:
+        with metrics.stage("incremental_diff"):
+            update = select_incremental(
+                state, base_dir, iter_group_sources(groups, parses_tar),
+                total, incl_abs, names, skip
+            )
+        groups = (
+            rows for rows in metrics.timed_iter(reader, "csv_loading")
+            if rows[0]["cord_uid"] in update
+        )
+        total = len(update)
+    elif len(skip):
+        groups = (rows for rows in groups if rows[0]["cord_uid"] not in skip)
+        total -= len(skip)
 
     print(f"Processing metadata from: {meta_path}")
-    for _, df_group in tqdm(data, total=total, desc="Reading metadata"):
-        final_row = None
-        row_data = [processor(ro.to_dict()) for _, ro in df_group.iterrows()]
-        if len(row_data) == 0:
-            continue
+    return iter_group_sources(groups, parses_tar), total
 
-        final_row = row_data[0]
-        for i in range(1, len(row_data)):
-            final_row = deduplicate(final_row, row_data[i], incl_abs)
 
-        if final_row is not None:
-            for key, value in final_row.items():
-                batch[key].extend(value)
+def result_actions(final_row):
+    # bulk actions of a processed group, a list per index
+    metrics.count("papers_processed")
+    if final_row is None:
+        return
+    for value in final_row.values():
+        with metrics.stage("serialization"):
+            actions = [to_action(doc) for doc in value]
+        for index, count in Counter(
+            action["_index"] for action in actions
+        ).items():
+            metrics.count("docs", count, index=index)
+        yield actions
+
+
+def track_uids(groups, cord_uids):
+    # appends the cord_uid of each group to `cord_uids` as it is read, the
+    # results come back in the same order
+    for rows, parses in groups:
+        cord_uids.append(rows[0]["cord_uid"])
+        yield rows, parses
 
-        # check if batch full
-        if len(batch["papers"]) >= batch_size:
-            bulk_save(es_conn, batch)
-            batch = defaultdict(list)
 
-    # save last results
-    if len(batch["papers"]):
-        bulk_save(es_conn, batch)
+def group_actions(final_row, cord_uid, checkpoint=None):
+    # bulk actions of a processed group, registered in the checkpoint
+    # before any of them can be sent
+    batches = list(result_actions(final_row))
+    if checkpoint is not None:
+        checkpoint.expect(
+            cord_uid, [action for actions in batches for action in actions]
+        )
+    return batches
+
+
+def process_groups(
+    sink, base_dir, groups, total, incl_abs, workers, checkpoint=None
+):
+    stats = Counter()
+    cord_uids = deque()
+    results = iter_processed_groups(
+        track_uids(groups, cord_uids), base_dir, incl_abs, workers,
+        stats=stats
+    )
+
+    for final_row in tqdm(results, total=total, desc="Reading metadata"):
+        cord_uid = cord_uids.popleft()
+        for actions in group_actions(final_row, cord_uid, checkpoint):
+            with metrics.stage("bulk_enqueue"):
+                sink.extend(actions)
+
+    report_dedup(stats)
+
+
+def read_chunk(base_dir, chunk):
+    # the json files of the groups, for the workers to parse them from
+    # memory (not when streamed from the tarball or cached)
+    if parse_cache is not None:
+        return chunk
+    return [
+        (rows, parses if parses is not None else {
+            json_file: json_data
+            for row in rows
+            for json_file, json_data in iter_json_files(base_dir, row)
+        })
+        for rows, parses in chunk
+    ]
+
+
+async def feed(queue, futures, done):
+    # `futures` into `queue`, in order, then `done`. An error is handed on
+    # as a failed future, raised by whoever awaits it
+    try:
+        async for future in futures:
+            await queue.put(future)
+    except Exception as e:
+        future = asyncio.get_running_loop().create_future()
+        future.set_exception(e)
+        await queue.put(future)
+        return
+    await queue.put(done)
+
+
+async def process_groups_async(
+    sink, base_dir, groups, total, incl_abs, workers=1, readers=8,
+    read_ahead=16, checkpoint=None, chunk_size=8
+):
+    """ Read, parse and send groups as concurrent stages.
+
+    `readers` threads read the metadata and the json files of up to
+    `read_ahead` chunks of `chunk_size` groups ahead of the `workers`
+    parsing processes, which take up to `2 * workers` chunks at a time,
+    while the sink sends the documents of the chunks already parsed. The
+    stages are connected by bounded queues, a slow stage holds back the
+    ones before it.
+    """
+    loop = asyncio.get_running_loop()
+    done = object()
+    stats = Counter()
+    read_queue = asyncio.Queue(read_ahead)
+    parse_queue = asyncio.Queue(workers * 2)
+    cord_uids = deque()
+    chunks = chunked(track_uids(groups, cord_uids), chunk_size)
+    parse_pool = ProcessPoolExecutor(
+        workers, initializer=init_worker, initargs=worker_args()
+    )
+    # fork the workers before any reader thread exists
+    await loop.run_in_executor(parse_pool, os.getpid)
+    read_pool = ThreadPoolExecutor(readers)
+
+    async def read_chunks():
+        while True:
+            chunk = await loop.run_in_executor(read_pool, next, chunks, None)
+            if chunk is None:
+                return
+            yield loop.run_in_executor(read_pool, read_chunk, base_dir, chunk)
+
+    async def parse_chunks():
+        while (item := await read_queue.get()) is not done:
+            chunk = await item
+            yield loop.run_in_executor(
+                parse_pool, process_group_chunk, base_dir, incl_abs, chunk
+            )
+
+    tasks = [
+        asyncio.create_task(feed(read_queue, read_chunks(), done)),
+        asyncio.create_task(feed(parse_queue, parse_chunks(), done)),
+    ]
+    try:
+        with tqdm(total=total, desc="Reading metadata") as bar:
+            while (item := await parse_queue.get()) is not done:
+                results, chunk_stats, chunk_metrics, cached = await item
+                stats.update(chunk_stats)
+                metrics.merge(chunk_metrics)
+                if parse_cache is not None:
+                    parse_cache.extend(cached)
+                for final_row in results:
+                    bar.update()
+                    cord_uid = cord_uids.popleft()
+                    for actions in group_actions(
+                        final_row, cord_uid, checkpoint
+                    ):
+                        start = time.perf_counter()
+                        await sink.extend(actions)
+                        metrics.add_time(
+                            "bulk_enqueue", time.perf_counter() - start
+                        )
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        read_pool.shutdown(cancel_futures=True)
+        parse_pool.shutdown(cancel_futures=True)
+
+    report_dedup(stats)
+
+
+async def ingest_async(sink, *args):
+    try:
+        async with sink:
+            await process_groups_async(sink, *args)
+    finally:
+        await sink.es_conn.close()
+
+
+def report_dedup(stats):
+    metrics.count("json_parses_saved", stats["json_parses_saved"])
+    print(
+        f"Deduplication skipped {stats['json_parses_saved']} json parses "
+        "of duplicated papers"
+    )
 
 
 def parse_data_version(data_name):
@@ -297,20 +1062,269 @@ def save_data_version(data_version):
     print(f"Saved data version as: {version.version}")
 
 
-def main(metadata, data_dir, address, port, incl_abs, batch_size):
-    es = get_connection(address, port)
-    init_index(incl_abs)
+def write_metrics(report=None, prom_file=None, success=True, **info):
+    if report is not None:
+        metrics.write_json(report, success=success, **info)
+    if prom_file is not None:
+        metrics.write_prometheus(prom_file, success=success)
 
-    data_dir = Path(data_dir)
-    data_version = parse_data_version(data_dir.name)
+
+def setup_indices(
+    num_papers, incl_abs, slim_paragraphs=False, data_version=None,
+    versioned=False, state=None, shards=None, best_compression=None,
+    partitioned=False, resume=False
+):
+    """ Create the indices to write into, returns their names.
+
+    A new generation (named after `data_version`) when `versioned`. The
+    incremental `state` is reset when its indices are gone. When
+    `partitioned`, the indices are shared with the runs of the other
+    partitions: leftovers are kept (their documents are overwritten, as
+    ids are deterministic) and the indices may already exist. When
+    `resume`ing, the generation of the interrupted run is kept. Either way
+    it must not be published yet.
+    """
+    names = index_names(incl_abs)
+    if versioned and (partitioned or resume):
+        names = index_names(incl_abs, data_version)
+        check_unpublished(names)
+    elif versioned:
+        generation = data_version or time.strftime("%Y-%m-%d-%H%M%S")
+        names = index_names(incl_abs, generation)
+        prepare_generation(names)
+        # incremental runs update a copy of the live generation
+        if state is not None and not clone_generation(names):
+            state.reset()
+    elif state is not None and not Index("papers").exists():
+        # nothing indexed, whatever the state says
+        state.reset()
+
+    profiles = index_profiles(
+        num_papers, incl_abs, parse_shards(shards), best_compression,
+        slim_paragraphs
+    )
+    try:
+        init_index(incl_abs, profiles, names, slim_paragraphs)
+    except BadRequestError as e:
+        if not partitioned or e.error != "resource_already_exists_exception":
+            raise
+        # created meanwhile by another partition, create the rest
+        init_index(incl_abs, profiles, names, slim_paragraphs)
+    return names
+
+
+def publish_release(names, data_version, versioned=False, keep_generations=2):
+    if versioned:
+        with metrics.stage("publish"):
+            verify_generation(names)
+            publish_generation(names)
+            cleanup_generations(names, keep_generations)
+
+    # once the release is indexed (and published)
     if data_version is None:
         print("Warning: Unable to get data version!\nNot saving to database")
     else:
         save_data_version(data_version)
 
+
+def export_release(
+    metadata, data_dir, export_dir, incl_abs, workers=1, parses_tar=None,
+    parse_cache=None, slim_paragraphs=False, shard_docs=100_000,
+    partition=None
+):
+    """ Write the documents of a release as NDJSON, for `replay_cord`.
+
+    The documents of a `partition` go into a `partition-<i>-of-<n>`
+    subdirectory of `export_dir`, so partitions can share it.
+    """
+    data_dir = Path(data_dir)
     if metadata is None:
         metadata = data_dir.joinpath("metadata.csv")
-    process_metadata(es, str(data_dir), metadata, incl_abs, batch_size)
+
+    data_version = parse_data_version(data_dir.name)
+    info = dict(
+        data_version=data_version,
+        release=data_version or data_dir.name,
+        num_papers=len(MetadataReader(metadata)),
+        incl_abs=incl_abs,
+        slim_paragraphs=slim_paragraphs,
+    )
+    if partition is not None:
+        info.update(partition=list(partition))
+        export_dir = Path(export_dir).joinpath(
+            "partition-{}-of-{}".format(*partition)
+        )
+    with metrics.stage("export"), NDJSONSink(
+        export_dir, shard_docs, info
+    ) as sink:
+        process_metadata(
+            sink, str(data_dir), metadata, incl_abs, workers,
+            parses_tar=parses_tar, cache_dir=parse_cache,
+            slim=slim_paragraphs, partition=partition
+        )
+
+
+def index_release(
+    metadata, data_dir, address, port, incl_abs, batch_size, workers=1,
+    chunk_mb=10, bulk_threads=4, max_retries=5, dead_letter=None,
+    incremental=False, state_db=None, parses_tar=None, bulk_load=False,
+    shards=None, best_compression=None, versioned=False, keep_generations=2,
+    parse_cache=None, slim_paragraphs=False, async_ingest=False, readers=8,
+    read_ahead=16, pool_size=10, timeout=None, http_compress=False,
+    sniff=False, partition=None, publish_partitions=None, resume=False,
+    checkpoint=None, skip_published=False
+):
+    conn_options = dict(
+        pool_size=pool_size, timeout=timeout, compress=http_compress,
+        sniff=sniff
+    )
+    es = get_connection(address, port, **conn_options)
+    data_dir = Path(data_dir)
+    data_version = parse_data_version(data_dir.name)
+    release = data_version or data_dir.name
+    if publish_partitions is not None:
+        check_partitions(release, publish_partitions)
+        names = index_names(incl_abs, data_version if versioned else None)
+        publish_release(names, data_version, versioned, keep_generations)
+        return
+
+    if skip_published and versioned and data_version is not None and \
+            is_published(index_names(incl_abs, data_version)):
+        # eg: the weekly run, when no newer release came out
+        print(f"Release {data_version} is already published, nothing to do")
+        return
+
+    if partition is not None and versioned and data_version is None:
+        raise ValueError(
+            "Versioned partitions need a dated release directory, all "
+            "partitions must write into the same generation"
+        )
+    if partition is not None and versioned and incremental:
+        # each partition would only write its changes into the shared
+        # generation, which no partition clones from the live one
+        raise ValueError(
+            "Versioned partitions can not be indexed incrementally"
+        )
+
+    state = None
+    if incremental:
+        if state_db is None:
+            state_db = data_dir.parent.joinpath("index_state.sqlite")
+        settings = dict(incl_abs=incl_abs)
+        if slim_paragraphs:
+            settings.update(slim_paragraphs=True)
+        if partition is not None:
+            settings.update(partition="/".join(map(str, partition)))
+        state = StateStore(state_db, settings=settings)
+
+    if metadata is None:
+        metadata = data_dir.joinpath("metadata.csv")
+
+    if resume and versioned and data_version is None:
+        print("Unable to resume, undated releases get a new generation")
+        resume = False
+    if checkpoint is None:
+        checkpoint = data_dir.joinpath("index_checkpoint.txt")
+        if partition is not None:
+            checkpoint = data_dir.joinpath(
+                "index_checkpoint-{}-of-{}.txt".format(*partition)
+            )
+    checkpoint = Checkpoint(checkpoint, settings=dict(
+        release=release, incl_abs=incl_abs, slim_paragraphs=slim_paragraphs,
+        versioned=versioned, incremental=incremental, partition=partition,
+    ), resume=resume)
+
+    with metrics.stage("index_setup"):
+        names = setup_indices(
+            len(MetadataReader(metadata)), incl_abs, slim_paragraphs,
+            data_version, versioned, state, shards, best_compression,
+            partitioned=partition is not None, resume=checkpoint.resumed
+        )
+
+    if dead_letter is None:
+        dead_letter = data_dir.joinpath("dead_letter.ndjson")
+        if partition is not None:
+            dead_letter = data_dir.joinpath(
+                "dead_letter-{}-of-{}.ndjson".format(*partition)
+            )
+
+    sink_cls, sink_conn = BulkSink, es
+    if async_ingest:
+        sink_cls = AsyncBulkSink
+        sink_conn = get_async_connection(address, port, **conn_options)
+    sink = sink_cls(
+        sink_conn,
+        max_docs=batch_size,
+        max_bytes=chunk_mb * 1024 * 1024,
+        threads=bulk_threads,
+        max_retries=max_retries,
+        dead_letter=dead_letter,
+        index_names=names,
+        metrics=metrics,
+        checkpoint=checkpoint,
+    )
+    loading = nullcontext()
+    if bulk_load and partition is not None:
+        # the other partitions may still be writing when this one is done
+        print("Ignoring --bulk_load, the indices are shared by partitions")
+    elif bulk_load:
+        # incremental runs add a few small segments, not worth merging
+        # unless everything is indexed (eg: the first run)
+        loading = bulk_load_profile(
+            incl_abs, names=names, merge=state is None or len(state) == 0
+        )
+    if partition is not None:
+        clear_partition(release, *partition)
+    # the async sink is opened and closed inside its event loop
+    sink_context = nullcontext() if async_ingest else sink
+    try:
+        with metrics.stage("indexing"), loading, sink_context:
+            process_metadata(
+                sink, str(data_dir), metadata, incl_abs, workers, state,
+                parses_tar, names, parse_cache, slim_paragraphs, readers,
+                read_ahead, partition, checkpoint
+            )
+    finally:
+        checkpoint.close()
+
+    if partition is not None:
+        mark_partition(
+            release, *partition, sink.stats["indexed"], sink.stats["failed"]
+        )
+    else:
+        publish_release(names, data_version, versioned, keep_generations)
+    checkpoint.remove()
+    if state is not None:
+        failed = checkpoint.incomplete()
+        if len(failed):
+            print(
+                f"{len(failed)} papers with rejected documents, left for "
+                "the next incremental run"
+            )
+        state.commit(skip=failed)
+        state.close()
+
+
+def main(
+    report=None, prom_file=None, export_dir=None, shard_docs=100_000,
+    **kwargs
+):
+    success = False
+    try:
+        if export_dir is not None:
+            export_release(
+                kwargs["metadata"], kwargs["data_dir"], export_dir,
+                kwargs["incl_abs"], kwargs["workers"], kwargs["parses_tar"],
+                kwargs["parse_cache"], kwargs["slim_paragraphs"], shard_docs,
+                kwargs["partition"]
+            )
+        else:
+            index_release(**kwargs)
+        success = True
+    finally:
+        write_metrics(
+            report, prom_file, success, data_dir=str(kwargs["data_dir"])
+        )
 
 
 if __name__ == "__main__":
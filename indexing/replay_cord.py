@@ -0,0 +1,171 @@
+"""
+Index an export of `process_cord.py --export_dir` into elastic search.
+
+The documents are already built, exported files are streamed as they are
+(sources are not parsed) by parallel processes, each with its own bulk
+sink.
+"""
+import os
+import sys
+import argparse
+
+from pathlib import Path
+from collections import Counter
+from contextlib import nullcontext
+from multiprocessing import Pool
+
+sys.path.append(os.path.dirname(__file__))
+from es.es_connector import get_connection  # noqa: E402
+from es.indexing import bulk_load as bulk_load_profile  # noqa: E402
+from es.bulk_sink import BulkSink  # noqa: E402
+from es.ndjson_sink import read_manifest, iter_actions  # noqa: E402
+from es.partitions import clear_partition, mark_partition  # noqa: E402
+from process_cord import (  # noqa: E402
+    init_worker,
+    add_connection_args,
+    add_bulk_args,
+    add_index_args,
+    add_metrics_args,
+    setup_indices,
+    publish_release,
+    metrics,
+    write_metrics,
+)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-e", "--export_dir", type=str, required=True,
+        help="Directory of the export (with its manifest.json)"
+    )
+    add_connection_args(parser)
+    parser.add_argument(
+        "-w", "--workers", type=int, default=4,
+        help="Processes sending exported files, each with `--bulk_threads` "
+        "concurrent requests"
+    )
+    add_bulk_args(parser)
+    add_index_args(parser)
+    add_metrics_args(parser)
+    return parser
+
+
+def worker_dead_letter(dead_letter, worker):
+    # eg: dead_letter-0.ndjson, workers never append to the same file
+    path = Path(dead_letter)
+    return path.with_name(f"{path.stem}-{worker}{path.suffix}")
+
+
+def replay_files(export_dir, conn_args, sink_args, files, dead_letter):
+    """ Index exported `files` (manifest entries), in a worker process, its
+    failed documents are written to its own `dead_letter` file """
+    # connections are not shared with the parent
+    es = get_connection(**conn_args)
+    with BulkSink(
+        es, metrics=metrics, dead_letter=dead_letter, **sink_args
+    ) as sink:
+        for entry in files:
+            sink.extend(iter_actions(
+                Path(export_dir).joinpath(entry["file"]), entry["index"]
+            ))
+            metrics.count("files_replayed")
+
+    return sink.stats, metrics.pop()
+
+
+def replay_release(
+    export_dir, address, port, batch_size, workers=4, chunk_mb=10,
+    bulk_threads=4, max_retries=5, dead_letter=None, bulk_load=False,
+    shards=None, best_compression=None, versioned=False, keep_generations=2,
+    pool_size=10, timeout=None, http_compress=False, sniff=False
+):
+    export_dir = Path(export_dir)
+    manifest = read_manifest(export_dir)
+    incl_abs = manifest["incl_abs"]
+    data_version = manifest["data_version"]
+    # exports older than partitions lack both
+    release = manifest.get("release", data_version)
+    partition = manifest.get("partition")
+    if partition is not None and versioned and data_version is None:
+        raise ValueError(
+            "Versioned partitions need a dated release, all partitions "
+            "must write into the same generation"
+        )
+    conn_args = dict(
+        addr=address, port=port, pool_size=pool_size, timeout=timeout,
+        compress=http_compress, sniff=sniff
+    )
+    get_connection(**conn_args)
+
+    with metrics.stage("index_setup"):
+        names = setup_indices(
+            manifest["num_papers"], incl_abs, manifest["slim_paragraphs"],
+            data_version, versioned, None, shards, best_compression,
+            partitioned=partition is not None
+        )
+
+    if dead_letter is None:
+        dead_letter = export_dir.joinpath("dead_letter.ndjson")
+    sink_args = dict(
+        max_docs=batch_size,
+        max_bytes=chunk_mb * 1024 * 1024,
+        threads=bulk_threads,
+        max_retries=max_retries,
+        index_names=names,
+    )
+
+    # largest files first, spread over the workers
+    files = sorted(manifest["files"], key=lambda entry: -entry["docs"])
+    batches = [files[i::workers] for i in range(workers)]
+    stats = Counter()
+    loading = nullcontext()
+    if bulk_load and partition is not None:
+        print("Ignoring --bulk_load, the indices are shared by partitions")
+    elif bulk_load:
+        loading = bulk_load_profile(incl_abs, names=names)
+    if partition is not None:
+        clear_partition(release, *partition)
+    print(
+        f"Replaying {sum(manifest['docs'].values())} documents from "
+        f"{len(files)} files with {workers} workers"
+    )
+    with metrics.stage("indexing"), loading, Pool(
+        workers, initializer=init_worker
+    ) as pool:
+        for worker_stats, worker_metrics in pool.starmap(replay_files, [
+            (
+                str(export_dir), conn_args, sink_args, batch,
+                str(worker_dead_letter(dead_letter, worker))
+            )
+            for worker, batch in enumerate(batches) if len(batch)
+        ]):
+            stats.update(worker_stats)
+            metrics.merge(worker_metrics)
+
+    print(
+        f"Indexed {stats['indexed']} documents in {stats['requests']} "
+        f"requests ({stats['retries']} retries, {stats['failed']} failed)"
+    )
+    if partition is not None:
+        # published with `process_cord.py --publish_partitions`
+        mark_partition(
+            release, *partition, stats["indexed"], stats["failed"]
+        )
+    else:
+        publish_release(names, data_version, versioned, keep_generations)
+
+
+def main(report=None, prom_file=None, **kwargs):
+    success = False
+    try:
+        replay_release(**kwargs)
+        success = True
+    finally:
+        write_metrics(
+            report, prom_file, success, export_dir=str(kwargs["export_dir"])
+        )
+
+
+if __name__ == "__main__":
+    main(**vars(get_parser().parse_args()))
@@ -0,0 +1,261 @@
+import os
+import sys
+import json
+import time
+import zipfile
+import argparse
+import tempfile
+
+from pathlib import Path
+from functools import partial
+from pyspark.sql import functions as F
+from pyspark.sql.types import ArrayType, StringType
+
+sys.path.append(os.path.dirname(__file__))
+from es.spark_connector import get_session  # noqa: E402
+from es.es_connector import get_connection  # noqa: E402
+from es.indexing import init_index, index_names, index_profiles  # noqa: E402
+from preprocessing.CSVProcessor import CSVProcessor  # noqa: E402
+from preprocessing.metadata_reader import MetadataReader  # noqa: E402
+from process_cord import (  # noqa: E402
+    get_json_files,
+    process_group,
+    to_action,
+    parse_data_version,
+    save_data_version,
+)
+
+
+csv_processor = CSVProcessor()
+fixed_dates = {}
+ID_FIELD = "doc_id"
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Index cord19 with spark, through elasticsearch-hadoop"
+    )
+    parser.add_argument(
+        "-m", "--metadata", type=str, default=None,
+        help="Metadata file to use (instead of `<data_dir>/metatadata.csv`"
+    )
+    parser.add_argument(
+        "-d", "--data_dir", type=str, required=True,
+        help="Directory containing cord19 data, reachable from every "
+        "spark executor"
+    )
+    parser.add_argument(
+        "-a", "--address", type=str, default="0.0.0.0",
+        help="Elastic search address"
+    )
+    parser.add_argument(
+        "-p", "--port", type=int, default=9200,
+        help="Elastic search port"
+    )
+    parser.add_argument(
+        "-i", "--incl_abs", action="store_true",
+        help="Whether to add abstract field to <papers> and <paragraphs> "
+        "wont create <abstracts> index"
+    )
+    parser.add_argument(
+        "-bs", "--batch_size", type=int, default=500,
+        help="Documents per bulk request of each spark task"
+    )
+    parser.add_argument(
+        "--master", type=str, default="local[*]",
+        help="Spark master (eg: `spark://host:7077`)"
+    )
+    parser.add_argument(
+        "--jar", type=str, default=None,
+        help="elasticsearch-hadoop jar (default: the one in spark_connector)"
+    )
+    parser.add_argument(
+        "--partitions", type=int, default=None,
+        help="Number of partitions papers are grouped into"
+    )
+
+    return parser
+
+
+def fix_date(value):
+    # same as `CSVProcessor.fix_dates`, where pandas reads empty as nan
+    if value is None or value == "":
+        value = "nan"
+    if value not in fixed_dates:
+        fixed_dates[value] = csv_processor.fix_date(value)
+    return fixed_dates[value]
+
+
+def json_files(pmc_json_files, pdf_json_files):
+    return get_json_files({
+        "pmc_json_files": pmc_json_files or "",
+        "pdf_json_files": pdf_json_files or "",
+    })
+
+
+def read_metadata(spark, meta_path):
+    rows = spark.read.csv(
+        str(meta_path), header=True, multiLine=True, escape='"'
+    )
+    rows = rows.select(*[
+        col for col in MetadataReader.columns if col in rows.columns
+    ])
+    # keeps the order of the file, duplicates are ranked by it
+    rows = rows.withColumn("row_id", F.monotonically_increasing_id())
+    rows = rows.withColumn(
+        "publish_time",
+        F.udf(fix_date, StringType())(F.col("publish_time"))
+    )
+    return rows.fillna("")
+
+
+def read_parses(spark, data_dir, rows):
+    """ Json parses referenced by the metadata, by cord_uid.
+
+    Files are named as in the metadata (relative to `data_dir`), pairs of
+    (json_file, json_data) are collected for each cord_uid.
+    """
+    texts = spark.read.text(
+        str(data_dir.joinpath("document_parses", "*", "*.json")),
+        wholetext=True
+    ).select(
+        # <data_dir>/document_parses/<parse type>/<file>.json
+        F.substring_index(F.input_file_name(), "/", -3).alias("json_file"),
+        F.col("value").alias("json_data"),
+    )
+    files_udf = F.udf(json_files, ArrayType(StringType()))
+    needed = rows.select(
+        "cord_uid",
+        F.explode(
+            files_udf(F.col("pmc_json_files"), F.col("pdf_json_files"))
+        ).alias("json_file"),
+    ).distinct()
+
+    return needed.join(texts, "json_file").groupBy("cord_uid").agg(
+        F.collect_list(F.struct("json_file", "json_data")).alias("parses")
+    )
+
+
+def index_group(base_dir, incl_abs, group):
+    """ Documents of a cord_uid, as (index, _id, serialized source) """
+    rows = sorted(group["rows"], key=lambda row: row["row_id"])
+    rows = [
+        {key: value for key, value in row.asDict().items() if key != "row_id"}
+        for row in rows
+    ]
+    parses = {
+        parse["json_file"]: parse["json_data"]
+        for parse in group["parses"] or []
+    }
+    final_row = process_group(Path(base_dir), incl_abs, rows, parses)
+    if final_row is None:
+        return
+
+    for value in final_row.values():
+        for doc in value:
+            action = to_action(doc)
+            yield action["_index"], action["_id"], action["_source"]
+
+
+def process_metadata(spark, data_dir, meta_path, incl_abs, partitions=None):
+    rows = read_metadata(spark, meta_path)
+    parses = read_parses(spark, data_dir, rows)
+    groups = rows.groupBy("cord_uid").agg(
+        F.collect_list(F.struct(*rows.columns)).alias("rows")
+    ).join(parses, "cord_uid", "left")
+    if partitions is not None:
+        groups = groups.repartition(partitions)
+
+    return groups.rdd.flatMap(
+        partial(index_group, str(data_dir), incl_abs)
+    )
+
+
+def with_id(doc):
+    # es-hadoop takes the _id from a field of the document, left out of
+    # what is indexed
+    _, doc_id, source = doc
+    return "key", dict(json.loads(source), **{ID_FIELD: doc_id})
+
+
+def save_to_es(docs, index, address, port, batch_size):
+    # same _id as `process_cord`, so indexing a release again (with either)
+    # overwrites its documents
+    es_conf = {
+        "es.nodes": address,
+        "es.port": str(port),
+        "es.nodes.wan.only": "true",
+        "es.resource": index,
+        "es.mapping.id": ID_FIELD,
+        "es.mapping.exclude": ID_FIELD,
+        "es.batch.size.entries": str(batch_size),
+    }
+    docs.filter(lambda doc: doc[0] == index).map(
+        with_id
+    ).saveAsNewAPIHadoopFile(
+        path="-",
+        outputFormatClass="org.elasticsearch.hadoop.mr.EsOutputFormat",
+        keyClass="org.apache.hadoop.io.NullWritable",
+        valueClass="org.elasticsearch.hadoop.mr.LinkedMapWritable",
+        conf=es_conf,
+    )
+
+
+def add_sources(spark):
+    # ship this package to the executors, the documents are built with the
+    # same code as `process_cord`
+    src_dir = Path(os.path.dirname(os.path.abspath(__file__)))
+    zip_path = Path(tempfile.mkdtemp()).joinpath("indexing.zip")
+    with zipfile.ZipFile(zip_path, "w") as zip_file:
+        for path in src_dir.rglob("*.py"):
+            if path.parent != src_dir:
+                # `es` and `preprocessing` have no __init__, they are only
+                # found as namespace packages with their directory entries
+                zip_file.write(path.parent, path.parent.relative_to(src_dir))
+            zip_file.write(path, path.relative_to(src_dir))
+    spark.sparkContext.addPyFile(str(zip_path))
+
+
+def main(
+    metadata, data_dir, address, port, incl_abs, batch_size,
+    master="local[*]", jar=None, partitions=None
+):
+    get_connection(address, port)
+    data_dir = Path(data_dir).absolute()
+    data_version = parse_data_version(data_dir.name)
+    if metadata is None:
+        metadata = data_dir.joinpath("metadata.csv")
+
+    # mappings are created up front, es-hadoop would guess them
+    names = index_names(incl_abs)
+    init_index(
+        incl_abs, index_profiles(len(MetadataReader(metadata)), incl_abs)
+    )
+
+    spark_config = dict(master=master)
+    if jar is not None:
+        spark_config["jar"] = jar
+    spark = get_session(spark_config, dict(addr=address, port=port))
+    add_sources(spark)
+
+    start = time.time()
+    print(f"Processing metadata from: {metadata}")
+    docs = process_metadata(spark, data_dir, metadata, incl_abs, partitions)
+    docs.persist()
+    counts = docs.map(lambda doc: (doc[0], 1)).countByKey()
+    for index in names.keys():
+        print(f"Indexing {counts.get(index, 0)} documents into {index}")
+        save_to_es(docs, index, address, port, batch_size)
+
+    docs.unpersist()
+    spark.stop()
+    print(f"Indexed in {time.time() - start:.1f}s")
+
+    if data_version is None:
+        print("Warning: Unable to get data version!\nNot saving to database")
+    else:
+        save_data_version(data_version)
+
+
+if __name__ == "__main__":
+    main(**vars(get_parser().parse_args()))
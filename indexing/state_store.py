@@ -0,0 +1,86 @@
+import sqlite3
+
+
+class StateStore:
+    """ Local SQLite record of what is currently indexed.
+
+    Maps each cord_uid to the content hash it had when it was indexed, so
+    the next release only needs to send new or changed papers. Settings
+    that change the indexed documents (eg: incl_abs) are stored too, when
+    they differ from the previous run the whole state is discarded.
+    """
+
+    def __init__(self, path, settings=None):
+        self.path = str(path)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS papers "
+            "(cord_uid TEXT PRIMARY KEY, hash TEXT NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS settings "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        self.conn.commit()
+        self.pending = None
+        if settings is not None:
+            self.check_settings(settings)
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM papers").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    def check_settings(self, settings):
+        settings = {key: str(value) for key, value in settings.items()}
+        stored = dict(self.conn.execute("SELECT key, value FROM settings"))
+        if len(stored) and stored != settings:
+            print("Indexing settings changed, discarding incremental state")
+            self.reset()
+
+        with self.conn:
+            self.conn.execute("DELETE FROM settings")
+            self.conn.executemany(
+                "INSERT INTO settings VALUES (?, ?)", settings.items()
+            )
+
+    def reset(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM papers")
+
+    def hashes(self):
+        return dict(self.conn.execute("SELECT cord_uid, hash FROM papers"))
+
+    def diff(self, hashes):
+        """ Compare the hashes of a release against the stored ones.
+
+        Returns the set of new or changed cord_uids and the set of removed
+        ones. The given hashes are kept until `commit` is called.
+        """
+        stored = self.hashes()
+        update = {
+            cord_uid for cord_uid, digest in hashes.items()
+            if stored.get(cord_uid) != digest
+        }
+        removed = set(stored.keys()) - set(hashes.keys())
+        self.pending = hashes
+        return update, removed
+
+    def commit(self, skip=()):
+        """ Store the last diffed hashes, once they are safely indexed.
+
+        The papers in `skip` (eg: with rejected documents) are left out, so
+        the next run indexes them again.
+        """
+        if self.pending is None:
+            return
+
+        skip = set(skip)
+        with self.conn:
+            self.conn.execute("DELETE FROM papers")
+            self.conn.executemany(
+                "INSERT INTO papers VALUES (?, ?)",
+                (item for item in self.pending.items() if item[0] not in skip)
+            )
+        self.pending = None
@@ -0,0 +1,123 @@
+import os
+import sys
+import json
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "indexing"))
+import process_cord  # noqa: E402
+
+
+def row(uid, abstract, *json_files, title="covid title"):
+    return {
+        "cord_uid": uid,
+        "title": title,
+        "abstract": abstract,
+        "publish_time": "2020-03-15",
+        "url": f"https://example.org/{uid}",
+        "journal": "Journal",
+        "authors": "Doe, J.",
+        "pdf_json_files": "; ".join(json_files),
+    }
+
+
+def parse(*paragraphs):
+    return json.dumps({
+        "body_text": [{"text": text} for text in paragraphs]
+    }).encode()
+
+
+PARSES = {
+    "a.json": parse("covid treatment", "other paragraph"),
+    # same length as a.json, one more keyword paragraph
+    "b.json": parse("covid treatment", "covid paragraph"),
+    "long.json": parse("covid treatment " * 20, "other paragraph"),
+    "plain.json": parse("nothing matches here"),
+    "empty.json": parse("", "  "),
+}
+
+# duplicates of a cord_uid, each group in metadata order
+GROUPS = [
+    # ties: same key, the first row wins
+    [row("tie", "covid abstract one"), row("tie", "covid abstract two")],
+    [
+        row("tie_parsed", "covid abstract", "a.json"),
+        row("tie_parsed", "covid abstract", "a.json", title="covid other"),
+    ],
+    # same body length, more paragraphs
+    [row("pars", "covid", "a.json"), row("pars", "covid", "b.json")],
+    # longer body
+    [
+        row("body", "covid", "a.json"),
+        row("body", "covid", "long.json"),
+        row("body", "covid", "plain.json"),
+    ],
+    # dominated: a longer abstract wins whatever the parses
+    [
+        row("dominated", "covid", "long.json"),
+        row("dominated", "covid with a much longer abstract than the rest"),
+        row("dominated", "covid", "b.json", "a.json"),
+    ],
+    # no keyword in the metadata, only in some parses
+    [
+        row("kw", "no match", "plain.json", title="title"),
+        row("kw", "no match", "b.json", title="title"),
+        row("kw", "no match", "empty.json", title="title"),
+    ],
+    # missing and empty parses
+    [
+        row("missing", "covid", "missing.json"),
+        row("missing", "covid", "empty.json", "a.json"),
+        row("missing", "covid"),
+    ],
+]
+
+
+def fold(base_dir, incl_abs, rows, parses):
+    # how duplicates were picked before `process_group`: every row is
+    # processed and `deduplicate` folded over them
+    row_data = [
+        process_cord.process_paper(base_dir, incl_abs, r, parses)
+        for r in rows
+    ]
+    final_row = row_data[0]
+    for data in row_data[1:]:
+        final_row = process_cord.deduplicate(final_row, data, incl_abs)
+    return final_row
+
+
+def actions(row_data):
+    return {
+        key: [process_cord.to_action(doc) for doc in docs]
+        for key, docs in row_data.items() if len(docs)
+    }
+
+
+@pytest.mark.parametrize("incl_abs", [False, True])
+@pytest.mark.parametrize("streamed", [False, True])
+def test_process_group_matches_fold(tmp_path, incl_abs, streamed):
+    # parses from a tarball (in memory) or from files (sized on disk)
+    parses = PARSES if streamed else None
+    if not streamed:
+        for name, data in PARSES.items():
+            tmp_path.joinpath(name).write_bytes(data)
+
+    for rows in GROUPS:
+        expected = fold(tmp_path, incl_abs, rows, parses)
+        actual = process_cord.process_group(tmp_path, incl_abs, rows, parses)
+        assert actions(actual) == actions(expected), rows[0]["cord_uid"]
+
+
+@pytest.mark.parametrize("incl_abs", [False, True])
+def test_dominated_rows_are_not_parsed(incl_abs):
+    # the metadata keyword match makes the abstract length exact, the rows
+    # with shorter abstracts can not catch up
+    rows = GROUPS[4]
+    bounds = [
+        process_cord.dedup_bounds(None, incl_abs, r, PARSES) for r in rows
+    ]
+    dominated = [process_cord.is_dominated(bounds, j) for j in range(3)]
+    assert dominated == [True, False, True]
+    stats = {"json_parses_saved": 0}
+    process_cord.process_group(None, incl_abs, rows, PARSES, stats)
+    assert stats["json_parses_saved"] == 2
@@ -0,0 +1,70 @@
+import os
+import sys
+import random
+import hashlib
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from downloader import MB, verify_file  # noqa: E402
+
+
+def write_file(tmp_path, size, seed=0):
+    path = tmp_path.joinpath("cord-19.tar.gz")
+    path.write_bytes(random.Random(seed).randbytes(size))
+    return path
+
+
+def multipart_etag(data, part_size):
+    # as s3 computes it for a multipart upload
+    parts = [
+        hashlib.md5(data[start:start + part_size]).digest()
+        for start in range(0, len(data), part_size)
+    ]
+    return f"{hashlib.md5(b''.join(parts)).hexdigest()}-{len(parts)}"
+
+
+def corrupt(path):
+    data = bytearray(path.read_bytes())
+    data[len(data) // 2] ^= 0xFF
+    path.write_bytes(bytes(data))
+
+
+def test_single_part_etag(tmp_path):
+    path = write_file(tmp_path, 3 * MB + 123)
+    etag = hashlib.md5(path.read_bytes()).hexdigest()
+    verify_file(path, 3 * MB + 123, etag)
+
+    corrupt(path)
+    with pytest.raises(RuntimeError, match="md5"):
+        verify_file(path, 3 * MB + 123, etag)
+    with pytest.raises(RuntimeError, match="bytes"):
+        verify_file(path, 3 * MB, etag)
+
+
+def test_multipart_whole_mib(tmp_path, capsys):
+    path = write_file(tmp_path, 7 * MB + 5)
+    etag = multipart_etag(path.read_bytes(), 2 * MB)
+    verify_file(path, 7 * MB + 5, etag)
+    verify_file(path, 7 * MB + 5, etag, etag_part_size=2 * MB)
+    assert capsys.readouterr().out == ""
+
+
+def test_multipart_mismatch(tmp_path, capsys):
+    path = write_file(tmp_path, 7 * MB + 5)
+    etag = multipart_etag(path.read_bytes(), 2 * MB)
+    corrupt(path)
+    # reported, the part size may just not be a whole MiB
+    verify_file(path, 7 * MB + 5, etag)
+    assert "can not verify etag" in capsys.readouterr().out
+    with pytest.raises(RuntimeError, match="multipart etag"):
+        verify_file(path, 7 * MB + 5, etag, etag_part_size=2 * MB)
+
+
+def test_multipart_not_whole_mib(tmp_path, capsys):
+    # an intact file is never rejected for its part size
+    path = write_file(tmp_path, 7 * MB + 5)
+    etag = multipart_etag(path.read_bytes(), 3 * MB // 2)
+    verify_file(path, 7 * MB + 5, etag)
+    assert "can not verify etag" in capsys.readouterr().out
+    verify_file(path, 7 * MB + 5, etag, etag_part_size=3 * MB // 2)
@@ -0,0 +1,71 @@
+import os
+import sys
+import pandas as pd
+
+sys.path.append(
+    os.path.join(os.path.dirname(__file__), "..", "indexing", "preprocessing")
+)
+from CSVProcessor import CSVProcessor  # noqa: E402
+
+
+# publish_time formats found in cord19 releases, repeated and missing
+SAMPLE = [
+    "2020-03-15",
+    "2020-12-31",
+    "2019",
+    "2020",
+    "2020 Mar",
+    "2020 Mar 15",
+    "2019 Dec 1",
+    "2020 Spring",
+    "2020 Summer",
+    "2020 Autumn",
+    "2020 Fall",
+    "2020 Winter",
+    "2020 Jan-Feb",
+    "2021 Nov-Dec",
+    "['2020-01-02', '2020-02-01']",
+    "['2021-05-17']",
+    float("nan"),
+    None,
+    "2020-03-15",
+    "2020 Mar",
+    float("nan"),
+]
+
+
+def per_row_fix_dates(df, csv_processor):
+    # how `publish_time` was fixed before `fix_dates`
+    return df.apply(
+        lambda row: csv_processor.fix_date(row["publish_time"]),
+        axis=1
+    )
+
+
+def sample_metadata():
+    return pd.DataFrame({
+        "cord_uid": [f"uid{i}" for i in range(len(SAMPLE))],
+        "publish_time": SAMPLE,
+    })
+
+
+def test_fix_dates_matches_per_row():
+    csv_processor = CSVProcessor()
+    df = sample_metadata()
+    expected = per_row_fix_dates(df, csv_processor)
+    fixed = csv_processor.fix_dates(df["publish_time"])
+    assert fixed.tolist() == expected.tolist()
+    assert fixed.index.equals(df.index)
+
+
+def test_fix_dates_of_chunks_sharing_a_cache():
+    csv_processor = CSVProcessor()
+    df = sample_metadata()
+    expected = per_row_fix_dates(df, csv_processor).tolist()
+    cache = {}
+    fixed = []
+    for start in range(0, len(df), 5):
+        chunk = df.iloc[start:start + 5]
+        fixed.extend(csv_processor.fix_dates(chunk["publish_time"], cache))
+    assert fixed == expected
+    assert len(cache) == len(set(df["publish_time"].fillna("nan")))